@@ -1,8 +1,11 @@
-import cv2
+from __future__ import annotations
+
 import os
-import numpy as np
+import abc
 import asyncio
-import psutil
+import bisect
+import hashlib
+import importlib
 import threading
 import concurrent.futures
 from typing import List, Dict, Optional, Tuple, Union, Callable, Awaitable
@@ -10,21 +13,89 @@ import time
 from datetime import datetime
 import logging
 import json
-from collections import deque
+import mmap
+from collections import deque, OrderedDict
 import gc
+import random
+import shutil
+import struct
+import sys
 import weakref
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+try:
+    import orjson  # 可选：更快的JSON编码器
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl  # 仅类Unix系统，用于reflink
+except ImportError:
+    fcntl = None
+
+# 日志：只获取logger，不在导入时配置根日志（由入口脚本调用 logging.basicConfig）
 logger = logging.getLogger(__name__)
 
-# 确保OpenCV使用CPU后端，优化CPU性能
-cv2.setUseOptimized(True)
-cv2.setNumThreads(0)
+# =============================================================================
+# 延迟导入
+# =============================================================================
+
+class _LazyModule:
+    """模块代理：首次访问属性时才导入真实模块
+
+    cv2/numpy/psutil 导入耗时数百毫秒，只需要文件探测、结果解析或打包读取的
+    命令行工具和短生命周期进程不必为此付出代价。
+    before_load 在导入前执行（如设置OpenCV环境变量），on_load 在导入后执行一次全局配置。
+    """
+    
+    def __init__(self, name: str, on_load: Callable = None, before_load: Callable = None):
+        self._name = name
+        self._on_load = on_load
+        self._before_load = before_load
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    if self._before_load:
+                        self._before_load()
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+    
+    @property
+    def loaded(self) -> bool:
+        """真实模块是否已导入"""
+        return self._module is not None
+    
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def _before_cv2_import():
+    # 无头环境配置（需在导入OpenCV前设置才生效）
+    os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '0')
+    os.environ.setdefault('OPENCV_IO_ENABLE_JASPER', '0')
+
+def _configure_cv2(module):
+    # 确保OpenCV使用CPU后端，优化CPU性能
+    module.setUseOptimized(True)
+    module.setNumThreads(0)
+
+cv2 = _LazyModule('cv2', on_load=_configure_cv2, before_load=_before_cv2_import)
+np = _LazyModule('numpy')
+psutil = _LazyModule('psutil')
 
-# 无头环境配置
-os.environ['OPENCV_IO_ENABLE_OPENEXR'] = '0'
-os.environ['OPENCV_IO_ENABLE_JASPER'] = '0'
+def preload_modules():
+    """立即导入所有延迟模块（预派生工作进程的父进程在fork前调用，子进程共享已加载的模块）"""
+    for module in (cv2, np, psutil):
+        module._load()
 
 # =============================================================================
 # 设备性能检测模块
@@ -118,7 +189,8 @@ class DevicePerformanceDetector:
         }
         return configs.get(performance_level, configs["low"])
     
-    def _get_default_profile(self) -> Dict[str, any]:
+    @staticmethod
+    def _get_default_profile() -> Dict[str, any]:
         """获取默认性能档案"""
         return {
             'cpu_cores_physical': 4,
@@ -246,10 +318,1343 @@ class AsyncFrameExtractorConfig:
     MEMORY_CLEANUP_INTERVAL = 1000
     COMPARE_FRAME_SIZE = (160, 90)
     
+    # 视频指纹去重配置
+    DEFAULT_DEDUP_MODE = 'off'            # off / skip / reuse
+    FINGERPRINT_SAMPLE_COUNT = 8          # 每个视频采样的帧数
+    FINGERPRINT_MATCH_DISTANCE = 10       # dHash 汉明距离不超过该值视为同一画面
+    FINGERPRINT_MATCH_RATIO = 0.75        # 较短视频中匹配帧比例达到该值视为重复
+    FINGERPRINT_MIN_DURATION_RATIO = 0.5  # 时长比例低于该值不视为裁剪副本
+    FINGERPRINT_INDEX_FILENAME = 'fingerprint_index.json'
+    FINGERPRINT_INDEX_MAX_ENTRIES = 1000
+    FINGERPRINT_INDEX_TTL_SECONDS = 7 * 24 * 3600
+    
+    # 跨文件帧去重配置
+    DEFAULT_CROSS_FILE_DEDUP = True
+    FRAME_DEDUP_HAMMING_RADIUS = 5        # 与任务内已保留帧的dHash距离不超过该值则丢弃
+    
+    # 运动自适应采样配置
+    DEFAULT_SAMPLING_MODE = 'uniform'     # uniform / adaptive
+    MOTION_PROXY_SIZE = (64, 36)          # 运动估计用的低分辨率灰度代理帧
+    MOTION_TARGET_DIFF = 6.0              # 相邻采样点代理帧平均灰度差的目标值
+    MOTION_SMOOTHING = 0.5                # 运动量指数平滑系数
+    ADAPTIVE_MIN_STRIDE_FACTOR = 0.25     # 步长下限 = 基础步长 × 该值
+    ADAPTIVE_MAX_STRIDE_FACTOR = 4.0      # 步长上限 = 基础步长 × 该值
+    SEEK_MIN_GAP_SECONDS = 2.0            # 距下一个采样帧超过该时长时直接定位，不再逐帧 grab（0 表示不定位）
+    
+    # 任务目录布局与图片直通配置
+    TASK_INPUT_SUBDIR = 'inputs'          # 上传文件直接保存在 <任务目录>/inputs
+    DEFAULT_IMAGE_PASSTHROUGH = True      # 已满足要求的JPEG直接链接，不重新编码
+    PASSTHROUGH_QUALITY_TOLERANCE = 5     # 源JPEG估算质量不低于 目标质量-该值 时可直通
+    
+    # 文件探测缓存配置
+    PROBE_CACHE_MAX_ENTRIES = 4096
+    
+    # 预扫描时间线配置
+    DEFAULT_PRESCAN = False
+    PRESCAN_SAMPLES_PER_SECOND = 4        # 预扫描每秒取样数
+    PRESCAN_PROXY_SIZE = (160, 90)        # 预扫描代理帧尺寸
+    PRESCAN_CUT_THRESHOLD = 30.0          # 相邻样本平均灰度差超过该值视为场景切换
+    TIMELINE_CACHE_SUBDIR = '.timelines'  # 位于输出根目录下，按源文件内容键命名，跨任务复用
+    TIMELINE_CACHE_MAX_ENTRIES = 2000
+    TIMELINE_VERSION = 2
+    CONTENT_KEY_CHUNK_BYTES = 1024 * 1024 # 内容键读取的首、中、尾数据块大小
+    
+    # 多尺寸输出配置：{档位名: (最大宽, 最大高)}，从已解码帧逐级缩小生成
+    DEFAULT_OUTPUT_TIERS = None
+    OUTPUT_TIER_PRESET = {'preview': (1280, 720), 'thumbnail': (320, 180)}
+    
+    # 帧编码配置
+    DEFAULT_ENCODE_FORMAT = 'jpeg'        # jpeg / webp
+    ENCODE_MIN_QUALITY = 40               # 字节预算模式下的最低质量
+    ENCODE_SEARCH_MAX_ATTEMPTS = 5        # 每帧质量搜索的最多编码次数
+    ENCODE_BUDGET_TOLERANCE = 0.1         # 结果不低于预算×(1-该值)即停止搜索
+    ENCODE_BASELINE_SAMPLE_INTERVAL = 10  # 每隔多少帧按固定质量抽样编码一次，用于估算节省字节
+    
+    # 打包输出配置
+    DEFAULT_OUTPUT_FORMAT = 'files'       # files（每帧一个JPEG）/ packed（每任务一个容器文件）
+    FRAME_PACK_INDEX_SUFFIX = '.index.json'
+    
+    # 结果输出配置
+    DEFAULT_RESULT_FORMAT = 'json'        # json / ndjson（帧记录逐行写入单独文件）
+    
+    # 雪碧图（缩略图拼图）配置：抽帧时从已解码帧生成缩略图，任务结束后拼成网格
+    DEFAULT_SPRITE_SHEET = False
+    SPRITE_TILE_SIZE = (160, 90)          # 单个格子 (宽, 高)，缩略图等比缩放后居中
+    SPRITE_COLUMNS = 10
+    SPRITE_MAX_TILES_PER_SHEET = 100      # 每张拼图最多格子数，超出时生成多张
+    SPRITE_QUALITY = 80
+    SPRITE_MAP_VERSION = 1
+    
+    # 按需派生图（缩放/裁剪）磁盘缓存配置
+    DERIVATIVE_CACHE_SUBDIR = '.derived'  # 位于输出根目录下
+    DERIVATIVE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    DERIVATIVE_MIN_WIDTH = 16
+    DERIVATIVE_MAX_WIDTH = 4096
+    DERIVATIVE_QUALITY = 85
+    
+    # 启动开销预算（全新解释器中测量，见 async_frame_extractor_benchmark.py --startup）
+    IMPORT_TIME_BUDGET_MS = 150           # 导入本模块，含asyncio等标准库；cv2/numpy/psutil 延迟到首次使用
+    CONSTRUCT_TIME_BUDGET_MS = 10         # 构造抽帧器；性能探测和线程池在首个任务时才创建
+    
     # 文件大小单位
     BYTES_TO_KB = 1024
     BYTES_TO_MB = 1024 * 1024
 
+# =============================================================================
+# 协作式任务取消
+# =============================================================================
+
+class TaskCancelledError(Exception):
+    """任务已被取消"""
+
+
+class CancellationToken:
+    """协作式取消令牌
+    
+    由调用方（如上传API的取消接口）在任意线程调用 cancel()，
+    抽帧循环、排队中的文件和批处理调度在各自检查点读取状态后尽快退出。
+    cleanup=False 时只停止处理、不删除已写出的输出（如工作进程的租约已被其他进程接管，
+    任务目录归新的持有者）；任何情况下抽帧器都不删除任务目录下的上传文件。
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+        self.cleanup = True
+    
+    def cancel(self, reason: str = "任务已取消", cleanup: bool = True):
+        """请求取消"""
+        self.reason = reason
+        self.cleanup = cleanup
+        self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        """是否已请求取消"""
+        return self._event.is_set()
+    
+    def raise_if_cancelled(self):
+        """已取消时抛出 TaskCancelledError"""
+        if self._event.is_set():
+            raise TaskCancelledError(self.reason or "任务已取消")
+
+# =============================================================================
+# 阶段计时与计数
+# =============================================================================
+
+class ExtractionMetrics:
+    """抽帧阶段计时与计数
+    
+    每个文件在自己的工作线程里独占一个实例，热路径上只做浮点累加，
+    文件完成后再在事件循环上合并到任务级实例。
+    """
+    
+    STAGES = ('open_probe', 'prescan', 'decode', 'resize', 'motion_estimation', 'scoring', 'scene_detection',
+              'hash_lookup', 'jpeg_encode', 'disk_write', 'rename')
+    COUNTERS = ('frames_read', 'frames_sampled', 'rejected_sharpness', 'rejected_similarity',
+                'rejected_duplicate', 'frames_written', 'frames_linked', 'bytes_written',
+                'encode_attempts', 'bytes_saved', 'seeks')
+    
+    def __init__(self):
+        self.stage_seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+    
+    def add_time(self, stage: str, seconds: float):
+        """累加阶段耗时"""
+        self.stage_seconds[stage] += seconds
+    
+    def incr(self, counter: str, value: int = 1):
+        """累加计数"""
+        self.counters[counter] += value
+    
+    def merge(self, other: Union['ExtractionMetrics', Dict[str, Dict]]):
+        """合并另一个实例（或其 to_dict() 结果）"""
+        if isinstance(other, ExtractionMetrics):
+            other = other.to_dict()
+        for stage, seconds in other.get('stage_seconds', {}).items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        for counter, value in other.get('counters', {}).items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+    
+    def to_dict(self) -> Dict[str, Dict]:
+        """导出为可JSON序列化的字典"""
+        return {
+            'stage_seconds': {stage: round(seconds, 4) for stage, seconds in self.stage_seconds.items()},
+            'counters': dict(self.counters)
+        }
+
+
+class MetricsSink(abc.ABC):
+    """指标导出接口，任务完成后收到任务级指标"""
+    
+    @abc.abstractmethod
+    def export(self, task_id: str, metrics: Dict[str, Dict]):
+        """导出一个任务的指标"""
+
+
+class LogMetricsSink(MetricsSink):
+    """以单行日志输出任务指标"""
+    
+    def export(self, task_id: str, metrics: Dict[str, Dict]):
+        stages = ' '.join(f"{stage}={seconds:.3f}s" for stage, seconds in metrics['stage_seconds'].items())
+        counters = ' '.join(f"{name}={value}" for name, value in metrics['counters'].items())
+        logger.info(f"📈 任务指标 task={task_id} {stages} {counters}")
+
+
+class PrometheusTextMetricsSink(MetricsSink):
+    """累计进程内所有任务的指标，按Prometheus文本格式输出
+    
+    指定 textfile_path 时每次导出后原子写入该文件，供 node_exporter 的
+    textfile collector 采集。
+    """
+    
+    def __init__(self, textfile_path: str = None, prefix: str = "frameweavers_extractor"):
+        self.textfile_path = textfile_path
+        self.prefix = prefix
+        self.totals = ExtractionMetrics()
+        self.tasks_total = 0
+        self._lock = threading.Lock()
+    
+    def export(self, task_id: str, metrics: Dict[str, Dict]):
+        with self._lock:
+            self.totals.merge(metrics)
+            self.tasks_total += 1
+            text = self._render_locked()
+        
+        if self.textfile_path:
+            tmp_path = f"{self.textfile_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.textfile_path)
+    
+    def render(self) -> str:
+        """渲染当前累计值"""
+        with self._lock:
+            return self._render_locked()
+    
+    def _render_locked(self) -> str:
+        lines = [
+            f"# HELP {self.prefix}_tasks_total Completed extraction tasks",
+            f"# TYPE {self.prefix}_tasks_total counter",
+            f"{self.prefix}_tasks_total {self.tasks_total}",
+            f"# HELP {self.prefix}_stage_seconds_total Time spent per extraction stage",
+            f"# TYPE {self.prefix}_stage_seconds_total counter"
+        ]
+        for stage, seconds in self.totals.stage_seconds.items():
+            lines.append(f'{self.prefix}_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+        lines.append(f"# HELP {self.prefix}_events_total Frame and byte counters")
+        lines.append(f"# TYPE {self.prefix}_events_total counter")
+        for counter, value in self.totals.counters.items():
+            lines.append(f'{self.prefix}_events_total{{counter="{counter}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+# =============================================================================
+# 帧记录与结果序列化
+# =============================================================================
+
+class FrameRecord:
+    """单帧元数据记录，使用 __slots__ 代替嵌套字典以降低大批量任务的内存和序列化开销。
+    
+    内部从抽帧、排序到重命名都使用该记录，只在 format_output 等 API 边界转换为字典；
+    同时保留 record['path'] 形式的只读访问以兼容旧调用方。
+    """
+    
+    __slots__ = ('path', 'filename', 'frame_number', 'timestamp', 'extracted_index',
+                 'source_type', 'source_file', 'sharpness', 'brightness', 'contrast',
+                 'quality_score', 'size_bytes', 'pack_offset', 'pack_length', 'tiers')
+    
+    METRIC_FIELDS = ('sharpness', 'brightness', 'contrast', 'quality_score')
+    
+    def __init__(self, path: str, filename: str, frame_number: int = 0, timestamp: float = 0.0,
+                 extracted_index: int = 0, source_type: str = 'unknown', source_file: str = 'unknown',
+                 quality_metrics: Dict[str, float] = None, size_bytes: int = 0):
+        self.path = path
+        self.filename = filename
+        self.frame_number = int(frame_number)
+        self.timestamp = float(timestamp)
+        self.extracted_index = int(extracted_index)
+        self.source_type = source_type
+        self.source_file = source_file
+        self.size_bytes = int(size_bytes)
+        self.pack_offset = -1
+        self.pack_length = 0
+        # 多尺寸输出：{档位名: {'path', 'size_bytes', 'width', 'height'}}，未开启时为None
+        self.tiers = None
+        quality_metrics = quality_metrics or {}
+        for field in self.METRIC_FIELDS:
+            setattr(self, field, float(quality_metrics.get(field, 0.0)))
+    
+    @property
+    def quality_metrics(self) -> Dict[str, float]:
+        return {field: getattr(self, field) for field in self.METRIC_FIELDS}
+    
+    @property
+    def total_size_bytes(self) -> int:
+        return self.size_bytes + sum(tier['size_bytes'] for tier in (self.tiers or {}).values())
+    
+    def all_paths(self) -> List[str]:
+        """主帧及各尺寸档位的路径"""
+        return [self.path] + [tier['path'] for tier in (self.tiers or {}).values()]
+    
+    def __getitem__(self, key: str):
+        if key in self.__slots__ or key == 'quality_metrics':
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def to_dict(self) -> Dict[str, any]:
+        """完整精度的字典（用于指纹索引持久化）"""
+        return {
+            'path': self.path,
+            'filename': self.filename,
+            'frame_number': self.frame_number,
+            'timestamp': self.timestamp,
+            'extracted_index': self.extracted_index,
+            'source_type': self.source_type,
+            'source_file': self.source_file,
+            'size_bytes': self.size_bytes,
+            'quality_metrics': self.quality_metrics,
+            **({'tiers': self.tiers} if self.tiers else {})
+        }
+    
+    def to_output_dict(self) -> Dict[str, any]:
+        """API 输出格式的字典（base_frame_paths 的元素）"""
+        output = {
+            'file_path': self.path,
+            'filename': self.filename,
+            'source_type': self.source_type,
+            'source_file': self.source_file,
+            'extracted_index': self.extracted_index,
+            'timestamp': self.timestamp,
+            'quality_metrics': {field: round(getattr(self, field), 2) for field in self.METRIC_FIELDS}
+        }
+        if self.pack_offset >= 0:
+            output['pack_offset'] = self.pack_offset
+            output['pack_length'] = self.pack_length
+        if self.tiers:
+            output['tiers'] = {
+                name: {('file_path' if key == 'path' else key): value for key, value in tier.items()}
+                for name, tier in self.tiers.items()
+            }
+        return output
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, any]) -> 'FrameRecord':
+        record = cls(
+            path=data['path'],
+            filename=data.get('filename', os.path.basename(data['path'])),
+            frame_number=data.get('frame_number', 0),
+            timestamp=data.get('timestamp', 0.0),
+            extracted_index=data.get('extracted_index', 0),
+            source_type=data.get('source_type', 'unknown'),
+            source_file=data.get('source_file', 'unknown'),
+            quality_metrics=data.get('quality_metrics'),
+            size_bytes=data.get('size_bytes', 0)
+        )
+        record.tiers = data.get('tiers')
+        return record
+
+
+def dumps_json(obj, compact: bool = False) -> bytes:
+    """序列化为UTF-8字节；compact 时优先使用 orjson，不缩进"""
+    if compact and orjson is not None:
+        return orjson.dumps(obj, default=str)
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+
+
+class FrameRecordStream:
+    """线程安全的NDJSON帧记录流，帧写盘后立即追加一行，读者可在任务进行中增量读取"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+    
+    def write(self, record: FrameRecord):
+        line = dumps_json(record.to_dict(), compact=True) + b'\n'
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._file.flush()
+    
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class TaskOutput:
+    """单个任务的输出上下文
+    
+    同一个抽帧器实例可以同时处理多个任务（如ASGI服务共享一个抽帧器），
+    任务目录、打包容器、雪碧图收集器等按任务变化的状态放在这里逐层传给抽帧、图片处理和重命名，不写到抽帧器实例上。
+    """
+    
+    __slots__ = ('output_dir', 'frame_pack', 'sprite_builder')
+    
+    def __init__(self, output_dir: str, frame_pack: 'FramePackWriter' = None,
+                 sprite_builder: 'SpriteSheetBuilder' = None):
+        self.output_dir = output_dir
+        self.frame_pack = frame_pack
+        self.sprite_builder = sprite_builder
+
+
+# =============================================================================
+# 帧编码
+# =============================================================================
+
+class FrameEncoder:
+    """帧编码器：固定质量编码，或按每帧字节预算搜索质量
+    
+    预算模式下以上一帧最终采用的质量为起点做二分搜索，相邻帧内容相近时通常一两次编码即可命中；
+    每隔 ENCODE_BASELINE_SAMPLE_INTERVAL 帧额外按固定质量编码一次，用于估算节省的字节数。
+    每个视频/图片各用一个实例，不在线程间共享。
+    """
+    
+    def __init__(self, quality: int = None, encode_format: str = 'jpeg', target_bytes: int = None,
+                 progressive: bool = False, optimize: bool = False):
+        if encode_format not in ('jpeg', 'webp'):
+            raise ValueError(f"不支持的编码格式: {encode_format}")
+        self.quality = quality or AsyncFrameExtractorConfig.DEFAULT_QUALITY
+        self.encode_format = encode_format
+        self.extension = '.webp' if encode_format == 'webp' else '.jpg'
+        self.target_bytes = target_bytes
+        self.progressive = progressive
+        self.optimize = optimize
+        
+        self.frames_encoded = 0
+        self.encode_attempts = 0
+        self.bytes_encoded = 0
+        self._seed_quality = self.quality
+        self._sampled_baseline_bytes = 0
+        self._sampled_final_bytes = 0
+    
+    def for_tiers(self) -> 'FrameEncoder':
+        """尺寸档位使用同样的格式和固定质量（字节预算只针对主帧）"""
+        return FrameEncoder(self.quality, self.encode_format, None, self.progressive, self.optimize)
+    
+    def _params(self, quality: int) -> List[int]:
+        if self.encode_format == 'webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, quality]
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if self.progressive:
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        if self.optimize:
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        return params
+    
+    def _encode_at(self, frame: np.ndarray, quality: int) -> Optional[np.ndarray]:
+        self.encode_attempts += 1
+        ok, buffer = cv2.imencode(self.extension, frame, self._params(quality))
+        return buffer if ok else None
+    
+    def _search(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        low, high = AsyncFrameExtractorConfig.ENCODE_MIN_QUALITY, self.quality
+        quality = min(max(self._seed_quality, low), high)
+        best = best_quality = None
+        smallest = smallest_quality = None
+        
+        for _ in range(AsyncFrameExtractorConfig.ENCODE_SEARCH_MAX_ATTEMPTS):
+            buffer = self._encode_at(frame, quality)
+            if buffer is None:
+                break
+            if buffer.nbytes <= self.target_bytes:
+                best, best_quality = buffer, quality
+                tolerance = AsyncFrameExtractorConfig.ENCODE_BUDGET_TOLERANCE
+                if quality >= high or buffer.nbytes >= self.target_bytes * (1 - tolerance):
+                    break
+                low = quality + 1
+            else:
+                if smallest is None or buffer.nbytes < smallest.nbytes:
+                    smallest, smallest_quality = buffer, quality
+                high = quality - 1
+            if low > high:
+                break
+            quality = (low + high + 1) // 2
+        
+        # 最低质量也超出预算时，使用尝试过的最小结果
+        if best is None:
+            best, best_quality = smallest, smallest_quality
+        if best_quality is not None:
+            self._seed_quality = best_quality
+        return best
+    
+    def encode(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        if not self.target_bytes:
+            buffer = self._encode_at(frame, self.quality)
+        else:
+            buffer = self._search(frame)
+            if buffer is not None and self.frames_encoded % AsyncFrameExtractorConfig.ENCODE_BASELINE_SAMPLE_INTERVAL == 0:
+                baseline = self._encode_at(frame, self.quality)
+                if baseline is not None:
+                    self._sampled_baseline_bytes += baseline.nbytes
+                    self._sampled_final_bytes += buffer.nbytes
+        
+        if buffer is not None:
+            self.frames_encoded += 1
+            self.bytes_encoded += buffer.nbytes
+        return buffer
+    
+    @property
+    def bytes_saved(self) -> int:
+        """相对固定质量编码节省的字节数（按抽样帧的压缩比例估算）"""
+        if not self._sampled_final_bytes:
+            return 0
+        ratio = self._sampled_baseline_bytes / self._sampled_final_bytes
+        return max(0, int(self.bytes_encoded * ratio) - self.bytes_encoded)
+
+
+# =============================================================================
+# 打包帧容器
+# =============================================================================
+
+class FramePackWriter:
+    """任务级打包帧容器：所有帧的JPEG字节顺序追加到一个文件，偏移/长度记入索引，
+    代替每帧一个文件，减少小文件和inode开销。多个工作线程可并发追加。
+    """
+    
+    def __init__(self, pack_path: str):
+        self.pack_path = pack_path
+        self.index_path = pack_path + AsyncFrameExtractorConfig.FRAME_PACK_INDEX_SUFFIX
+        self._lock = threading.Lock()
+        self._file = open(pack_path, 'ab')
+        self._offset = self._file.tell()
+        self._locations = {}  # 写入时的帧路径 -> (offset, length)
+    
+    def append(self, key: str, data) -> Tuple[int, int]:
+        length = memoryview(data).nbytes
+        with self._lock:
+            offset = self._offset
+            self._file.write(data)
+            self._offset += length
+            self._locations[key] = (offset, length)
+        return offset, length
+    
+    def locate(self, key: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            return self._locations.get(key)
+    
+    def write_index(self, records: List[FrameRecord]) -> str:
+        """把最终保留帧的偏移写入索引文件（原子替换）；被淘汰帧的字节留在容器中但不再被引用"""
+        with self._lock:
+            self._file.flush()
+        frames = []
+        for record in records:
+            if record.pack_offset >= 0:
+                frames.append({'filename': record.filename, 'offset': record.pack_offset,
+                               'length': record.pack_length})
+            for tier in (record.tiers or {}).values():
+                if tier.get('pack_offset', -1) >= 0:
+                    frames.append({'filename': os.path.basename(tier['path']), 'offset': tier['pack_offset'],
+                                   'length': tier['pack_length']})
+        index = {
+            'version': 1,
+            'pack': os.path.basename(self.pack_path),
+            'frames': frames
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+        return self.index_path
+    
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class FramePackReader:
+    """只读打开打包帧容器：按文件名通过mmap切片零拷贝读取，或按需导出为普通文件
+    
+    read() 返回的 memoryview 引用映射内存，close() 前需释放。
+    """
+    
+    def __init__(self, index_path: str):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.pack_path = os.path.join(os.path.dirname(index_path), index['pack'])
+        self.frames = {entry['filename']: (entry['offset'], entry['length']) for entry in index['frames']}
+        self._file = open(self.pack_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def locate(self, filename: str) -> Tuple[int, int]:
+        """返回帧在容器文件中的 (offset, length)，可直接用于HTTP Range或sendfile"""
+        return self.frames[filename]
+    
+    def read(self, filename: str) -> memoryview:
+        offset, length = self.frames[filename]
+        return memoryview(self._mmap)[offset:offset + length]
+    
+    def export(self, filename: str, target_path: str) -> str:
+        view = self.read(filename)
+        try:
+            with open(target_path, 'wb') as f:
+                f.write(view)
+        finally:
+            view.release()
+        return target_path
+    
+    def export_all(self, target_dir: str) -> List[str]:
+        """把全部帧导出为独立JPEG文件，供需要真实文件的下游使用"""
+        os.makedirs(target_dir, exist_ok=True)
+        return [self.export(filename, os.path.join(target_dir, filename)) for filename in self.frames]
+    
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+# =============================================================================
+# 雪碧图
+# =============================================================================
+
+class SpriteSheetBuilder:
+    """收集抽帧过程中已解码帧的缩略图，任务结束后按最终帧顺序拼成网格图和坐标表
+    
+    add() 在抽帧线程中调用（多个视频并发），缩略图按帧写出时的路径登记；
+    build() 在重命名后调用，传入重命名前的路径以找到对应缩略图。
+    没有缩略图的帧（如复用历史任务的帧）从磁盘读取后补齐。
+    """
+    
+    def __init__(self, tile_size: Tuple[int, int] = None, columns: int = None, max_tiles_per_sheet: int = None):
+        self.tile_size = tuple(tile_size or AsyncFrameExtractorConfig.SPRITE_TILE_SIZE)
+        self.columns = max(1, columns or AsyncFrameExtractorConfig.SPRITE_COLUMNS)
+        self.max_tiles_per_sheet = max(1, max_tiles_per_sheet or AsyncFrameExtractorConfig.SPRITE_MAX_TILES_PER_SHEET)
+        self._thumbnails = {}
+        self._lock = threading.Lock()
+    
+    def make_thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        """等比缩小到格子内"""
+        tile_width, tile_height = self.tile_size
+        height, width = frame.shape[:2]
+        scale = min(tile_width / width, tile_height / height, 1.0)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if size == (width, height):
+            return frame.copy()
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    
+    def add(self, key: str, frame: np.ndarray):
+        thumbnail = self.make_thumbnail(frame)
+        with self._lock:
+            self._thumbnails[key] = thumbnail
+    
+    def build(self, output_dir: str, name: str, keys: List[str], records: List[FrameRecord],
+              quality: int = None) -> Dict[str, any]:
+        """写出拼图和坐标表，返回坐标表；keys 与 records 一一对应（重命名前的路径）"""
+        tile_width, tile_height = self.tile_size
+        encoder = FrameEncoder(quality or AsyncFrameExtractorConfig.SPRITE_QUALITY)
+        
+        tiles = []
+        for key, record in zip(keys, records):
+            thumbnail = self._thumbnails.get(key)
+            if thumbnail is None and os.path.exists(record.path):
+                image = cv2.imread(record.path)
+                thumbnail = self.make_thumbnail(image) if image is not None else None
+            if thumbnail is not None:
+                tiles.append((record, thumbnail))
+        
+        sheets = []
+        for sheet_index, start in enumerate(range(0, len(tiles), self.max_tiles_per_sheet)):
+            chunk = tiles[start:start + self.max_tiles_per_sheet]
+            columns = min(self.columns, len(chunk))
+            rows = (len(chunk) + columns - 1) // columns
+            canvas = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+            
+            entries = []
+            for position, (record, thumbnail) in enumerate(chunk):
+                height, width = thumbnail.shape[:2]
+                x = (position % columns) * tile_width + (tile_width - width) // 2
+                y = (position // columns) * tile_height + (tile_height - height) // 2
+                canvas[y:y + height, x:x + width] = thumbnail
+                entries.append({'filename': record.filename, 'extracted_index': record.extracted_index,
+                                'x': x, 'y': y, 'w': width, 'h': height})
+            
+            buffer = encoder.encode(canvas)
+            if buffer is None:
+                continue
+            sheet_filename = f"{name}_{sheet_index}{encoder.extension}"
+            sheet_path = os.path.join(output_dir, sheet_filename)
+            with open(sheet_path, 'wb') as f:
+                f.write(buffer.tobytes())
+            sheets.append({'filename': sheet_filename, 'path': sheet_path, 'width': canvas.shape[1],
+                           'height': canvas.shape[0], 'tiles': entries})
+        
+        sprite_map = {
+            'version': AsyncFrameExtractorConfig.SPRITE_MAP_VERSION,
+            'tile_width': tile_width,
+            'tile_height': tile_height,
+            'columns': self.columns,
+            'sheets': sheets
+        }
+        map_path = os.path.join(output_dir, f"{name}.json")
+        tmp_path = f"{map_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sprite_map, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, map_path)
+        sprite_map['map_path'] = map_path
+        return sprite_map
+
+
+# =============================================================================
+# 运动自适应采样
+# =============================================================================
+
+class MotionAdaptiveSampler:
+    """按低分辨率代理帧差估计运动量，沿视频调整采样步长
+    
+    步长以 calculate_optimal_frame_count 的固定间隔为基准：两个采样点之间画面变化
+    低于目标值时拉长步长，高于目标值时缩短，让解码和评分预算集中在内容变化处。
+    画面突变时立即采用新的运动量，不经过平滑。
+    """
+    
+    def __init__(self, base_stride: int):
+        self.base_stride = max(1, base_stride)
+        self.min_stride = max(1, int(self.base_stride * AsyncFrameExtractorConfig.ADAPTIVE_MIN_STRIDE_FACTOR))
+        self.max_stride = max(self.min_stride,
+                              int(self.base_stride * AsyncFrameExtractorConfig.ADAPTIVE_MAX_STRIDE_FACTOR))
+        self.stride = self.base_stride
+        self.motion = AsyncFrameExtractorConfig.MOTION_TARGET_DIFF
+        self.next_sample = 0
+        self._previous_proxy = None
+    
+    def should_sample(self, frame_index: int) -> bool:
+        return frame_index >= self.next_sample
+    
+    def update(self, frame: np.ndarray, frame_index: int) -> int:
+        """用当前采样帧更新运动估计，返回下一次采样的步长"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+        proxy = cv2.resize(gray, AsyncFrameExtractorConfig.MOTION_PROXY_SIZE, interpolation=cv2.INTER_AREA)
+        
+        if self._previous_proxy is not None:
+            diff = float(cv2.absdiff(proxy, self._previous_proxy).mean())
+            if diff > 2 * self.motion:
+                self.motion = diff
+            else:
+                smoothing = AsyncFrameExtractorConfig.MOTION_SMOOTHING
+                self.motion = smoothing * self.motion + (1 - smoothing) * diff
+            
+            factor = AsyncFrameExtractorConfig.MOTION_TARGET_DIFF / max(self.motion, 1e-3)
+            self.stride = int(min(self.max_stride, max(self.min_stride, self.base_stride * factor)))
+        
+        self._previous_proxy = proxy
+        self.next_sample = frame_index + self.stride
+        return self.stride
+
+
+# =============================================================================
+# 文件探测缓存、图片头解析与零拷贝链接
+# =============================================================================
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# libjpeg 标准亮度量化表（质量50），用于估算JPEG质量
+_JPEG_STD_LUMINANCE_SUM = sum((
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99
+))
+
+FICLONE = 0x40049409
+
+
+def _estimate_jpeg_quality(luminance_sum: int) -> int:
+    """按 libjpeg 的量化表缩放规则，由亮度量化表之和反推质量"""
+    scale = luminance_sum * 100.0 / _JPEG_STD_LUMINANCE_SUM
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(100, max(1, quality))))
+
+
+def _scan_jpeg_header(f) -> Optional[Dict[str, int]]:
+    """扫描JPEG段直到SOF，返回宽高、分量数和估算质量（无亮度量化表时为None）"""
+    luminance_sum = None
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker == 0xD9:
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(6)
+            if len(data) < 6:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            quality = _estimate_jpeg_quality(luminance_sum) if luminance_sum else None
+            return {'width': width, 'height': height, 'components': data[5], 'quality': quality}
+        if marker == 0xDB:
+            data = f.read(length - 2)
+            offset = 0
+            while offset < len(data):
+                precision, table_id = data[offset] >> 4, data[offset] & 0x0F
+                value_size = 2 if precision else 1
+                table = data[offset + 1:offset + 1 + 64 * value_size]
+                if table_id == 0:
+                    fmt = '>64H' if precision else '64B'
+                    luminance_sum = sum(struct.unpack(fmt, table))
+                offset += 1 + 64 * value_size
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_jpeg_info(file_path: str) -> Optional[Dict[str, int]]:
+    """只读JPEG文件头，返回 {'width', 'height', 'components', 'quality'}"""
+    try:
+        with open(file_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            return _scan_jpeg_header(f)
+    except (OSError, struct.error):
+        return None
+
+
+def _read_tiff_size(f, header: bytes) -> Optional[Tuple[int, int]]:
+    endian = '<' if header[:2] == b'II' else '>'
+    f.seek(struct.unpack(endian + 'I', header[4:8])[0])
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return None
+    size = {}
+    for _ in range(struct.unpack(endian + 'H', count_bytes)[0]):
+        entry = f.read(12)
+        if len(entry) < 12:
+            break
+        tag, field_type = struct.unpack(endian + 'HH', entry[:4])
+        if tag in (256, 257):
+            if field_type == 3:
+                size[tag] = struct.unpack(endian + 'H', entry[8:10])[0]
+            else:
+                size[tag] = struct.unpack(endian + 'I', entry[8:12])[0]
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+
+def read_image_size(file_path: str) -> Optional[Tuple[int, int]]:
+    """只读文件头获取图片宽高，不解码像素；无法识别的格式返回None"""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(32)
+            if header[:2] == b'\xff\xd8':
+                info = _scan_jpeg_header(f)
+                return (info['width'], info['height']) if info else None
+            if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+                return struct.unpack('>II', header[16:24])
+            if header[:2] == b'BM':
+                if struct.unpack('<I', header[14:18])[0] == 12:
+                    return struct.unpack('<HH', header[18:22])
+                width, height = struct.unpack('<ii', header[18:26])
+                return width, abs(height)
+            if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                chunk = header[12:16]
+                if chunk == b'VP8 ':
+                    width, height = struct.unpack('<HH', header[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                if chunk == b'VP8L':
+                    bits = struct.unpack('<I', header[21:25])[0]
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b'VP8X':
+                    return (int.from_bytes(header[24:27], 'little') + 1,
+                            int.from_bytes(header[27:30], 'little') + 1)
+            if header[:4] in (b'II*\x00', b'MM\x00*'):
+                return _read_tiff_size(f, header)
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+def link_or_copy(source: str, target: str) -> str:
+    """把文件放到目标路径：优先硬链接，跨设备时尝试reflink，最后退回普通复制。返回所用方式"""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        pass
+    
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            if os.path.exists(target):
+                os.remove(target)
+    
+    shutil.copyfile(source, target)
+    return 'copy'
+
+
+class ProbeCache:
+    """按 (路径, 大小, 修改时间) 缓存文件探测结果，文件未变时重复提交不再打开文件"""
+    
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or AsyncFrameExtractorConfig.PROBE_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(file_path: str, stat: os.stat_result) -> Tuple[str, int, int]:
+        return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+    
+    def get(self, key: Tuple[str, int, int]) -> Optional[Dict[str, any]]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+        return result
+    
+    def put(self, key: Tuple[str, int, int], result: Dict[str, any]):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# =============================================================================
+# 按需派生图与磁盘LRU缓存
+# =============================================================================
+
+def render_derivative(image_bytes: bytes, width: int, crop: Tuple[float, float, float, float] = None,
+                      encode_format: str = 'jpeg', quality: int = None) -> bytes:
+    """从已编码的帧生成派生图：可选按比例裁剪 (x, y, w, h ∈ [0, 1])，再按宽度等比缩小（不放大）"""
+    frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("无法解码源图片")
+    
+    if crop:
+        height, source_width = frame.shape[:2]
+        x, y, w, h = crop
+        left, top = int(x * source_width), int(y * height)
+        right = max(left + 1, min(source_width, int(round((x + w) * source_width))))
+        bottom = max(top + 1, min(height, int(round((y + h) * height))))
+        frame = frame[top:bottom, left:right]
+    
+    height, source_width = frame.shape[:2]
+    if width < source_width:
+        target_height = max(1, int(round(height * width / source_width)))
+        frame = cv2.resize(frame, (width, target_height), interpolation=cv2.INTER_AREA)
+    
+    buffer = FrameEncoder(quality or AsyncFrameExtractorConfig.DERIVATIVE_QUALITY, encode_format).encode(frame)
+    if buffer is None:
+        raise ValueError("派生图编码失败")
+    return buffer.tobytes()
+
+
+class DerivativeCache:
+    """派生图磁盘缓存：总字节数超过上限时按最近最少使用淘汰
+    
+    同一派生图的并发请求合并为一次生成，其余请求等待同一个 Future。
+    启动时扫描缓存目录，按修改时间恢复LRU顺序。
+    """
+    
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes or AsyncFrameExtractorConfig.DERIVATIVE_CACHE_MAX_BYTES
+        self._entries = OrderedDict()  # key -> (路径, 字节数)
+        self._inflight = {}            # key -> Future
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        existing = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name, entry.path, stat.st_size))
+        for _, name, path, size in sorted(existing):
+            self._entries[name] = (path, size)
+            self.total_bytes += size
+        self._evict()
+    
+    def _evict(self):
+        """淘汰最久未使用的条目直到不超过上限（调用方持有锁或在初始化中）"""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.total_bytes -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+    
+    def get_or_create(self, key: str, create: Callable[[], bytes],
+                      executor: concurrent.futures.Executor = None) -> str:
+        """返回派生图路径；未命中时调用 create() 生成（提供 executor 时在其中运行）
+        
+        key 需包含扩展名，直接作为缓存文件名。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        if not owner:
+            return future.result()
+        
+        try:
+            data = executor.submit(create).result() if executor else create()
+            path = os.path.join(self.cache_dir, key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._entries[key] = (path, len(data))
+                self.total_bytes += len(data)
+                self._evict()
+            future.set_result(path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return path
+    
+    def stats(self) -> Dict[str, any]:
+        """命中率、淘汰次数等统计"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_ratio': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+
+# =============================================================================
+# 预扫描时间线
+# =============================================================================
+
+def select_timeline_frames(timeline: Dict[str, any], budget: int) -> List[int]:
+    """从时间线中挑选候选帧号：先取变化最大的场景切换点，剩余预算均匀分配到各秒的最清晰样本"""
+    budget = max(1, budget)
+    cuts = sorted(timeline['cuts'], key=lambda cut: cut[1], reverse=True)[:budget]
+    selected = {frame_index for frame_index, _ in cuts}
+    
+    covered = [frame_index for frame_index in timeline['best_frame'] if frame_index >= 0]
+    remaining = budget - len(selected)
+    if remaining > 0 and covered:
+        positions = np.linspace(0, len(covered) - 1, num=min(remaining, len(covered)))
+        selected.update(covered[int(round(position))] for position in positions)
+    
+    return sorted(selected)
+
+
+def compute_content_key(file_path: str) -> str:
+    """按文件大小和首、中、尾三个数据块计算内容键
+    
+    不读取整个文件；同一视频重新上传到不同任务目录后键不变，可用来复用预扫描结果。
+    """
+    chunk = AsyncFrameExtractorConfig.CONTENT_KEY_CHUNK_BYTES
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode('ascii'))
+    with open(file_path, 'rb') as f:
+        for offset in (0, (size - chunk) // 2, size - chunk):
+            f.seek(max(0, offset))
+            digest.update(f.read(chunk))
+    return digest.hexdigest()
+
+
+# =============================================================================
+# 感知哈希与视频指纹
+# =============================================================================
+
+def compute_dhash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """计算差值哈希（dHash），hash_size=8 时为64位整数"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def fingerprints_match(a: Dict[str, any], b: Dict[str, any]) -> bool:
+    """判断两个视频指纹是否为同一视频（含重新编码和裁剪副本）
+    
+    以较短视频为准，统计其采样哈希在较长视频中能找到近似匹配的比例。
+    """
+    shorter, longer = sorted((a, b), key=lambda fp: fp['duration'])
+    if not shorter['hashes'] or not longer['hashes'] or longer['duration'] <= 0:
+        return False
+    if shorter['duration'] / longer['duration'] < AsyncFrameExtractorConfig.FINGERPRINT_MIN_DURATION_RATIO:
+        return False
+    
+    matched = sum(
+        1 for h in shorter['hashes']
+        if min(hamming_distance(h, other) for other in longer['hashes'])
+        <= AsyncFrameExtractorConfig.FINGERPRINT_MATCH_DISTANCE
+    )
+    return matched / len(shorter['hashes']) >= AsyncFrameExtractorConfig.FINGERPRINT_MATCH_RATIO
+
+
+class BKTree:
+    """按汉明距离组织的BK树，用于半径查询"""
+    
+    def __init__(self):
+        self.root = None
+        self.size = 0
+    
+    def add(self, value: int):
+        """插入哈希值（完全相同的值不重复插入）"""
+        if self.root is None:
+            self.root = (value, {})
+            self.size = 1
+            return
+        
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (value, {})
+                self.size += 1
+                return
+            node = child
+    
+    def find_within(self, value: int, radius: int) -> Optional[int]:
+        """返回任意一个距离不超过 radius 的值，没有则返回None"""
+        if self.root is None:
+            return None
+        
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= radius:
+                return node_value
+            # 三角不等式剪枝：只有边权在 [d-r, d+r] 内的子树可能命中
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return None
+
+
+class PerceptualHashIndex:
+    """任务级帧感知哈希索引
+    
+    同一任务的多个文件在不同工作线程中并发抽帧，查询和插入各自加锁。
+    帧写盘成功后才登记哈希，写入失败的帧不会让后续近似帧被误判为重复；
+    代价是两个线程可能同时放行一对近似帧，多保留一帧无害。
+    """
+    
+    def __init__(self, radius: int = None):
+        self.radius = AsyncFrameExtractorConfig.FRAME_DEDUP_HAMMING_RADIUS if radius is None else radius
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+    
+    def contains(self, value: int) -> bool:
+        """索引中是否已有汉明距离不超过 radius 的近似帧"""
+        with self._lock:
+            return self._tree.find_within(value, self.radius) is not None
+    
+    def add(self, value: int):
+        """登记已写出帧的哈希"""
+        with self._lock:
+            self._tree.add(value)
+    
+    def __len__(self) -> int:
+        return self._tree.size
+
+
+class VideoFingerprintIndex:
+    """近期任务的视频指纹索引，以JSON文件持久化在输出根目录
+    
+    每条记录保存指纹、所属任务以及该视频最终输出的帧信息，
+    后续任务遇到重复视频时可以直接复用这些帧。
+    多个工作进程共享同一个索引文件：写入时持有文件锁，重新读取磁盘上的最新内容合并后再原子替换；
+    查询前发现文件被其他进程更新过则重新加载。
+    """
+    
+    def __init__(self, index_path: str, max_entries: int = None, ttl_seconds: float = None):
+        self.index_path = index_path
+        self.lock_path = f"{index_path}.lock"
+        self.max_entries = max_entries or AsyncFrameExtractorConfig.FINGERPRINT_INDEX_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or AsyncFrameExtractorConfig.FINGERPRINT_INDEX_TTL_SECONDS
+        self.entries = []
+        self._mtime_ns = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._load()
+    
+    def _load(self):
+        """从磁盘读取索引（调用方持有 _lock）"""
+        try:
+            self._mtime_ns = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = []
+    
+    def _reload_if_changed(self):
+        """索引文件被其他进程改写过时重新加载（调用方持有 _lock）"""
+        try:
+            mtime_ns = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self._load()
+    
+    def find_match(self, fingerprint: Dict[str, any]) -> Optional[Dict[str, any]]:
+        """查找最近的匹配记录"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            self._reload_if_changed()
+            for entry in reversed(self.entries):
+                if entry['created_at'] >= cutoff and fingerprints_match(fingerprint, entry['fingerprint']):
+                    return entry
+        return None
+    
+    def add_entries(self, entries: List[Dict[str, any]]):
+        """在文件锁内合并磁盘上的最新索引与新记录，淘汰过期和超量的旧记录后原子写回"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            self._load()
+            new_keys = {(entry['task_id'], entry['file_name']) for entry in entries}
+            merged = [entry for entry in self.entries if (entry['task_id'], entry['file_name']) not in new_keys]
+            merged.extend(entries)
+            merged.sort(key=lambda entry: entry['created_at'])
+            self.entries = [entry for entry in merged if entry['created_at'] >= cutoff][-self.max_entries:]
+            
+            tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._mtime_ns = os.stat(self.index_path).st_mtime_ns
+
+# =============================================================================
+# 采样分析器
+# =============================================================================
+
+class StackSamplingProfiler:
+    """低开销的栈采样分析器
+    
+    后台线程按固定间隔读取 sys._current_frames()，只采样事件循环线程和
+    FrameExtractor 线程池工作线程，按调用栈聚合计数，输出可直接交给
+    flamegraph.pl / speedscope 的 collapsed-stack 格式。
+    注意线程池在并发任务间共享，采样结果可能包含同时运行的其他任务。
+    """
+    
+    DEFAULT_INTERVAL = 0.005
+    WORKER_THREAD_PREFIX = "FrameExtractor"
+    
+    def __init__(self, interval: float = None):
+        self.interval = interval or self.DEFAULT_INTERVAL
+        self.stacks = {}
+        self.sample_count = 0
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """在事件循环线程中调用，开始采样"""
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止采样"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+    
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                name = thread_names.get(thread_id, '')
+                if thread_id == self._loop_thread_id:
+                    root = 'event_loop'
+                elif name.startswith(self.WORKER_THREAD_PREFIX):
+                    root = 'worker'
+                else:
+                    continue
+                
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(root)
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.sample_count += 1
+    
+    def write_collapsed(self, output_path: str) -> str:
+        """写出 collapsed-stack 文件（每行: 栈帧;栈帧;... 次数）"""
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        return output_path
+
 # =============================================================================
 # 异步进度监控
 # =============================================================================
@@ -331,9 +1736,19 @@ class AsyncFrameExtractor:
     """异步视频抽帧器"""
     
     def __init__(self, output_dir: str = None, max_file_size_mb: int = None, 
-                 auto_detect_performance: bool = True):
-        """初始化异步抽帧器"""
+                 auto_detect_performance: bool = True, metrics_sink: MetricsSink = None,
+                 profile_sample_rate: float = 0.0):
+        """初始化异步抽帧器
+        
+        profile_sample_rate: 自动开启采样分析的任务比例（0-1），单个任务也可通过
+        process_and_format_async(profile=True) 强制开启
+        """
         self.output_dir = output_dir or AsyncFrameExtractorConfig.DEFAULT_OUTPUT_DIR
+        self.base_output_dir = self.output_dir
+        self.metrics_sink = metrics_sink
+        self._fingerprint_index = None
+        self.probe_cache = ProbeCache()
+        self.profile_sample_rate = profile_sample_rate
         self.max_file_size_mb = max_file_size_mb or AsyncFrameExtractorConfig.DEFAULT_MAX_FILE_SIZE_MB
         self.max_file_size_bytes = self.max_file_size_mb * AsyncFrameExtractorConfig.BYTES_TO_MB
         
@@ -343,35 +1758,53 @@ class AsyncFrameExtractor:
         self.supported_formats = (AsyncFrameExtractorConfig.SUPPORTED_VIDEO_FORMATS | 
                                  AsyncFrameExtractorConfig.SUPPORTED_IMAGE_FORMATS)
         
-        # 设备性能检测
-        self.performance_detector = DevicePerformanceDetector()
-        if auto_detect_performance:
-            self.performance_profile = self.performance_detector.get_performance_profile()
-        else:
-            self.performance_profile = self.performance_detector._get_default_profile()
-        
-        # 线程池和资源管理
-        self.thread_pool = None
-        self.semaphore = None
-        self._setup_resources()
+        # 设备性能检测、线程池和信号量都在首次使用时创建：
+        # 构造抽帧器只做目录准备，命令行工具和短生命周期进程无需付出探测和建池的开销
+        self.auto_detect_performance = auto_detect_performance
+        self.performance_detector = None
+        self._performance_profile = None
+        self._thread_pool = None
+        self._semaphore = None
+        self._resource_lock = threading.Lock()
         
         logger.info(f"✓ 异步抽帧器初始化完成 - 输出目录: {self.output_dir}")
-        logger.info(f"🔧 性能配置: {self.performance_profile['performance_level']} | "
-                   f"最大工作线程: {self.performance_profile['max_workers']} | "
-                   f"批处理大小: {self.performance_profile['recommended_batch_size']}")
-    
-    def _setup_resources(self):
-        """设置资源管理"""
-        config = self.performance_profile['concurrency_config']
-        
-        # 创建线程池
-        self.thread_pool = concurrent.futures.ThreadPoolExecutor(
-            max_workers=config['max_workers'],
-            thread_name_prefix="FrameExtractor"
-        )
-        
-        # 创建信号量限制并发
-        self.semaphore = asyncio.Semaphore(config['batch_size'])
+    
+    @property
+    def performance_profile(self) -> Dict[str, any]:
+        """设备性能档案（首次访问时探测）"""
+        if self._performance_profile is None:
+            with self._resource_lock:
+                if self._performance_profile is None:
+                    if self.auto_detect_performance:
+                        self.performance_detector = DevicePerformanceDetector()
+                        profile = self.performance_detector.get_performance_profile()
+                    else:
+                        profile = DevicePerformanceDetector._get_default_profile()
+                    logger.info(f"🔧 性能配置: {profile['performance_level']} | "
+                               f"最大工作线程: {profile['max_workers']} | "
+                               f"批处理大小: {profile['recommended_batch_size']}")
+                    self._performance_profile = profile
+        return self._performance_profile
+    
+    @property
+    def thread_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        """抽帧线程池（首次提交任务时创建，cleanup() 后再次使用会重新创建）"""
+        if self._thread_pool is None:
+            config = self.performance_profile['concurrency_config']
+            with self._resource_lock:
+                if self._thread_pool is None:
+                    self._thread_pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=config['max_workers'],
+                        thread_name_prefix="FrameExtractor"
+                    )
+        return self._thread_pool
+    
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """限制并发处理文件数的信号量（首次在事件循环中使用时创建）"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.performance_profile['concurrency_config']['batch_size'])
+        return self._semaphore
     
     async def __aenter__(self):
         """异步上下文管理器入口"""
@@ -383,9 +1816,9 @@ class AsyncFrameExtractor:
     
     async def cleanup(self):
         """清理资源"""
-        if self.thread_pool:
-            self.thread_pool.shutdown(wait=True)
-            self.thread_pool = None
+        if self._thread_pool:
+            self._thread_pool.shutdown(wait=True)
+            self._thread_pool = None
         
         # 强制垃圾回收
         gc.collect()
@@ -404,38 +1837,56 @@ class AsyncFrameExtractor:
     
     async def validate_file(self, file_path: str) -> Dict[str, any]:
         """异步文件验证"""
-        def _sync_validate():
-            result = {'valid': False, 'error': None, 'file_info': {}}
-            
+        results = await self.validate_files([file_path])
+        return results[file_path]
+    
+    async def validate_files(self, file_paths: List[str]) -> Dict[str, Dict[str, any]]:
+        """在一次线程池调用中批量验证多个文件，返回 {路径: 验证结果}"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.thread_pool, self._validate_batch_sync, list(file_paths))
+    
+    def _validate_batch_sync(self, file_paths: List[str]) -> Dict[str, Dict[str, any]]:
+        """批量验证（同步方法）"""
+        return {file_path: self._validate_file_sync(file_path) for file_path in file_paths}
+    
+    def _validate_file_sync(self, file_path: str) -> Dict[str, any]:
+        """验证单个文件（同步方法），探测结果按 (路径, 大小, 修改时间) 缓存"""
+        result = {'valid': False, 'error': None, 'file_info': {}}
+        
+        try:
+            # 基础检查
             try:
-                # 基础检查
-                if not os.path.exists(file_path):
-                    result['error'] = f"文件不存在: {file_path}"
-                    return result
-                
-                file_ext = os.path.splitext(file_path)[1].lower()
-                if file_ext not in self.supported_formats:
-                    result['error'] = f"不支持的文件格式: {file_ext}"
-                    return result
-                
-                file_size = os.path.getsize(file_path)
-                if file_size > self.max_file_size_bytes:
-                    result['error'] = f"文件过大: {file_size/AsyncFrameExtractorConfig.BYTES_TO_MB:.1f}MB"
-                    return result
-                
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                result['error'] = f"文件不存在: {file_path}"
+                return result
+            
+            file_ext = os.path.splitext(file_path)[1].lower()
+            if file_ext not in self.supported_formats:
+                result['error'] = f"不支持的文件格式: {file_ext}"
+                return result
+            
+            file_size = stat.st_size
+            if file_size > self.max_file_size_bytes:
+                result['error'] = f"文件过大: {file_size/AsyncFrameExtractorConfig.BYTES_TO_MB:.1f}MB"
+                return result
+            
+            cache_key = ProbeCache.make_key(file_path, stat)
+            cached = self.probe_cache.get(cache_key)
+            if cached is None:
                 # 判断文件类型并获取信息
                 if file_ext in AsyncFrameExtractorConfig.SUPPORTED_VIDEO_FORMATS:
-                    return self._validate_video_sync(file_path, file_size, file_ext)
+                    cached = self._validate_video_sync(file_path, file_size, file_ext)
                 else:
-                    return self._validate_image_sync(file_path, file_size, file_ext)
-                    
-            except Exception as e:
-                result['error'] = f"验证出错: {str(e)}"
-                return result
-        
-        # 在线程池中执行同步验证
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.thread_pool, _sync_validate)
+                    cached = self._validate_image_sync(file_path, file_size, file_ext)
+                self.probe_cache.put(cache_key, cached)
+            
+            # 返回副本，调用方修改结果不影响缓存
+            return {**cached, 'file_info': dict(cached['file_info'])}
+                
+        except Exception as e:
+            result['error'] = f"验证出错: {str(e)}"
+            return result
     
     def _validate_video_sync(self, file_path: str, file_size: int, file_ext: str) -> Dict[str, any]:
         """同步验证视频文件"""
@@ -477,16 +1928,21 @@ class AsyncFrameExtractor:
         return result
     
     def _validate_image_sync(self, file_path: str, file_size: int, file_ext: str) -> Dict[str, any]:
-        """同步验证图片文件"""
+        """同步验证图片文件：优先只读文件头获取尺寸，无法识别时才完整解码"""
         result = {'valid': False, 'error': None, 'file_info': {}}
         
-        image = cv2.imread(file_path)
-        if image is None:
-            result['error'] = "无法读取图片文件"
-            return result
-        
-        height, width = image.shape[:2]
-        channels = image.shape[2] if len(image.shape) == 3 else 1
+        size = read_image_size(file_path)
+        if size is not None:
+            width, height = size
+            # 处理时按 cv2.imread 默认的三通道彩色读取
+            channels = 3
+        else:
+            image = cv2.imread(file_path)
+            if image is None:
+                result['error'] = "无法读取图片文件"
+                return result
+            height, width = image.shape[:2]
+            channels = image.shape[2] if len(image.shape) == 3 else 1
         
         if width <= 0 or height <= 0:
             result['error'] = "图片尺寸异常"
@@ -565,6 +2021,137 @@ class AsyncFrameExtractor:
             'strategy': strategy
         }
     
+    def _timeline_cache_dir(self) -> str:
+        return os.path.join(self.base_output_dir, AsyncFrameExtractorConfig.TIMELINE_CACHE_SUBDIR)
+    
+    def _prune_timeline_cache(self, cache_dir: str):
+        """缓存条目超过上限时按最近使用时间淘汰最旧的"""
+        try:
+            entries = [entry for entry in os.scandir(cache_dir)
+                       if entry.is_file() and entry.name.endswith('.json')]
+            if len(entries) <= AsyncFrameExtractorConfig.TIMELINE_CACHE_MAX_ENTRIES:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:len(entries) - AsyncFrameExtractorConfig.TIMELINE_CACHE_MAX_ENTRIES]:
+                os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"清理时间线缓存失败 {cache_dir}: {e}")
+    
+    def build_video_timeline(self, video_path: str, video_info: Dict) -> Optional[Dict[str, any]]:
+        """低成本预扫描，生成每秒的变化/亮度/清晰度时间线（同步方法）
+        
+        非取样帧只 grab（取样间隔超过 SEEK_MIN_GAP_SECONDS 时直接定位），取样帧缩到
+        PRESCAN_PROXY_SIZE 的灰度代理帧上计算指标。结果按源文件内容键缓存在输出根目录的
+        TIMELINE_CACHE_SUBDIR 下，同一视频在其他任务中再次上传时直接复用。
+        """
+        cache_dir = self._timeline_cache_dir()
+        content_key = compute_content_key(video_path)
+        cache_path = os.path.join(cache_dir, f"{content_key}.json")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if (cached.get('version') == AsyncFrameExtractorConfig.TIMELINE_VERSION and
+                        cached.get('content_key') == content_key):
+                    os.utime(cache_path)
+                    return cached
+            except (OSError, ValueError) as e:
+                logger.warning(f"时间线缓存损坏，重新扫描 {cache_path}: {e}")
+        
+        fps = video_info['fps']
+        total_frames = video_info['total_frames']
+        step = max(1, int(round(fps / AsyncFrameExtractorConfig.PRESCAN_SAMPLES_PER_SECOND)))
+        seconds = max(1, int(np.ceil(total_frames / fps)))
+        
+        change = [0.0] * seconds
+        brightness_sum = [0.0] * seconds
+        sample_count = [0] * seconds
+        sharpness = [-1.0] * seconds
+        best_frame = [-1] * seconds
+        cuts = []
+        
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+        
+        # 取样间隔足够长时逐个定位到取样帧，中间的帧不再解码
+        seek_gap = int(fps * AsyncFrameExtractorConfig.SEEK_MIN_GAP_SECONDS)
+        sparse = bool(seek_gap) and step > seek_gap
+        
+        try:
+            previous_proxy = None
+            frame_index = 0
+            while True:
+                if sparse and frame_index % step:
+                    next_index = frame_index + step - frame_index % step
+                    if cap.set(cv2.CAP_PROP_POS_FRAMES, next_index):
+                        frame_index = next_index
+                    else:
+                        sparse = False  # 后端不支持定位时退回逐帧 grab
+                if not cap.grab():
+                    break
+                if frame_index % step == 0:
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        second = min(int(frame_index / fps), seconds - 1)
+                        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+                        proxy = cv2.resize(gray, AsyncFrameExtractorConfig.PRESCAN_PROXY_SIZE,
+                                           interpolation=cv2.INTER_AREA)
+                        
+                        if previous_proxy is not None:
+                            diff = float(cv2.absdiff(proxy, previous_proxy).mean())
+                            change[second] = max(change[second], diff)
+                            if diff > AsyncFrameExtractorConfig.PRESCAN_CUT_THRESHOLD:
+                                cuts.append([frame_index, round(diff, 2)])
+                        previous_proxy = proxy
+                        
+                        brightness_sum[second] += float(proxy.mean())
+                        sample_count[second] += 1
+                        proxy_sharpness = float(cv2.Laplacian(proxy, cv2.CV_64F).var())
+                        if proxy_sharpness > sharpness[second]:
+                            sharpness[second] = proxy_sharpness
+                            best_frame[second] = frame_index
+                frame_index += 1
+        finally:
+            cap.release()
+        
+        timeline = {
+            'version': AsyncFrameExtractorConfig.TIMELINE_VERSION,
+            'content_key': content_key,
+            'fps': fps,
+            'total_frames': total_frames if sparse else frame_index,
+            'sample_step': step,
+            'change': [round(value, 2) for value in change],
+            'brightness': [round(total / count, 2) if count else 0.0
+                           for total, count in zip(brightness_sum, sample_count)],
+            'sharpness': [round(max(value, 0.0), 2) for value in sharpness],
+            'best_frame': best_frame,
+            'cuts': cuts
+        }
+        
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(timeline, f, separators=(',', ':'))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"写入时间线缓存失败 {cache_path}: {e}")
+        self._prune_timeline_cache(cache_dir)
+        
+        return timeline
+    
+    async def get_video_timeline_async(self, video_path: str, video_info: Dict = None) -> Optional[Dict[str, any]]:
+        """异步获取视频时间线（优先读缓存），供抽帧、预览和封面选择使用"""
+        if video_info is None:
+            validation = await self.validate_file(video_path)
+            if not validation['valid'] or validation['file_info']['file_type'] != 'video':
+                return None
+            video_info = validation['file_info']
+        
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.thread_pool, self.build_video_timeline, video_path, video_info)
+    
     def calculate_frame_quality(self, frame: np.ndarray) -> Dict[str, float]:
         """计算帧质量指标（同步方法）"""
         # 转换为灰度图
@@ -650,9 +2237,78 @@ class AsyncFrameExtractor:
         
         return frame
     
-    async def extract_frames_async(self, video_path: str, progress_monitor: AsyncProgressMonitor = None, **kwargs) -> Dict[str, any]:
-        """异步视频抽帧方法"""
+    def compute_video_fingerprint(self, video_path: str, video_info: Dict) -> Dict[str, any]:
+        """计算视频感知指纹（同步方法）
+        
+        在视频内均匀seek少量位置，把帧缩成 COMPARE_FRAME_SIZE 代理图后计算dHash，
+        不需要完整解码视频。
+        """
+        sample_count = AsyncFrameExtractorConfig.FINGERPRINT_SAMPLE_COUNT
+        total_frames = video_info['total_frames']
+        hashes = []
+        
+        cap = cv2.VideoCapture(video_path)
+        try:
+            for i in range(sample_count):
+                # 避开片头片尾，在 5%~95% 区间均匀取点
+                position = int(total_frames * (0.05 + 0.9 * i / max(sample_count - 1, 1)))
+                cap.set(cv2.CAP_PROP_POS_FRAMES, min(position, total_frames - 1))
+                ret, frame = cap.read()
+                if not ret:
+                    continue
+                proxy = cv2.resize(frame, AsyncFrameExtractorConfig.COMPARE_FRAME_SIZE, interpolation=cv2.INTER_AREA)
+                hashes.append(compute_dhash(proxy))
+        finally:
+            cap.release()
+        
+        return {
+            'duration': video_info['duration_seconds'],
+            'hashes': hashes
+        }
+    
+    def _get_fingerprint_index(self) -> VideoFingerprintIndex:
+        """获取（首次使用时加载）视频指纹索引"""
+        if self._fingerprint_index is None:
+            self._fingerprint_index = VideoFingerprintIndex(
+                os.path.join(self.base_output_dir, AsyncFrameExtractorConfig.FINGERPRINT_INDEX_FILENAME)
+            )
+        return self._fingerprint_index
+    
+    def _link_reused_frames(self, entry: Dict[str, any], video_path: str,
+                            task_output: TaskOutput) -> List[FrameRecord]:
+        """把历史任务的帧硬链接（失败则reflink或复制）到当前任务目录（同步方法）"""
+        frame_paths = []
+        for index, record in enumerate(entry['frames']):
+            if not os.path.exists(record['path']):
+                continue
+            filename = f"reused_{index:04d}_{os.path.basename(record['path'])}"
+            target = os.path.join(task_output.output_dir, filename)
+            link_or_copy(record['path'], target)
+            size_bytes = record.get('size_bytes') or os.path.getsize(target)
+            frame_paths.append(FrameRecord(
+                path=target,
+                filename=filename,
+                frame_number=record.get('frame_number', 0),
+                timestamp=record.get('timestamp', 0.0),
+                extracted_index=index,
+                source_type='video',
+                source_file=os.path.basename(video_path),
+                quality_metrics=record.get('quality_metrics'),
+                size_bytes=size_bytes
+            ))
+        return frame_paths
+    
+    async def extract_frames_async(self, video_path: str, progress_monitor: AsyncProgressMonitor = None,
+                                   cancel_token: CancellationToken = None,
+                                   frame_hash_index: PerceptualHashIndex = None,
+                                   frame_stream: FrameRecordStream = None,
+                                   task_output: TaskOutput = None, **kwargs) -> Dict[str, any]:
+        """异步视频抽帧方法（task_output 为空时帧写入抽帧器输出目录）"""
         async with self.semaphore:  # 限制并发
+            # 排队期间任务可能已被取消
+            if cancel_token and cancel_token.cancelled:
+                return {'success': False, 'cancelled': True, 'error': cancel_token.reason}
+            
             logger.info(f"🎬 开始异步抽帧: {os.path.basename(video_path)}")
             start_time = time.time()
             
@@ -665,7 +2321,9 @@ class AsyncFrameExtractor:
             max_base_frames = kwargs.get('max_base_frames', AsyncFrameExtractorConfig.DEFAULT_MAX_BASE_FRAMES)
             
             # 验证文件
+            probe_start = time.perf_counter()
             validation = await self.validate_file(video_path)
+            probe_seconds = time.perf_counter() - probe_start
             if not validation['valid']:
                 return {'success': False, 'error': validation['error']}
             
@@ -679,16 +2337,31 @@ class AsyncFrameExtractor:
                 video_info['fps'], 
                 video_info['total_frames']
             )
+            calc_result['sampling_mode'] = kwargs.get('sampling_mode', AsyncFrameExtractorConfig.DEFAULT_SAMPLING_MODE)
+            
+            # 预扫描：直接从时间线选出候选帧，只对候选帧做全分辨率处理
+            prescan_seconds = 0.0
+            if kwargs.get('prescan', AsyncFrameExtractorConfig.DEFAULT_PRESCAN):
+                prescan_start = time.perf_counter()
+                timeline = await self.get_video_timeline_async(video_path, video_info)
+                prescan_seconds = time.perf_counter() - prescan_start
+                if timeline:
+                    calc_result['sampling_mode'] = 'timeline'
+                    calc_result['target_frames'] = select_timeline_frames(timeline, calc_result['optimal_frames'])
+                    calc_result['scene_cuts'] = len(timeline['cuts'])
+            
+            loop = asyncio.get_event_loop()
             
             # 在线程池中执行实际的帧提取
             def _extract_frames():
                 return self._extract_frames_sync(
                     video_path, video_info, calc_result, quality, max_resolution,
                     sharpness_threshold, similarity_threshold, scene_sensitivity,
-                    max_base_frames, progress_monitor
+                    max_base_frames, progress_monitor, loop, cancel_token, frame_hash_index, frame_stream,
+                    self._resolve_output_tiers(kwargs.get('output_tiers', AsyncFrameExtractorConfig.DEFAULT_OUTPUT_TIERS)),
+                    self._make_encoder(quality, kwargs), task_output
                 )
             
-            loop = asyncio.get_event_loop()
             result = await loop.run_in_executor(self.thread_pool, _extract_frames)
             
             processing_time = time.time() - start_time
@@ -697,15 +2370,30 @@ class AsyncFrameExtractor:
                 logger.info(f"✅ 异步抽帧完成: {len(result['frame_paths'])} 帧, 耗时 {processing_time:.2f}秒")
                 result['processing_time'] = processing_time
                 result['calculation_result'] = calc_result
+                result['metrics']['stage_seconds']['open_probe'] += round(probe_seconds, 4)
+                result['metrics']['stage_seconds']['prescan'] += round(prescan_seconds, 4)
             
             return result
     
     def _extract_frames_sync(self, video_path: str, video_info: Dict, calc_result: Dict,
                            quality: int, max_resolution: tuple, sharpness_threshold: float,
                            similarity_threshold: float, scene_sensitivity: str,
-                           max_base_frames: int, progress_monitor: AsyncProgressMonitor = None) -> Dict[str, any]:
+                           max_base_frames: int, progress_monitor: AsyncProgressMonitor = None,
+                           loop: asyncio.AbstractEventLoop = None,
+                           cancel_token: CancellationToken = None,
+                           frame_hash_index: PerceptualHashIndex = None,
+                           frame_stream: FrameRecordStream = None,
+                           output_tiers: List[Tuple[str, Tuple[int, int]]] = None,
+                           encoder: FrameEncoder = None,
+                           task_output: TaskOutput = None) -> Dict[str, any]:
         """同步帧提取核心逻辑"""
+        task_output = task_output or TaskOutput(self.output_dir)
+        metrics = ExtractionMetrics()
+        perf_counter = time.perf_counter
+        
+        stage_start = perf_counter()
         cap = cv2.VideoCapture(video_path)
+        metrics.add_time('open_probe', perf_counter() - stage_start)
         if not cap.isOpened():
             return {'success': False, 'error': '无法打开视频'}
         
@@ -716,56 +2404,159 @@ class AsyncFrameExtractor:
             previous_frame = None
             last_progress_update = 0
             
-            jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+            encoder = encoder or FrameEncoder(quality)
+            tier_encoder = encoder.for_tiers() if output_tiers else None
             frame_interval = calc_result['frame_interval']
             total_frames = video_info['total_frames']
             
+            # adaptive 模式下步长随运动量变化；uniform 模式保持固定间隔
+            sampler = None
+            if calc_result.get('sampling_mode') == 'adaptive':
+                sampler = MotionAdaptiveSampler(frame_interval)
+            
+            # timeline 模式只处理预扫描选出的候选帧，候选之间直接定位，最后一个候选之后不再解码
+            target_frames = None
+            target_set = None
+            last_target = -1
+            if calc_result.get('target_frames'):
+                target_frames = sorted(set(calc_result['target_frames']))
+                target_set = set(target_frames)
+                last_target = target_frames[-1]
+            
+            # 采样间隔较长时定位到下一个采样帧；定位本身要从关键帧解码，间隔太短时反而更慢
+            fps = video_info.get('fps') or 0
+            seek_gap = int(fps * AsyncFrameExtractorConfig.SEEK_MIN_GAP_SECONDS)
+            
             while True:
-                ret, frame = cap.read()
+                # 每解码一帧检查一次取消请求，取消后删除已写出的帧
+                if cancel_token and cancel_token.cancelled:
+                    if cancel_token.cleanup:
+                        self._remove_frame_files(frame_paths)
+                    logger.info(f"⏹️ 抽帧已取消: {os.path.basename(video_path)}")
+                    return {'success': False, 'cancelled': True, 'error': cancel_token.reason}
+                
+                if seek_gap:
+                    if target_frames is not None:
+                        index = bisect.bisect_left(target_frames, frame_count)
+                        next_sample = target_frames[index] if index < len(target_frames) else frame_count
+                    elif sampler:
+                        next_sample = sampler.next_sample
+                    else:
+                        next_sample = -(-frame_count // frame_interval) * frame_interval
+                    if next_sample - frame_count > seek_gap:
+                        stage_start = perf_counter()
+                        if cap.set(cv2.CAP_PROP_POS_FRAMES, next_sample):
+                            frame_count = next_sample
+                            metrics.incr('seeks')
+                        else:
+                            seek_gap = 0  # 后端不支持定位时退回逐帧 grab
+                        metrics.add_time('decode', perf_counter() - stage_start)
+                
+                # 只对采样帧做 retrieve（像素转换和拷贝），其余帧 grab 后直接跳过
+                stage_start = perf_counter()
+                ret = cap.grab()
+                metrics.add_time('decode', perf_counter() - stage_start)
                 if not ret:
                     break
+                metrics.incr('frames_read')
                 
-                # 更新进度
-                if progress_monitor and time.time() - last_progress_update > AsyncFrameExtractorConfig.PROGRESS_UPDATE_INTERVAL:
-                    progress = (frame_count / total_frames) * 100
-                    # 注意：这里不能直接调用异步方法，需要在外层处理
+                # 更新进度（工作线程中不能直接await，投递回事件循环执行）
+                if progress_monitor and loop and time.time() - last_progress_update > AsyncFrameExtractorConfig.PROGRESS_UPDATE_INTERVAL:
+                    progress = min(frame_count / total_frames * 100, 99.0)
+                    asyncio.run_coroutine_threadsafe(
+                        progress_monitor.update_file_progress(os.path.basename(video_path), progress), loop
+                    )
                     last_progress_update = time.time()
                 
-                # 均匀抽帧
-                if frame_count % frame_interval == 0:
+                if target_frames is not None:
+                    if frame_count > last_target:
+                        break
+                    is_sample = frame_count in target_set
+                elif sampler:
+                    is_sample = sampler.should_sample(frame_count)
+                else:
+                    is_sample = frame_count % frame_interval == 0
+                
+                if is_sample:
+                    stage_start = perf_counter()
+                    ret, frame = cap.retrieve()
+                    metrics.add_time('decode', perf_counter() - stage_start)
+                    if not ret:
+                        frame_count += 1
+                        continue
+                    metrics.incr('frames_sampled')
+                    
                     # 调整分辨率
+                    stage_start = perf_counter()
                     processed_frame = self.resize_frame(frame, max_resolution)
+                    metrics.add_time('resize', perf_counter() - stage_start)
+                    
+                    if sampler:
+                        stage_start = perf_counter()
+                        sampler.update(processed_frame, frame_count)
+                        metrics.add_time('motion_estimation', perf_counter() - stage_start)
                     
                     # 质量评估
+                    stage_start = perf_counter()
                     quality_metrics = self.calculate_frame_quality(processed_frame)
+                    metrics.add_time('scoring', perf_counter() - stage_start)
                     
                     # 判断是否保留
                     should_keep = self._should_keep_frame(
                         processed_frame, previous_frame, quality_metrics,
-                        sharpness_threshold, similarity_threshold, scene_sensitivity
+                        sharpness_threshold, similarity_threshold, scene_sensitivity, metrics
                     )
                     
+                    compare_frame = None
+                    frame_hash = None
+                    if should_keep:
+                        compare_frame = cv2.resize(processed_frame, AsyncFrameExtractorConfig.COMPARE_FRAME_SIZE)
+                        
+                        # 跨文件去重：任务内已有近似帧则在编码前丢弃（写盘成功后才登记哈希）
+                        if frame_hash_index is not None:
+                            stage_start = perf_counter()
+                            frame_hash = compute_dhash(compare_frame)
+                            is_duplicate = frame_hash_index.contains(frame_hash)
+                            metrics.add_time('hash_lookup', perf_counter() - stage_start)
+                            if is_duplicate:
+                                metrics.incr('rejected_duplicate')
+                                should_keep = False
+                    
                     if should_keep:
                         # 保存帧
                         timestamp = frame_count / video_info['fps']
-                        filename = f"frame_{extracted_count:04d}_{timestamp:.2f}s.jpg"
-                        filepath = os.path.join(self.output_dir, filename)
+                        filename = f"frame_{extracted_count:04d}_{timestamp:.2f}s{encoder.extension}"
+                        filepath = os.path.join(task_output.output_dir, filename)
                         
-                        if cv2.imwrite(filepath, processed_frame, jpeg_params):
-                            frame_info = {
-                                'path': filepath,
-                                'filename': filename,
-                                'frame_number': frame_count,
-                                'timestamp': timestamp,
-                                'extracted_index': extracted_count,
-                                'quality_metrics': quality_metrics,
-                                'source_type': 'video',
-                                'source_file': os.path.basename(video_path)
-                            }
-                            frame_paths.append(frame_info)
+                        size_bytes = self._write_frame(filepath, processed_frame, encoder, metrics,
+                                                       task_output.frame_pack)
+                        if size_bytes:
+                            if frame_hash is not None:
+                                frame_hash_index.add(frame_hash)
+                            record = FrameRecord(
+                                path=filepath,
+                                filename=filename,
+                                frame_number=frame_count,
+                                timestamp=timestamp,
+                                extracted_index=extracted_count,
+                                source_type='video',
+                                source_file=os.path.basename(video_path),
+                                quality_metrics=quality_metrics,
+                                size_bytes=size_bytes
+                            )
+                            if output_tiers:
+                                record.tiers = self._write_tiers(filepath, processed_frame, tier_encoder,
+                                                                 output_tiers, metrics, task_output.frame_pack)
+                            if task_output.sprite_builder:
+                                stage_start = perf_counter()
+                                task_output.sprite_builder.add(filepath, processed_frame)
+                                metrics.add_time('resize', perf_counter() - stage_start)
+                            frame_paths.append(record)
+                            if frame_stream:
+                                frame_stream.write(record)
                             
                             # 更新前一帧用于比较
-                            previous_frame = cv2.resize(processed_frame, AsyncFrameExtractorConfig.COMPARE_FRAME_SIZE)
+                            previous_frame = compare_frame
                             extracted_count += 1
                             
                             # 达到最大帧数则退出
@@ -784,15 +2575,92 @@ class AsyncFrameExtractor:
         finally:
             cap.release()
         
+        metrics.incr('encode_attempts', encoder.encode_attempts)
+        if tier_encoder:
+            metrics.incr('encode_attempts', tier_encoder.encode_attempts)
+        metrics.incr('bytes_saved', encoder.bytes_saved)
+        
         return {
             'success': True,
             'video_info': video_info,
-            'frame_paths': frame_paths
+            'frame_paths': frame_paths,
+            'metrics': metrics.to_dict()
         }
     
+    def _write_frame(self, filepath: str, frame: np.ndarray, encoder: FrameEncoder,
+                     metrics: ExtractionMetrics = None, frame_pack: FramePackWriter = None) -> int:
+        """编码并写入帧（给出 frame_pack 时追加到打包容器），分别计时编码和写盘，返回写入字节数（失败返回0）"""
+        stage_start = time.perf_counter()
+        buffer = encoder.encode(frame)
+        encoded_at = time.perf_counter()
+        if buffer is None:
+            return 0
+        
+        try:
+            if frame_pack:
+                frame_pack.append(filepath, buffer)
+            else:
+                with open(filepath, 'wb') as f:
+                    f.write(buffer)
+        except OSError as e:
+            logger.warning(f"写入帧失败 {filepath}: {e}")
+            return 0
+        
+        if metrics:
+            metrics.add_time('jpeg_encode', encoded_at - stage_start)
+            metrics.add_time('disk_write', time.perf_counter() - encoded_at)
+            metrics.incr('frames_written')
+            metrics.incr('bytes_written', buffer.nbytes)
+        return buffer.nbytes
+    
+    def _jpeg_passthrough_ok(self, image_path: str, encoder: FrameEncoder) -> bool:
+        """源文件是否可以不经重新编码直接作为输出帧"""
+        if os.path.splitext(image_path)[1].lower() not in ('.jpg', '.jpeg'):
+            return False
+        if encoder.encode_format != 'jpeg' or encoder.progressive:
+            return False
+        if encoder.target_bytes and os.path.getsize(image_path) > encoder.target_bytes:
+            return False
+        info = read_jpeg_info(image_path)
+        if not info or info['quality'] is None or info['components'] not in (1, 3):
+            return False
+        return info['quality'] >= encoder.quality - AsyncFrameExtractorConfig.PASSTHROUGH_QUALITY_TOLERANCE
+    
+    def _make_encoder(self, quality: int, kwargs: Dict[str, any]) -> FrameEncoder:
+        """按处理参数创建帧编码器"""
+        return FrameEncoder(
+            quality=quality,
+            encode_format=kwargs.get('encode_format', AsyncFrameExtractorConfig.DEFAULT_ENCODE_FORMAT),
+            target_bytes=kwargs.get('target_frame_bytes'),
+            progressive=kwargs.get('progressive_jpeg', False),
+            optimize=kwargs.get('optimize_jpeg', False)
+        )
+    
+    def _link_image(self, image_path: str, output_path: str, metrics: ExtractionMetrics = None,
+                    frame_pack: FramePackWriter = None) -> int:
+        """把源图片链接到输出路径（给出 frame_pack 时追加到打包容器），返回文件字节数（失败返回0）"""
+        stage_start = time.perf_counter()
+        try:
+            if frame_pack:
+                with open(image_path, 'rb') as f:
+                    _, size_bytes = frame_pack.append(output_path, f.read())
+            else:
+                link_or_copy(image_path, output_path)
+                size_bytes = os.path.getsize(output_path)
+        except OSError as e:
+            logger.warning(f"链接图片失败 {image_path}: {e}")
+            return 0
+        
+        if metrics:
+            metrics.add_time('disk_write', time.perf_counter() - stage_start)
+            metrics.incr('frames_linked')
+            metrics.incr('bytes_written', size_bytes)
+        return size_bytes
+    
     def _should_keep_frame(self, frame: np.ndarray, previous_frame: Optional[np.ndarray], 
                           quality_metrics: Dict[str, float], sharpness_threshold: float,
-                          similarity_threshold: float, scene_sensitivity: str) -> bool:
+                          similarity_threshold: float, scene_sensitivity: str,
+                          metrics: ExtractionMetrics = None) -> bool:
         """判断是否保留帧（同步方法）"""
         # 第一帧总是保留
         if previous_frame is None:
@@ -800,56 +2668,163 @@ class AsyncFrameExtractor:
         
         # 清晰度检查
         if quality_metrics['sharpness'] < sharpness_threshold:
+            if metrics:
+                metrics.incr('rejected_sharpness')
             return False
         
         # 场景变化检测
+        stage_start = time.perf_counter()
         scene_result = self.detect_scene_change(previous_frame, frame, scene_sensitivity)
+        if metrics:
+            metrics.add_time('scene_detection', time.perf_counter() - stage_start)
         
         # 如果发生场景变化，检查变化强度
         if scene_result['is_scene_change']:
             intensity_threshold = AsyncFrameExtractorConfig.INTENSITY_THRESHOLDS.get(scene_sensitivity, 40.0)
-            return scene_result['change_intensity'] >= intensity_threshold
+            keep = scene_result['change_intensity'] >= intensity_threshold
+        else:
+            # 如果没有场景变化，检查像素差异
+            keep = scene_result['pixel_difference'] >= similarity_threshold
         
-        # 如果没有场景变化，检查像素差异
-        return scene_result['pixel_difference'] >= similarity_threshold
+        if not keep and metrics:
+            metrics.incr('rejected_similarity')
+        return keep
+    
+    def _remove_frame_files(self, frame_paths: List[FrameRecord]):
+        """删除已写出的帧文件（含各尺寸档位，同步方法）"""
+        for record in frame_paths:
+            for path in record.all_paths():
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError:
+                    pass
+    
+    def _remove_task_outputs(self, task_output_dir: str):
+        """删除任务目录下的全部输出，保留 TASK_INPUT_SUBDIR 中的上传文件（同步方法）"""
+        try:
+            entries = list(os.scandir(task_output_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name == AsyncFrameExtractorConfig.TASK_INPUT_SUBDIR:
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+    
+    def _resolve_output_tiers(self, output_tiers) -> List[Tuple[str, Tuple[int, int]]]:
+        """把 output_tiers 参数（True 表示使用预设）整理为按尺寸从大到小排列的档位列表"""
+        if not output_tiers:
+            return []
+        if output_tiers is True:
+            output_tiers = AsyncFrameExtractorConfig.OUTPUT_TIER_PRESET
+        return sorted(output_tiers.items(), key=lambda item: item[1][0] * item[1][1], reverse=True)
     
-    async def process_image_file_async(self, image_path: str, **kwargs) -> Dict[str, any]:
-        """异步处理图片文件"""
+    def _write_tiers(self, filepath: str, frame: np.ndarray, encoder: FrameEncoder,
+                     output_tiers: List[Tuple[str, Tuple[int, int]]],
+                     metrics: ExtractionMetrics = None, frame_pack: FramePackWriter = None) -> Dict[str, Dict]:
+        """从已解码的帧逐级缩小（图像金字塔），为每个档位写出一个文件"""
+        tiers = {}
+        base, ext = os.path.splitext(filepath)
+        current = frame
+        for name, max_size in output_tiers:
+            stage_start = time.perf_counter()
+            current = self.resize_frame(current, max_size)
+            if metrics:
+                metrics.add_time('resize', time.perf_counter() - stage_start)
+            
+            tier_path = f"{base}_{name}{ext}"
+            size_bytes = self._write_frame(tier_path, current, encoder, metrics, frame_pack)
+            if size_bytes:
+                height, width = current.shape[:2]
+                tiers[name] = {'path': tier_path, 'size_bytes': size_bytes, 'width': width, 'height': height}
+        return tiers
+    
+    async def process_image_file_async(self, image_path: str, cancel_token: CancellationToken = None,
+                                       task_output: TaskOutput = None, **kwargs) -> Dict[str, any]:
+        """异步处理图片文件（task_output 为空时写入抽帧器输出目录）"""
+        task_output = task_output or TaskOutput(self.output_dir)
         async with self.semaphore:  # 限制并发
+            if cancel_token and cancel_token.cancelled:
+                return {'success': False, 'cancelled': True, 'error': cancel_token.reason}
+            
             def _process_image():
                 quality = kwargs.get('quality', AsyncFrameExtractorConfig.DEFAULT_QUALITY)
                 max_resolution = kwargs.get('max_resolution')
+                metrics = ExtractionMetrics()
                 
                 # 读取和处理图片
+                stage_start = time.perf_counter()
                 image = cv2.imread(image_path)
+                metrics.add_time('decode', time.perf_counter() - stage_start)
                 if image is None:
                     return {'success': False, 'error': '无法读取图片文件'}
+                metrics.incr('frames_read')
+                metrics.incr('frames_sampled')
                 
+                stage_start = time.perf_counter()
                 processed_image = self.resize_frame(image, max_resolution)
+                metrics.add_time('resize', time.perf_counter() - stage_start)
+                
+                stage_start = time.perf_counter()
                 quality_metrics = self.calculate_frame_quality(processed_image)
+                metrics.add_time('scoring', time.perf_counter() - stage_start)
+                
+                if cancel_token and cancel_token.cancelled:
+                    return {'success': False, 'cancelled': True, 'error': cancel_token.reason}
                 
                 # 生成输出文件名
                 base_name = os.path.splitext(os.path.basename(image_path))[0]
-                output_filename = f"image_{base_name}.jpg"
-                output_path = os.path.join(self.output_dir, output_filename)
+                encoder = self._make_encoder(quality, kwargs)
+                output_filename = f"image_{base_name}{encoder.extension}"
+                output_path = os.path.join(task_output.output_dir, output_filename)
                 
-                # 保存图片
-                jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-                if cv2.imwrite(output_path, processed_image, jpeg_params):
+                # 保存图片：已满足格式、质量和分辨率要求的JPEG直接链接，不重新编码
+                size_bytes = 0
+                if (kwargs.get('image_passthrough', AsyncFrameExtractorConfig.DEFAULT_IMAGE_PASSTHROUGH) and
+                        processed_image is image and self._jpeg_passthrough_ok(image_path, encoder)):
+                    size_bytes = self._link_image(image_path, output_path, metrics, task_output.frame_pack)
+                if not size_bytes:
+                    size_bytes = self._write_frame(output_path, processed_image, encoder, metrics,
+                                                   task_output.frame_pack)
+                    metrics.incr('encode_attempts', encoder.encode_attempts)
+                    metrics.incr('bytes_saved', encoder.bytes_saved)
+                if size_bytes:
+                    tiers = None
+                    output_tiers = self._resolve_output_tiers(
+                        kwargs.get('output_tiers', AsyncFrameExtractorConfig.DEFAULT_OUTPUT_TIERS)
+                    )
+                    if output_tiers:
+                        tiers = self._write_tiers(output_path, processed_image, encoder.for_tiers(),
+                                                  output_tiers, metrics, task_output.frame_pack)
+                    if task_output.sprite_builder:
+                        stage_start = time.perf_counter()
+                        task_output.sprite_builder.add(output_path, processed_image)
+                        metrics.add_time('resize', time.perf_counter() - stage_start)
                     return {
                         'success': True,
                         'file_type': 'image',
                         'output_info': {
                             'path': output_path,
                             'filename': output_filename,
-                            'quality_metrics': quality_metrics
-                        }
+                            'quality_metrics': quality_metrics,
+                            'size_bytes': size_bytes,
+                            'tiers': tiers
+                        },
+                        'metrics': metrics.to_dict()
                     }
                 else:
                     return {'success': False, 'error': '保存图片失败'}
             
             # 验证图片
+            probe_start = time.perf_counter()
             validation = await self.validate_file(image_path)
+            probe_seconds = time.perf_counter() - probe_start
             if not validation['valid']:
                 return {'success': False, 'error': validation['error']}
             
@@ -859,10 +2834,14 @@ class AsyncFrameExtractor:
             
             # 在线程池中处理图片
             loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(self.thread_pool, _process_image)
+            result = await loop.run_in_executor(self.thread_pool, _process_image)
+            if result['success']:
+                result['metrics']['stage_seconds']['open_probe'] += round(probe_seconds, 4)
+            return result
     
     async def process_multiple_files_async(self, input_paths: List[str], device_id: str = None, 
                                          task_id: str = None, progress_callback: Callable = None,
+                                         cancel_token: CancellationToken = None,
                                          **kwargs) -> Dict[str, any]:
         """异步处理多个文件（核心并行处理方法）"""
         # 处理任务ID
@@ -870,10 +2849,9 @@ class AsyncFrameExtractor:
             device_id = device_id or "async_device"
             task_id = self.generate_task_id(device_id)
         
-        # 创建任务目录
+        # 创建任务目录（任务输出状态只放在本次调用的上下文里，抽帧器实例可被并发任务共享）
         task_output_dir = self.create_task_output_dir(task_id)
-        original_output_dir = self.output_dir
-        self.output_dir = task_output_dir
+        task_output = TaskOutput(task_output_dir)
         
         # 设置进度监控
         progress_monitor = AsyncProgressMonitor(len(input_paths))
@@ -885,27 +2863,108 @@ class AsyncFrameExtractor:
                    f"批处理大小 {self.performance_profile['recommended_batch_size']}")
         
         start_time = time.time()
+        frame_stream = None
         
         try:
             all_frame_paths = []
             success_count = 0
             failed_count = 0
+            task_metrics = ExtractionMetrics()
+            file_metrics = {}
+            
+            # 视频去重：本任务内已处理视频的指纹，以及需要写入索引的指纹
+            dedup_mode = kwargs.get('dedup_mode', AsyncFrameExtractorConfig.DEFAULT_DEDUP_MODE)
+            task_fingerprints = {}
+            duplicate_files = []
+            loop = asyncio.get_event_loop()
+            
+            # 跨文件帧去重索引，本任务所有视频共享
+            frame_hash_index = None
+            if kwargs.get('cross_file_dedup', AsyncFrameExtractorConfig.DEFAULT_CROSS_FILE_DEDUP):
+                frame_hash_index = PerceptualHashIndex()
+            
+            # 打包输出：本任务所有帧追加到同一个容器文件
+            if kwargs.get('output_format', AsyncFrameExtractorConfig.DEFAULT_OUTPUT_FORMAT) == 'packed':
+                task_output.frame_pack = FramePackWriter(os.path.join(task_output_dir, f"frames_{task_id}.pack"))
+            
+            # 雪碧图：抽帧时从已解码帧收集缩略图
+            if kwargs.get('sprite_sheet', AsyncFrameExtractorConfig.DEFAULT_SPRITE_SHEET):
+                task_output.sprite_builder = SpriteSheetBuilder(kwargs.get('sprite_tile_size'),
+                                                                kwargs.get('sprite_columns'))
+            
+            # NDJSON输出：帧记录写盘后立即追加到任务目录下的流文件
+            if kwargs.get('result_format', AsyncFrameExtractorConfig.DEFAULT_RESULT_FORMAT) == 'ndjson':
+                frame_stream = FrameRecordStream(os.path.join(task_output_dir, f"frames_{task_id}.partial.ndjson"))
+            
+            async def check_duplicate(file_path: str, video_info: Dict) -> Optional[Dict[str, any]]:
+                """检测重复视频，返回跳过/复用结果；不重复时登记指纹并返回None"""
+                fingerprint = await loop.run_in_executor(
+                    self.thread_pool, self.compute_video_fingerprint, file_path, video_info
+                )
+                file_name = os.path.basename(file_path)
+                
+                # 任务内重复：指纹登记在同一事件循环上同步完成，并发文件间不会漏判
+                for other_path, other_fingerprint in task_fingerprints.items():
+                    if fingerprints_match(fingerprint, other_fingerprint):
+                        duplicate_files.append({'file': file_name, 'duplicate_of': os.path.basename(other_path),
+                                                'action': 'skipped'})
+                        logger.info(f"♻️ 跳过任务内重复视频: {file_name} ≈ {os.path.basename(other_path)}")
+                        return {'success': True, 'skipped_duplicate': True, 'frame_paths': []}
+                task_fingerprints[file_path] = fingerprint
+                
+                # 跨任务重复
+                index = await loop.run_in_executor(self.thread_pool, self._get_fingerprint_index)
+                entry = index.find_match(fingerprint)
+                if entry is None:
+                    return None
+                
+                duplicate_info = {'file': file_name, 'duplicate_of': entry['file_name'],
+                                  'source_task_id': entry['task_id']}
+                if dedup_mode == 'reuse':
+                    frame_paths = await loop.run_in_executor(
+                        self.thread_pool, self._link_reused_frames, entry, file_path, task_output
+                    )
+                    if frame_paths:
+                        duplicate_files.append({**duplicate_info, 'action': 'reused'})
+                        logger.info(f"♻️ 复用历史任务 {entry['task_id']} 的 {len(frame_paths)} 帧: {file_name}")
+                        return {'success': True, 'reused_duplicate': True, 'frame_paths': frame_paths}
+                    # 历史帧已被清理，正常抽帧
+                    return None
+                
+                duplicate_files.append({**duplicate_info, 'action': 'skipped'})
+                logger.info(f"♻️ 跳过与历史任务 {entry['task_id']} 重复的视频: {file_name}")
+                return {'success': True, 'skipped_duplicate': True, 'frame_paths': []}
+            
+            # 一次线程池调用批量验证全部输入，结果进入探测缓存，后续抽帧时的验证直接命中
+            validations = await self.validate_files(input_paths)
             
             # 创建处理任务
             async def process_single_file(file_path: str) -> Tuple[str, Dict[str, any]]:
                 """处理单个文件的异步包装"""
                 try:
+                    if cancel_token and cancel_token.cancelled:
+                        return file_path, {'success': False, 'cancelled': True, 'error': cancel_token.reason}
+                    
                     await progress_monitor.update_file_progress(os.path.basename(file_path), 0)
                     
-                    validation = await self.validate_file(file_path)
+                    validation = validations[file_path]
                     if not validation['valid']:
                         await progress_monitor.complete_file(os.path.basename(file_path))
                         return file_path, {'success': False, 'error': validation['error']}
                     
+                    if validation['file_info']['file_type'] == 'video' and dedup_mode != 'off':
+                        duplicate_result = await check_duplicate(file_path, validation['file_info'])
+                        if duplicate_result:
+                            await progress_monitor.complete_file(os.path.basename(file_path))
+                            return file_path, duplicate_result
+                    
                     if validation['file_info']['file_type'] == 'video':
-                        result = await self.extract_frames_async(file_path, progress_monitor, **kwargs)
+                        result = await self.extract_frames_async(
+                            file_path, progress_monitor, cancel_token, frame_hash_index, frame_stream,
+                            task_output, **kwargs
+                        )
                     else:
-                        result = await self.process_image_file_async(file_path, **kwargs)
+                        result = await self.process_image_file_async(file_path, cancel_token, task_output, **kwargs)
                     
                     await progress_monitor.complete_file(os.path.basename(file_path))
                     return file_path, result
@@ -919,6 +2978,10 @@ class AsyncFrameExtractor:
             batch_size = self.performance_profile['recommended_batch_size']
             
             for i in range(0, len(input_paths), batch_size):
+                # 已取消则丢弃剩余排队文件
+                if cancel_token and cancel_token.cancelled:
+                    break
+                
                 batch = input_paths[i:i + batch_size]
                 
                 # 创建当前批次的任务
@@ -936,21 +2999,31 @@ class AsyncFrameExtractor:
                     
                     if result['success']:
                         success_count += 1
+                        if 'metrics' in result:
+                            task_metrics.merge(result['metrics'])
+                            file_metrics[os.path.basename(file_path)] = result['metrics']
+                        if result.get('reused_duplicate') and frame_stream:
+                            for record in result['frame_paths']:
+                                frame_stream.write(record)
                         if 'frame_paths' in result:
+                            self._attach_pack_locations(result['frame_paths'], task_output.frame_pack)
                             all_frame_paths.extend(result['frame_paths'])
                         elif 'output_info' in result:
                             # 转换图片结果为帧格式
-                            frame_info = {
-                                'path': result['output_info']['path'],
-                                'filename': result['output_info']['filename'],
-                                'frame_number': 0,
-                                'timestamp': 0.0,
-                                'extracted_index': len(all_frame_paths),
-                                'quality_metrics': result['output_info']['quality_metrics'],
-                                'source_type': 'image',
-                                'source_file': os.path.basename(file_path)
-                            }
-                            all_frame_paths.append(frame_info)
+                            record = FrameRecord(
+                                path=result['output_info']['path'],
+                                filename=result['output_info']['filename'],
+                                extracted_index=len(all_frame_paths),
+                                source_type='image',
+                                source_file=os.path.basename(file_path),
+                                quality_metrics=result['output_info']['quality_metrics'],
+                                size_bytes=result['output_info'].get('size_bytes', 0)
+                            )
+                            record.tiers = result['output_info'].get('tiers')
+                            self._attach_pack_locations([record], task_output.frame_pack)
+                            all_frame_paths.append(record)
+                            if frame_stream:
+                                frame_stream.write(record)
                     else:
                         failed_count += 1
                 
@@ -959,26 +3032,73 @@ class AsyncFrameExtractor:
                     await asyncio.sleep(0.1)
                     gc.collect()
             
+            # 取消时清理本任务的部分输出（上传文件由任务的所有者决定何时删除）
+            if cancel_token and cancel_token.cancelled:
+                if frame_stream:
+                    frame_stream.close()
+                if task_output.frame_pack:
+                    task_output.frame_pack.close()
+                if cancel_token.cleanup:
+                    loop = asyncio.get_event_loop()
+                    await loop.run_in_executor(self.thread_pool, self._remove_task_outputs, task_output_dir)
+                    logger.info(f"⏹️ 任务已取消并清理输出: {task_id}")
+                else:
+                    logger.info(f"⏹️ 任务已停止，保留输出: {task_id} ({cancel_token.reason})")
+                return {
+                    'success': False,
+                    'cancelled': True,
+                    'error': cancel_token.reason,
+                    'task_id': task_id,
+                    'device_id': device_id,
+                    'task_output_dir': task_output_dir
+                }
+            
             # 如果超过最大帧数限制，按质量排序保留
             max_base_frames = kwargs.get('max_base_frames', AsyncFrameExtractorConfig.DEFAULT_MAX_BASE_FRAMES)
             if len(all_frame_paths) > max_base_frames:
-                all_frame_paths.sort(key=lambda x: x['quality_metrics']['quality_score'], reverse=True)
+                all_frame_paths.sort(key=lambda record: record.quality_score, reverse=True)
                 
                 # 删除多余文件
-                for frame_info in all_frame_paths[max_base_frames:]:
-                    try:
-                        if os.path.exists(frame_info['path']):
-                            os.remove(frame_info['path'])
-                    except:
-                        pass
+                self._remove_frame_files(all_frame_paths[max_base_frames:])
                 
                 all_frame_paths = all_frame_paths[:max_base_frames]
             
-            # 重新命名文件确保顺序
-            await self._rename_frames_async(all_frame_paths)
+            # 重新命名文件确保顺序（雪碧图按重命名前的路径查找缩略图）
+            original_paths = [record.path for record in all_frame_paths]
+            rename_start = time.perf_counter()
+            await self._rename_frames_async(all_frame_paths, task_output)
+            task_metrics.add_time('rename', time.perf_counter() - rename_start)
+            
+            sprite_sheets = None
+            if task_output.sprite_builder:
+                sprite_start = time.perf_counter()
+                try:
+                    sprite_sheets = await loop.run_in_executor(
+                        self.thread_pool, task_output.sprite_builder.build, task_output_dir,
+                        f"sprites_{task_id}", original_paths, all_frame_paths
+                    )
+                except Exception as e:
+                    logger.warning(f"生成雪碧图失败: {e}")
+                task_metrics.add_time('jpeg_encode', time.perf_counter() - sprite_start)
+            
+            frame_pack_index = None
+            if task_output.frame_pack:
+                frame_pack_index = await loop.run_in_executor(
+                    self.thread_pool, task_output.frame_pack.write_index, all_frame_paths
+                )
+            
+            # 把本任务新处理视频的指纹和最终帧写入索引
+            if task_fingerprints:
+                await self._record_fingerprints_async(task_id, task_fingerprints, all_frame_paths)
             
             processing_time = time.time() - start_time
             
+            if self.metrics_sink:
+                try:
+                    self.metrics_sink.export(task_id, task_metrics.to_dict())
+                except Exception as e:
+                    logger.warning(f"导出指标失败: {e}")
+            
             logger.info(f"✅ 异步并行处理完成: 成功 {success_count}, 失败 {failed_count}, 耗时 {processing_time:.2f}秒")
             
             return {
@@ -991,29 +3111,109 @@ class AsyncFrameExtractor:
                 'failed_count': failed_count,
                 'frame_paths': all_frame_paths,
                 'batch_processing_time': processing_time,
-                'performance_profile': self.performance_profile
+                'performance_profile': self.performance_profile,
+                'metrics': task_metrics.to_dict(),
+                'file_metrics': file_metrics,
+                'duplicate_files': duplicate_files,
+                'frame_stream_path': frame_stream.path if frame_stream else None,
+                'frame_format': kwargs.get('encode_format', AsyncFrameExtractorConfig.DEFAULT_ENCODE_FORMAT).upper(),
+                'frame_pack_path': task_output.frame_pack.pack_path if task_output.frame_pack else None,
+                'frame_pack_index_path': frame_pack_index,
+                'sprite_sheets': sprite_sheets
             }
             
         finally:
-            self.output_dir = original_output_dir
+            if frame_stream:
+                frame_stream.close()
+            if task_output.frame_pack:
+                task_output.frame_pack.close()
+    
+    async def _record_fingerprints_async(self, task_id: str, task_fingerprints: Dict[str, Dict],
+                                         all_frame_paths: List[FrameRecord]):
+        """把视频指纹和对应的最终帧记录写入指纹索引"""
+        def _record():
+            now = time.time()
+            entries = []
+            for file_path, fingerprint in task_fingerprints.items():
+                file_name = os.path.basename(file_path)
+                frames = [
+                    {
+                        'path': record.path,
+                        'frame_number': record.frame_number,
+                        'timestamp': record.timestamp,
+                        'quality_metrics': record.quality_metrics
+                    }
+                    for record in all_frame_paths
+                    if record.source_type == 'video' and record.source_file == file_name
+                ]
+                entries.append({
+                    'task_id': task_id,
+                    'file_name': file_name,
+                    'fingerprint': fingerprint,
+                    'frames': frames,
+                    'created_at': now
+                })
+            self._get_fingerprint_index().add_entries(entries)
+        
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self.thread_pool, _record)
+        except Exception as e:
+            logger.warning(f"更新视频指纹索引失败: {e}")
+    
+    def _attach_pack_locations(self, records: List[FrameRecord], frame_pack: Optional[FramePackWriter]):
+        """打包输出时，把写入容器的偏移和长度记到帧记录上（需在重命名前调用）"""
+        if not frame_pack:
+            return
+        for record in records:
+            location = frame_pack.locate(record.path)
+            if location:
+                record.pack_offset, record.pack_length = location
+            for tier in (record.tiers or {}).values():
+                location = frame_pack.locate(tier['path'])
+                if location:
+                    tier['pack_offset'], tier['pack_length'] = location
     
-    async def _rename_frames_async(self, all_frame_paths: List[Dict]):
+    async def _rename_frames_async(self, all_frame_paths: List[FrameRecord], task_output: TaskOutput):
         """异步重新命名帧文件"""
+        def _rename_tiers(record: FrameRecord, new_path: str):
+            base, ext = os.path.splitext(new_path)
+            for name, tier in (record.tiers or {}).items():
+                new_tier_path = f"{base}_{name}{ext}"
+                if tier.get('pack_offset', -1) < 0 and tier['path'] != new_tier_path:
+                    if not os.path.exists(tier['path']):
+                        continue
+                    if os.path.exists(new_tier_path):
+                        os.remove(new_tier_path)
+                    os.rename(tier['path'], new_tier_path)
+                tier['path'] = new_tier_path
+        
         def _rename_files():
-            for i, frame_info in enumerate(all_frame_paths):
-                old_path = frame_info['path']
-                clean_name = os.path.splitext(frame_info['source_file'])[0]
-                new_filename = f"frame_{i:04d}_{frame_info['source_type']}_{clean_name}.jpg"
-                new_path = os.path.join(self.output_dir, new_filename)
+            for i, record in enumerate(all_frame_paths):
+                old_path = record.path
+                clean_name = os.path.splitext(record.source_file)[0]
+                extension = os.path.splitext(record.path)[1] or '.jpg'
+                new_filename = f"frame_{i:04d}_{record.source_type}_{clean_name}{extension}"
+                new_path = os.path.join(task_output.output_dir, new_filename)
+                
+                # 已写入打包容器的帧没有独立文件，只更新记录，容器索引按最终文件名写出；
+                # 复用的历史帧等仍是独立文件，照常重命名
+                if record.pack_offset >= 0:
+                    _rename_tiers(record, new_path)
+                    record.path = new_path
+                    record.filename = new_filename
+                    record.extracted_index = i
+                    continue
                 
                 try:
                     if old_path != new_path and os.path.exists(old_path):
                         if os.path.exists(new_path):
                             os.remove(new_path)
                         os.rename(old_path, new_path)
-                        frame_info['path'] = new_path
-                        frame_info['filename'] = new_filename
-                        frame_info['extracted_index'] = i
+                        _rename_tiers(record, new_path)
+                        record.path = new_path
+                        record.filename = new_filename
+                        record.extracted_index = i
                 except Exception as e:
                     logger.warning(f"重命名文件失败 {old_path}: {e}")
         
@@ -1021,39 +3221,35 @@ class AsyncFrameExtractor:
         loop = asyncio.get_event_loop()
         await loop.run_in_executor(self.thread_pool, _rename_files)
     
-    def format_output(self, processing_result: Dict[str, any], save_json: bool = True) -> Dict[str, any]:
-        """格式化输出结果（同步方法）"""
+    def format_output(self, processing_result: Dict[str, any], save_json: bool = True,
+                      compact_json: bool = False) -> Dict[str, any]:
+        """格式化输出结果（同步方法）
+        
+        帧记录只在这里转换为字典；compact_json=True 时结果文件不缩进、不加空格（安装了 orjson 时用它编码）。
+        处理时启用了 NDJSON 输出的，帧记录写入单独的 frames_<task_id>.ndjson，结果文件只保留摘要。
+        """
         if not processing_result.get('success', False):
             return {
                 'success': False,
                 'error': processing_result.get('error', '处理失败'),
+                'cancelled': processing_result.get('cancelled', False),
                 'device_id': processing_result.get('device_id'),
                 'task_id': processing_result.get('task_id'),
                 'base_frame_paths': []
             }
         
         # 构建基础帧路径数组
-        base_frame_paths = []
-        for frame_info in processing_result.get('frame_paths', []):
-            frame_data = {
-                'file_path': frame_info['path'],
-                'filename': frame_info['filename'],
-                'source_type': frame_info.get('source_type', 'unknown'),
-                'source_file': frame_info.get('source_file', 'unknown'),
-                'extracted_index': frame_info.get('extracted_index', 0),
-                'timestamp': frame_info.get('timestamp', 0.0),
-                'quality_metrics': {
-                    'sharpness': round(frame_info['quality_metrics']['sharpness'], 2),
-                    'brightness': round(frame_info['quality_metrics']['brightness'], 2),
-                    'contrast': round(frame_info['quality_metrics']['contrast'], 2),
-                    'quality_score': round(frame_info['quality_metrics']['quality_score'], 2)
-                }
-            }
-            base_frame_paths.append(frame_data)
-        
-        # 计算统计信息
-        total_size_mb = sum(os.path.getsize(f['path']) for f in processing_result['frame_paths'] 
-                           if os.path.exists(f['path'])) / AsyncFrameExtractorConfig.BYTES_TO_MB
+        records = [
+            record if isinstance(record, FrameRecord) else FrameRecord.from_dict(record)
+            for record in processing_result.get('frame_paths', [])
+        ]
+        base_frame_paths = [record.to_output_dict() for record in records]
+        
+        # 计算统计信息：使用写盘时记录的大小，旧记录缺失时才回退到 stat
+        total_size_mb = sum(
+            record.total_size_bytes or (os.path.getsize(record.path) if os.path.exists(record.path) else 0)
+            for record in records
+        ) / AsyncFrameExtractorConfig.BYTES_TO_MB
         
         formatted_result = {
             'success': True,
@@ -1066,12 +3262,20 @@ class AsyncFrameExtractor:
                 'failed_files': processing_result.get('failed_count', 0),
                 'final_frame_count': len(base_frame_paths),
                 'processing_time_seconds': round(processing_result.get('batch_processing_time', 0), 2),
-                'performance_profile': processing_result.get('performance_profile', {})
+                'performance_profile': processing_result.get('performance_profile', {}),
+                'stage_metrics': processing_result.get('metrics', {}),
+                'file_metrics': processing_result.get('file_metrics', {}),
+                'duplicate_files': processing_result.get('duplicate_files', [])
             },
             'storage_info': {
                 'task_output_directory': processing_result.get('task_output_dir', ''),
                 'total_size_mb': round(total_size_mb, 2),
-                'frame_format': 'JPEG'
+                'frame_format': processing_result.get('frame_format', 'JPEG'),
+                **({'frame_pack_path': processing_result['frame_pack_path'],
+                    'frame_pack_index_path': processing_result['frame_pack_index_path']}
+                   if processing_result.get('frame_pack_path') else {}),
+                **({'sprite_sheets': processing_result['sprite_sheets']} if processing_result.get('sprite_sheets') else {}),
+                **({'profile_path': processing_result['profile_path']} if processing_result.get('profile_path') else {})
             },
             'metadata': {
                 'extraction_timestamp': datetime.now().isoformat(),
@@ -1083,14 +3287,22 @@ class AsyncFrameExtractor:
         
         # 保存JSON结果
         if save_json:
-            json_path = self._save_json_result(formatted_result)
+            stream_path = processing_result.get('frame_stream_path')
+            ndjson_path = None
+            if stream_path:
+                ndjson_path = self._save_frames_ndjson(formatted_result, records, stream_path)
+                if ndjson_path:
+                    formatted_result['storage_info']['frames_ndjson_path'] = ndjson_path
+            json_path = self._save_json_result(formatted_result, compact=compact_json,
+                                               include_frames=ndjson_path is None)
             if json_path:
                 formatted_result['storage_info']['json_result_path'] = json_path
         
         return formatted_result
     
-    def _save_json_result(self, formatted_result: Dict[str, any]) -> Optional[str]:
-        """保存JSON结果（同步方法）"""
+    def _save_json_result(self, formatted_result: Dict[str, any], compact: bool = False,
+                          include_frames: bool = True) -> Optional[str]:
+        """保存JSON结果（同步方法），先写临时文件再原子替换，读者不会看到半个文件"""
         try:
             task_output_dir = formatted_result['storage_info']['task_output_directory']
             task_id = formatted_result['task_id']
@@ -1098,26 +3310,79 @@ class AsyncFrameExtractor:
             json_filename = f"async_frames_result_{task_id}.json"
             json_path = os.path.join(task_output_dir, json_filename)
             
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(formatted_result, f, ensure_ascii=False, indent=2, default=str)
+            payload = formatted_result
+            if not include_frames:
+                payload = {key: value for key, value in formatted_result.items() if key != 'base_frame_paths'}
+            
+            tmp_path = f"{json_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps_json(payload, compact=compact))
+            os.replace(tmp_path, json_path)
             
             return json_path
         except Exception as e:
             logger.error(f"保存JSON失败: {str(e)}")
             return None
     
+    def _save_frames_ndjson(self, formatted_result: Dict[str, any], records: List[FrameRecord],
+                            stream_path: str) -> Optional[str]:
+        """把最终帧记录逐行写入 frames_<task_id>.ndjson（原子替换），并删除处理期间的流文件"""
+        try:
+            task_output_dir = formatted_result['storage_info']['task_output_directory']
+            ndjson_path = os.path.join(task_output_dir, f"frames_{formatted_result['task_id']}.ndjson")
+            
+            tmp_path = f"{ndjson_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                for record in records:
+                    f.write(dumps_json(record.to_output_dict(), compact=True) + b'\n')
+            os.replace(tmp_path, ndjson_path)
+            
+            if os.path.exists(stream_path):
+                os.remove(stream_path)
+            return ndjson_path
+        except Exception as e:
+            logger.error(f"保存NDJSON失败: {str(e)}")
+            return None
+    
     async def process_and_format_async(self, input_paths: List[str], device_id: str = None, 
                                      task_id: str = None, save_json: bool = True, 
-                                     progress_callback: Callable = None, **kwargs) -> Dict[str, any]:
-        """一键异步处理并格式化输出"""
+                                     progress_callback: Callable = None,
+                                     cancel_token: CancellationToken = None, profile: bool = None,
+                                     compact_json: bool = False, **kwargs) -> Dict[str, any]:
+        """一键异步处理并格式化输出
+        
+        profile: True/False 强制开启/关闭采样分析，None 时按 profile_sample_rate 抽样
+        compact_json: 结果JSON文件不缩进，适合大批量任务
+        """
+        if profile is None:
+            profile = self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+        
+        profiler = None
+        if profile:
+            # 提前确定任务ID，分析结果要写入任务目录
+            if task_id is None:
+                device_id = device_id or "async_device"
+                task_id = self.generate_task_id(device_id)
+            profiler = StackSamplingProfiler()
+            profiler.start()
+        
         try:
             # 处理多个文件
-            processing_result = await self.process_multiple_files_async(
-                input_paths, device_id, task_id, progress_callback, **kwargs
-            )
+            try:
+                processing_result = await self.process_multiple_files_async(
+                    input_paths, device_id, task_id, progress_callback, cancel_token, **kwargs
+                )
+            finally:
+                if profiler:
+                    profiler.stop()
+            
+            if profiler and processing_result.get('success'):
+                profile_path = os.path.join(processing_result['task_output_dir'], f"profile_{task_id}.collapsed")
+                processing_result['profile_path'] = profiler.write_collapsed(profile_path)
+                logger.info(f"🔬 采样分析完成: {profiler.sample_count} 次采样 -> {profile_path}")
             
             # 格式化输出
-            formatted_output = self.format_output(processing_result, save_json)
+            formatted_output = self.format_output(processing_result, save_json, compact_json)
             
             if formatted_output['success']:
                 logger.info(f"✅ 一键异步处理完成: {len(formatted_output['base_frame_paths'])} 帧")
@@ -1191,5 +3456,6 @@ async def main():
             print(f"❌ 异步处理失败: {result.get('error', '未知错误')}")
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     # 运行异步主函数
     asyncio.run(main())
\ No newline at end of file
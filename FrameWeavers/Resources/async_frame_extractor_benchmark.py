@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步抽帧器热点路径微基准测试
+
+在确定性的合成视频（480p/1080p/4K × 24/30/60fps）上分别测量：
+- 解码帧率（frames decoded/s）
+- resize_frame / calculate_frame_quality / detect_scene_change / _should_keep_frame 吞吐
+- JPEG写盘速度（writes/s）
+- _extract_frames_sync 端到端吞吐（uniform 与 adaptive 两种采样模式）
+以及每个阶段的峰值RSS。结果可保存为基线JSON，后续运行与基线对比标记性能回退。
+--startup 在全新解释器中测量模块导入和抽帧器构造耗时，超出配置预算时返回非零退出码。
+
+使用方法:
+python async_frame_extractor_benchmark.py --save-baseline benchmark_baseline.json
+python async_frame_extractor_benchmark.py --compare benchmark_baseline.json --tolerance 0.15
+python async_frame_extractor_benchmark.py --resolutions 480p,1080p --fps 30 --duration 2
+python async_frame_extractor_benchmark.py --startup
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List
+
+import cv2
+import numpy as np
+import psutil
+
+from async_frame_extractor import AsyncFrameExtractor, AsyncFrameExtractorConfig
+
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160)
+}
+FRAME_RATES = [24, 30, 60]
+BENCHMARK_SEED = 20240601
+DEFAULT_MAX_RESOLUTION = (1920, 1080)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_RUNS = 5
+HEAVY_MODULES = ('cv2', 'numpy', 'psutil')
+
+# =============================================================================
+# 启动开销
+# =============================================================================
+
+# 在子进程中执行，保证每次都是冷导入
+STARTUP_SCRIPT = '''
+import json, sys, tempfile, time
+start = time.perf_counter()
+import async_frame_extractor
+imported = time.perf_counter()
+with tempfile.TemporaryDirectory() as output_dir:
+    constructed_start = time.perf_counter()
+    async_frame_extractor.AsyncFrameExtractor(output_dir=output_dir)
+    constructed = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'construct_ms': (constructed - constructed_start) * 1000,
+    'heavy_modules_loaded': [name for name in %r if name in sys.modules]
+}))
+''' % (HEAVY_MODULES,)
+
+def measure_startup(runs: int = STARTUP_RUNS) -> Dict[str, Any]:
+    """在全新解释器中多次测量导入和构造耗时（取最快一次），并与预算对比"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    import_ms = min(sample['import_ms'] for sample in samples)
+    construct_ms = min(sample['construct_ms'] for sample in samples)
+    heavy_loaded = sorted({name for sample in samples for name in sample['heavy_modules_loaded']})
+    violations = []
+    if import_ms > AsyncFrameExtractorConfig.IMPORT_TIME_BUDGET_MS:
+        violations.append(f"导入耗时 {import_ms:.1f}ms 超出预算 {AsyncFrameExtractorConfig.IMPORT_TIME_BUDGET_MS}ms")
+    if construct_ms > AsyncFrameExtractorConfig.CONSTRUCT_TIME_BUDGET_MS:
+        violations.append(f"构造耗时 {construct_ms:.1f}ms 超出预算 {AsyncFrameExtractorConfig.CONSTRUCT_TIME_BUDGET_MS}ms")
+    if heavy_loaded:
+        violations.append(f"导入或构造时加载了重量级模块: {', '.join(heavy_loaded)}")
+
+    return {
+        'runs': runs,
+        'import_ms': import_ms,
+        'construct_ms': construct_ms,
+        'heavy_modules_loaded': heavy_loaded,
+        'budget_ms': {
+            'import': AsyncFrameExtractorConfig.IMPORT_TIME_BUDGET_MS,
+            'construct': AsyncFrameExtractorConfig.CONSTRUCT_TIME_BUDGET_MS
+        },
+        'violations': violations
+    }
+
+# =============================================================================
+# 合成视频
+# =============================================================================
+
+def generate_synthetic_video(output_path: str, duration: float, width: int, height: int,
+                             fps: float, scene_length: float = 2.0, seed: int = 0) -> str:
+    """生成确定性的合成测试视频
+
+    每 scene_length 秒切换一次底色和纹理模拟场景切换，场景内叠加移动的方块
+    和少量噪声，保证抽帧器的清晰度和场景检测逻辑都能被触发。
+    """
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"无法创建视频文件: {output_path}")
+
+    total_frames = max(1, int(duration * fps))
+    frames_per_scene = max(1, int(scene_length * fps))
+    block = max(8, min(width, height) // 6)
+
+    try:
+        scene_base = None
+        for index in range(total_frames):
+            if index % frames_per_scene == 0:
+                color = rng.integers(0, 256, size=3, dtype=np.uint8)
+                scene_base = np.empty((height, width, 3), dtype=np.uint8)
+                scene_base[:] = color
+                # 棋盘纹理保证拉普拉斯方差足够高
+                checker = ((np.indices((height, width)).sum(axis=0) // 16) % 2).astype(np.uint8) * 60
+                scene_base = cv2.add(scene_base, cv2.merge([checker, checker, checker]))
+
+            frame = scene_base.copy()
+            offset = (index % frames_per_scene) / frames_per_scene
+            x = int(offset * (width - block))
+            y = int((0.5 + 0.4 * np.sin(offset * 2 * np.pi)) * (height - block))
+            cv2.rectangle(frame, (x, y), (x + block, y + block), (255, 255, 255), -1)
+            noise = rng.integers(0, 12, size=frame.shape, dtype=np.uint8)
+            writer.write(cv2.add(frame, noise))
+    finally:
+        writer.release()
+
+    return output_path
+
+# =============================================================================
+# 计时与内存
+# =============================================================================
+
+class PeakRssSampler:
+    """阶段内峰值RSS采样器"""
+
+    def __init__(self, interval: float = 0.01):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+def measure_stage(operation: Callable[[], int], repeat: int) -> Dict[str, float]:
+    """重复执行阶段，取最快一次的吞吐（operation 返回本次处理的单位数）"""
+    best_rate = 0.0
+    best_seconds = None
+    units = 0
+    with PeakRssSampler() as sampler:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            units = operation()
+            elapsed = time.perf_counter() - start
+            if elapsed > 0 and units / elapsed > best_rate:
+                best_rate = units / elapsed
+                best_seconds = elapsed
+    return {
+        'units': units,
+        'seconds': best_seconds,
+        'per_second': best_rate,
+        'peak_rss_mb': sampler.peak / (1024 * 1024)
+    }
+
+def decode_sampled_frames(video_path: str, sample_limit: int) -> List[np.ndarray]:
+    """解码视频并均匀保留最多 sample_limit 帧，避免4K视频把所有帧常驻内存"""
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    try:
+        step = max(1, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // sample_limit)
+        index = 0
+        while len(frames) < sample_limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % step == 0:
+                frames.append(frame)
+            index += 1
+    finally:
+        cap.release()
+    return frames
+
+# =============================================================================
+# 基准测试
+# =============================================================================
+
+def benchmark_video(extractor: AsyncFrameExtractor, video_path: str, workdir: str,
+                    repeat: int, sample_limit: int) -> Dict[str, Dict[str, float]]:
+    """对一个合成视频跑完所有阶段"""
+    results = {}
+
+    def decode():
+        cap = cv2.VideoCapture(video_path)
+        count = 0
+        try:
+            while cap.read()[0]:
+                count += 1
+        finally:
+            cap.release()
+        return count
+
+    results['decode'] = measure_stage(decode, repeat)
+
+    # 后续阶段使用均匀取样的候选帧
+    candidates = decode_sampled_frames(video_path, sample_limit)
+
+    results['resize_frame'] = measure_stage(
+        lambda: len([extractor.resize_frame(f, DEFAULT_MAX_RESOLUTION) for f in candidates]), repeat
+    )
+
+    resized = [extractor.resize_frame(f, DEFAULT_MAX_RESOLUTION) for f in candidates]
+    results['calculate_frame_quality'] = measure_stage(
+        lambda: len([extractor.calculate_frame_quality(f) for f in resized]), repeat
+    )
+
+    proxies = [cv2.resize(f, AsyncFrameExtractorConfig.COMPARE_FRAME_SIZE) for f in resized]
+    results['detect_scene_change'] = measure_stage(
+        lambda: len([extractor.detect_scene_change(a, b) for a, b in zip(proxies, proxies[1:])]), repeat
+    )
+
+    metrics = [extractor.calculate_frame_quality(f) for f in resized]
+
+    def should_keep():
+        for index in range(1, len(resized)):
+            extractor._should_keep_frame(
+                resized[index], proxies[index - 1], metrics[index],
+                AsyncFrameExtractorConfig.DEFAULT_SHARPNESS_THRESHOLD,
+                AsyncFrameExtractorConfig.DEFAULT_SIMILARITY_THRESHOLD,
+                AsyncFrameExtractorConfig.DEFAULT_SCENE_SENSITIVITY
+            )
+        return len(resized) - 1
+
+    results['should_keep_frame'] = measure_stage(should_keep, repeat)
+
+    jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, AsyncFrameExtractorConfig.DEFAULT_QUALITY]
+
+    def jpeg_write():
+        for index, frame in enumerate(resized):
+            cv2.imwrite(os.path.join(workdir, f"bench_{index:04d}.jpg"), frame, jpeg_params)
+        return len(resized)
+
+    results['jpeg_write'] = measure_stage(jpeg_write, repeat)
+
+    file_size = os.path.getsize(video_path)
+    video_info = extractor._validate_video_sync(video_path, file_size, '.mp4')['file_info']
+    calc_result = extractor.calculate_optimal_frame_count(
+        video_info['duration_seconds'], video_info['fps'], video_info['total_frames']
+    )
+
+    # 吞吐按视频总帧数计算；实际 grab 解码的帧数和定位次数另外记录，用于观察跳帧效果
+    extract_counters = {}
+    
+    def make_extract(sampling_mode: str):
+        def extract():
+            result = extractor._extract_frames_sync(
+                video_path, video_info, {**calc_result, 'sampling_mode': sampling_mode},
+                AsyncFrameExtractorConfig.DEFAULT_QUALITY,
+                DEFAULT_MAX_RESOLUTION, AsyncFrameExtractorConfig.DEFAULT_SHARPNESS_THRESHOLD,
+                AsyncFrameExtractorConfig.DEFAULT_SIMILARITY_THRESHOLD,
+                AsyncFrameExtractorConfig.DEFAULT_SCENE_SENSITIVITY,
+                AsyncFrameExtractorConfig.DEFAULT_MAX_BASE_FRAMES
+            )
+            extractor._remove_frame_files(result['frame_paths'])
+            extract_counters[sampling_mode] = result['metrics']['counters']
+            return video_info['total_frames']
+        return extract
+
+    for stage, sampling_mode in (('extract_frames_sync', 'uniform'), ('extract_frames_adaptive', 'adaptive')):
+        results[stage] = measure_stage(make_extract(sampling_mode), repeat)
+        results[stage]['frames_decoded'] = extract_counters[sampling_mode]['frames_read']
+        results[stage]['seeks'] = extract_counters[sampling_mode]['seeks']
+
+    return results
+
+def run_benchmarks(resolutions: List[str], frame_rates: List[int], duration: float,
+                   repeat: int, sample_limit: int, video_dir: str = None) -> Dict[str, Any]:
+    """运行完整基准矩阵"""
+    cases = {}
+    with tempfile.TemporaryDirectory(prefix="frame_bench_") as workdir:
+        video_dir = video_dir or workdir
+        os.makedirs(video_dir, exist_ok=True)
+        extractor = AsyncFrameExtractor(output_dir=workdir, auto_detect_performance=False)
+
+        try:
+            for resolution in resolutions:
+                width, height = RESOLUTIONS[resolution]
+                for fps in frame_rates:
+                    case = f"{resolution}@{fps}"
+                    video_path = os.path.join(video_dir, f"synthetic_{resolution}_{fps}fps_{duration:g}s.mp4")
+                    if not os.path.exists(video_path):
+                        generate_synthetic_video(video_path, duration, width, height, fps, seed=BENCHMARK_SEED)
+
+                    print(f"⏱️ {case} ...")
+                    cases[case] = benchmark_video(extractor, video_path, workdir, repeat, sample_limit)
+        finally:
+            extractor.thread_pool.shutdown(wait=True)
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'duration': duration,
+            'repeat': repeat,
+            'sample_limit': sample_limit,
+            'max_resolution': list(DEFAULT_MAX_RESOLUTION),
+            'seed': BENCHMARK_SEED
+        },
+        'cases': cases
+    }
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线对比，返回吞吐下降超过 tolerance 的阶段"""
+    regressions = []
+    for case, stages in report['cases'].items():
+        baseline_stages = baseline.get('cases', {}).get(case, {})
+        for stage, metrics in stages.items():
+            reference = baseline_stages.get(stage, {}).get('per_second')
+            if not reference:
+                continue
+            ratio = metrics['per_second'] / reference
+            metrics['baseline_ratio'] = ratio
+            if ratio < 1 - tolerance:
+                regressions.append(f"{case} {stage}: {metrics['per_second']:.1f}/s "
+                                   f"(基线 {reference:.1f}/s, {ratio:.0%})")
+    return regressions
+
+def print_report(report: Dict[str, Any]):
+    """打印结果表"""
+    print(f"\n{'用例':<12}{'阶段':<26}{'吞吐/s':>12}{'峰值RSS(MB)':>14}{'解码帧/总帧':>14}")
+    for case, stages in report['cases'].items():
+        for stage, metrics in stages.items():
+            decoded = ''
+            if 'frames_decoded' in metrics:
+                decoded = f"{metrics['frames_decoded']}/{metrics['units']}"
+            print(f"{case:<12}{stage:<26}{metrics['per_second']:>12.1f}{metrics['peak_rss_mb']:>14.1f}{decoded:>14}")
+
+def main():
+    """基准测试入口"""
+    parser = argparse.ArgumentParser(description="AsyncFrameExtractor 热点路径微基准测试")
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS), help="逗号分隔: 480p,1080p,4k")
+    parser.add_argument('--fps', default=','.join(str(f) for f in FRAME_RATES), help="逗号分隔: 24,30,60")
+    parser.add_argument('--duration', type=float, default=4.0, help="合成视频时长（秒）")
+    parser.add_argument('--repeat', type=int, default=3, help="每个阶段重复次数（取最快一次）")
+    parser.add_argument('--sample-limit', type=int, default=60, help="逐帧阶段使用的候选帧数量")
+    parser.add_argument('--video-dir', help="合成视频缓存目录（默认使用临时目录）")
+    parser.add_argument('--output', help="结果JSON输出路径")
+    parser.add_argument('--save-baseline', help="将本次结果保存为基线")
+    parser.add_argument('--compare', help="与指定基线JSON对比")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="允许的吞吐下降比例")
+    parser.add_argument('--startup', action='store_true', help="只测量导入和构造耗时并与预算对比")
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = measure_startup()
+        print(f"🚀 导入 {startup['import_ms']:.1f}ms（预算 {startup['budget_ms']['import']}ms）| "
+              f"构造 {startup['construct_ms']:.1f}ms（预算 {startup['budget_ms']['construct']}ms）")
+        for line in startup['violations']:
+            print(f"  ❌ {line}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(startup, f, ensure_ascii=False, indent=2)
+        return 1 if startup['violations'] else 0
+
+    resolutions = [r.strip().lower() for r in args.resolutions.split(',') if r.strip()]
+    unknown = [r for r in resolutions if r not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"未知分辨率: {', '.join(unknown)}")
+    frame_rates = [int(f) for f in args.fps.split(',') if f.strip()]
+
+    report = run_benchmarks(resolutions, frame_rates, args.duration, args.repeat,
+                            args.sample_limit, args.video_dir)
+    print_report(report)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 处性能回退（容差 {args.tolerance:.0%}）:")
+            for line in regressions:
+                print(f"  {line}")
+            exit_code = 1
+        else:
+            print(f"\n✅ 与基线相比无性能回退（容差 {args.tolerance:.0%}）")
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {path}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
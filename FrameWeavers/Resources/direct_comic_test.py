@@ -103,10 +103,11 @@ def test_direct_comic_generation():
     except Exception as e:
         print(f"❌ 测试异常: {str(e)}")
 
-def monitor_progress(base_url: str, task_id: str, max_wait: int = 3000):
-    """监控任务进度"""
+def monitor_progress(base_url: str, task_id: str, max_wait: int = 3000, long_poll_wait: int = 30):
+    """监控任务进度（优先使用长轮询，服务端不支持时退回2秒轮询）"""
     start_time = time.time()
     last_progress = -1
+    version = 0
     
     stage_descriptions = {
         'initializing': '初始化中',
@@ -118,7 +119,11 @@ def monitor_progress(base_url: str, task_id: str, max_wait: int = 3000):
     
     while time.time() - start_time < max_wait:
         try:
-            response = requests.get(f'{base_url}/api/task/status/{task_id}')
+            response = requests.get(
+                f'{base_url}/api/task/status/{task_id}',
+                params={'wait': long_poll_wait, 'since_version': version},
+                timeout=long_poll_wait + 10
+            )
             
             if response.status_code == 200:
                 status_data = response.json()
@@ -140,6 +145,12 @@ def monitor_progress(base_url: str, task_id: str, max_wait: int = 3000):
                     error = status_data.get('error', '未知错误')
                     print(f"   ❌ 处理失败: {error}")
                     return {'success': False, 'error': error}
+                
+                # 版本号前进说明服务端支持长轮询，可立即发起下一次请求
+                new_version = status_data.get('version', version)
+                if new_version > version:
+                    version = new_version
+                    continue
             
             time.sleep(2)
             
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化任务队列 - 基于嵌入式SQLite
+
+上传API把任务写入队列，任意数量的工作进程（同一台机器或共享文件系统的多台机器）
+通过租约领取任务：
+- 领取任务时写入 lease_owner 和 lease_expires，租约期内其他工作进程看不到该任务
+- 工作进程定期心跳延长租约；进程崩溃后租约过期，任务自动重新可见并被其他进程领取
+- 超过最大尝试次数的任务标记为 failed，不再重试
+- 任务状态字段（status/progress/message...）以JSON保存在 state 列，
+  上传API按 seq 增量同步，SSE和长轮询接口保持不变
+- 按 device_id 加权公平调度（虚拟时间起止标签，成本为上传字节数/权重），
+  并限制每个设备同时处理的任务数，大量长视频不会挤占其他设备的小任务
+
+注意：SQLite依赖文件锁，NFS等网络文件系统上的锁不可靠，
+多机部署时请把数据库放在支持POSIX锁的共享存储上。
+"""
+
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, Any, List, Optional
+
+# 队列默认配置
+DEFAULT_LEASE_SECONDS = 60       # 租约时长（可见性超时）
+DEFAULT_MAX_ATTEMPTS = 3         # 单个任务最多被领取次数
+SQLITE_BUSY_TIMEOUT_MS = 10000   # 写锁等待时间
+
+# 公平调度默认配置
+DEFAULT_DEVICE_WEIGHT = 1.0      # 设备权重，越大分到的处理份额越多
+DEFAULT_DEVICE_MAX_CONCURRENT = 2  # 单个设备同时处理的任务数上限
+COST_UNIT_BYTES = 1024 * 1024    # 任务成本单位（按上传字节数计）
+
+# 任务在队列中的生命周期
+JOB_QUEUED = 'queued'
+JOB_LEASED = 'leased'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_FINAL_STATES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    device_id TEXT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    cost REAL NOT NULL DEFAULT 1,
+    weight REAL NOT NULL DEFAULT 1,
+    max_concurrent INTEGER NOT NULL DEFAULT 1,
+    vstart REAL NOT NULL DEFAULT 0,
+    vfinish REAL NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, vfinish);
+CREATE INDEX IF NOT EXISTS idx_jobs_device ON jobs (device_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs (seq);
+CREATE TABLE IF NOT EXISTS queue_meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+def job_cost(total_bytes: int) -> float:
+    """任务成本：按上传字节数计，至少为1，避免空文件任务插队"""
+    return max(total_bytes / COST_UNIT_BYTES, 1.0)
+
+
+class FairTaskScheduler:
+    """进程内加权公平调度器（非队列模式的上传API使用）
+
+    与 JobQueue.lease 相同的起止标签算法：
+    新任务起始标签 = max(当前虚拟时间, 该设备最后一个待处理任务的结束标签)，
+    结束标签 = 起始标签 + 成本/权重；有空闲槽位时派发结束标签最小、且设备未达并发上限的任务。
+    小任务的结束标签小，即使重度用户排了很多长任务也能很快被派发。
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pending = []                      # (vfinish, 序号, 任务)
+        self._counter = itertools.count()
+        self._running = defaultdict(int)        # device_id -> 运行中任务数
+        self._last_finish = {}                  # device_id -> 最后一个待处理任务的结束标签
+        self._vtime = 0.0
+
+    def submit(self, device_id: str, cost: float, run: Callable[[], None],
+               weight: float = DEFAULT_DEVICE_WEIGHT, max_concurrent: int = DEFAULT_DEVICE_MAX_CONCURRENT):
+        """提交任务，run 在调度到后于独立线程中执行"""
+        with self._lock:
+            vstart = max(self._vtime, self._last_finish.get(device_id, 0.0))
+            vfinish = vstart + cost / max(weight, 1e-6)
+            self._last_finish[device_id] = vfinish
+            heapq.heappush(self._pending, (vfinish, next(self._counter), {
+                'device_id': device_id, 'vstart': vstart, 'vfinish': vfinish,
+                'max_concurrent': max_concurrent, 'run': run
+            }))
+        self._dispatch()
+
+    def _dispatch(self):
+        """在槽位允许时派发可运行的任务（达到并发上限的设备暂时跳过）"""
+        to_start = []
+        with self._lock:
+            skipped = []
+            while self._pending and sum(self._running.values()) + len(to_start) < self.slots:
+                entry = heapq.heappop(self._pending)
+                job = entry[2]
+                device_id = job['device_id']
+                starting = sum(1 for started in to_start if started['device_id'] == device_id)
+                if self._running[device_id] + starting >= job['max_concurrent']:
+                    skipped.append(entry)
+                    continue
+                self._vtime = max(self._vtime, job['vstart'])
+                to_start.append(job)
+            for entry in skipped:
+                heapq.heappush(self._pending, entry)
+            for job in to_start:
+                self._running[job['device_id']] += 1
+
+        for job in to_start:
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        try:
+            job['run']()
+        finally:
+            device_id = job['device_id']
+            with self._lock:
+                self._running[device_id] -= 1
+                if not self._running[device_id]:
+                    del self._running[device_id]
+                    # 设备空闲后不保留历史标签，下次提交从当前虚拟时间开始
+                    if not any(entry[2]['device_id'] == device_id for entry in self._pending):
+                        self._last_finish.pop(device_id, None)
+            self._dispatch()
+
+    def pending_count(self, device_id: str = None) -> int:
+        """排队中的任务数"""
+        with self._lock:
+            return sum(1 for entry in self._pending if device_id is None or entry[2]['device_id'] == device_id)
+
+
+class DeviceUploadQuota:
+    """按设备统计最近一分钟的上传字节数（滑动窗口）"""
+
+    WINDOW_SECONDS = 60
+
+    def __init__(self, bytes_per_minute: int):
+        self.bytes_per_minute = bytes_per_minute
+        self._lock = threading.Lock()
+        self._events = defaultdict(deque)  # device_id -> deque[(时间, 字节数)]
+
+    def _window(self, device_id: str, now: float) -> deque:
+        """返回设备窗口内的记录，先移除过期记录（调用方持有锁）"""
+        events = self._events[device_id]
+        while events and now - events[0][0] >= self.WINDOW_SECONDS:
+            events.popleft()
+        return events
+
+    def check(self, device_id: str, nbytes: int = 0) -> Optional[float]:
+        """只检查不记账：再上传 nbytes 字节不超额时返回 None，否则返回建议的重试等待秒数"""
+        if not self.bytes_per_minute:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            events = self._window(device_id, now)
+            used = sum(size for _, size in events)
+            if used + nbytes <= self.bytes_per_minute:
+                return None
+            if nbytes > self.bytes_per_minute:
+                # 单次请求就超过额度，无论等多久都不会成功
+                return float('inf')
+            # 等到足够多的旧记录移出窗口
+            for timestamp, size in events:
+                used -= size
+                if used + nbytes <= self.bytes_per_minute:
+                    return max(self.WINDOW_SECONDS - (now - timestamp), 0.0)
+            return float(self.WINDOW_SECONDS)
+
+    def available(self, device_id: str) -> float:
+        """设备当前窗口内还能上传的字节数（不限额时为 inf）"""
+        if not self.bytes_per_minute:
+            return float('inf')
+        with self._lock:
+            used = sum(size for _, size in self._window(device_id, time.monotonic()))
+        return max(self.bytes_per_minute - used, 0)
+
+    def consume(self, device_id: str, nbytes: int):
+        """记入实际接收的字节数
+
+        上传被接受后才调用，被拒绝或中途断开的请求不占用额度；
+        分块传输（无 Content-Length）的请求同样按实际字节数记账。
+        """
+        if not self.bytes_per_minute or nbytes <= 0:
+            return
+        with self._lock:
+            self._events[device_id].append((time.monotonic(), nbytes))
+
+
+class JobQueue:
+    """SQLite任务队列
+
+    每个线程使用独立连接；所有状态变更都在 BEGIN IMMEDIATE 事务内完成，
+    多进程同时领取时由SQLite写锁保证同一任务只被一个工作进程拿到。
+    每次变更都会把 seq 设为全表最大值加一，供 changed_since() 增量读取。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.db_path = os.path.abspath(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的连接（自动提交模式，事务显式开启）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        """在写事务中执行 fn(conn)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _next_seq(conn) -> int:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['state'] = json.loads(job['state'])
+        return job
+
+    def _update(self, conn, job_id: str, where: str, params: tuple, state: Dict = None,
+                **columns) -> bool:
+        """更新一行（满足 where 条件时），可合并 state 字段"""
+        row = conn.execute(f"SELECT state FROM jobs WHERE id = ? AND {where}",
+                           (job_id, *params)).fetchone()
+        if row is None:
+            return False
+        if state:
+            merged = json.loads(row['state'])
+            merged.update(state)
+            columns['state'] = json.dumps(merged, ensure_ascii=False, default=str)
+        columns['seq'] = self._next_seq(conn)
+        columns['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in columns)
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+        return True
+
+    # =========================================================================
+    # 生产者接口
+    # =========================================================================
+
+    @staticmethod
+    def _vtime(conn) -> float:
+        row = conn.execute("SELECT value FROM queue_meta WHERE key = 'vtime'").fetchone()
+        return row[0] if row else 0.0
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any], device_id: str = None,
+                state: Dict[str, Any] = None, max_attempts: int = None, cost: float = 1.0,
+                weight: float = DEFAULT_DEVICE_WEIGHT,
+                max_concurrent: int = DEFAULT_DEVICE_MAX_CONCURRENT):
+        """写入新任务，并按设备计算公平调度的起止标签（见 FairTaskScheduler）"""
+        now = time.time()
+
+        def insert(conn):
+            last_finish = conn.execute(
+                "SELECT MAX(vfinish) FROM jobs WHERE device_id IS ? AND status IN (?, ?)",
+                (device_id, JOB_QUEUED, JOB_LEASED)
+            ).fetchone()[0]
+            vstart = max(self._vtime(conn), last_finish or 0.0)
+            conn.execute(
+                "INSERT INTO jobs (id, device_id, payload, state, status, max_attempts, cost, weight, "
+                "max_concurrent, vstart, vfinish, seq, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, device_id, json.dumps(payload, ensure_ascii=False),
+                 json.dumps(state or {}, ensure_ascii=False, default=str), JOB_QUEUED,
+                 max_attempts or self.max_attempts, cost, weight, max_concurrent,
+                 vstart, vstart + cost / max(weight, 1e-6), self._next_seq(conn), now, now)
+            )
+
+        self._transaction(insert)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """取消未结束的任务，返回取消前的队列状态（任务不存在或已结束时返回None）
+
+        排队中的任务不会再被领取；正在运行的工作进程会在下次心跳时得知。
+        """
+        def mark(conn):
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or not self._update(
+                conn, job_id, "status IN (?, ?)", (JOB_QUEUED, JOB_LEASED),
+                state={'status': 'cancelled', 'message': '任务已取消'},
+                status=JOB_CANCELLED, lease_owner=None, lease_expires=None
+            ):
+                return None
+            return row['status']
+
+        return self._transaction(mark)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取单个任务"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def changed_since(self, seq: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """读取 seq 之后变更过的任务（按 seq 升序）"""
+        rows = self._connect().execute(
+            "SELECT * FROM jobs WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def active_count(self, device_id: str) -> int:
+        """设备排队中和处理中的任务数"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE device_id IS ? AND status IN (?, ?)",
+            (device_id, JOB_QUEUED, JOB_LEASED)
+        ).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """按队列状态统计任务数"""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    # =========================================================================
+    # 工作进程接口
+    # =========================================================================
+
+    def lease(self, worker_id: str, lease_seconds: float = None) -> Optional[Dict[str, Any]]:
+        """领取一个任务：排队中的任务，或租约已过期（工作进程崩溃）的任务
+
+        按结束标签从小到大选择，跳过已达并发上限的设备；
+        过期任务已用完尝试次数时直接标记为 failed。
+        """
+        lease_seconds = lease_seconds or self.lease_seconds
+
+        def take(conn):
+            now = time.time()
+            exhausted = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (JOB_LEASED, now)
+            ).fetchall()
+            for (job_id,) in exhausted:
+                self._update(conn, job_id, "1", (), status=JOB_FAILED, lease_owner=None,
+                             lease_expires=None, error='工作进程多次失联，超过最大尝试次数',
+                             state={'status': 'error', 'message': '处理失败: 工作进程多次失联',
+                                    'error': '工作进程多次失联'})
+
+            row = conn.execute(
+                "SELECT * FROM jobs AS j WHERE (j.status = ? OR (j.status = ? AND j.lease_expires < ?)) "
+                "AND (SELECT COUNT(*) FROM jobs AS r WHERE r.device_id IS j.device_id AND r.status = ? "
+                "AND r.lease_expires >= ?) < j.max_concurrent "
+                "ORDER BY j.vfinish, j.created_at LIMIT 1",
+                (JOB_QUEUED, JOB_LEASED, now, JOB_LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute("INSERT INTO queue_meta (key, value) VALUES ('vtime', ?) "
+                         "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                         (row['vstart'],))
+
+            self._update(conn, row['id'], "1", (), status=JOB_LEASED, lease_owner=worker_id,
+                         lease_expires=now + lease_seconds, attempts=row['attempts'] + 1)
+            return self._row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?",
+                                                 (row['id'],)).fetchone())
+
+        return self._transaction(take)
+
+    def _owned(self) -> str:
+        return "status = ? AND lease_owner = ?"
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = None) -> bool:
+        """延长租约；任务已被取消或租约已被其他进程接管时返回 False"""
+        lease_seconds = lease_seconds or self.lease_seconds
+        return self._transaction(lambda conn: conn.execute(
+            f"UPDATE jobs SET lease_expires = ? WHERE id = ? AND {self._owned()}",
+            (time.time() + lease_seconds, job_id, JOB_LEASED, worker_id)
+        ).rowcount == 1)
+
+    def update_state(self, job_id: str, worker_id: str, **fields) -> bool:
+        """工作进程写回任务状态字段（仅租约持有者可写）"""
+        return self._transaction(lambda conn: self._update(
+            conn, job_id, self._owned(), (JOB_LEASED, worker_id), state=fields
+        ))
+
+    def complete(self, job_id: str, worker_id: str, **fields) -> bool:
+        """标记任务完成"""
+        return self._transaction(lambda conn: self._update(
+            conn, job_id, self._owned(), (JOB_LEASED, worker_id), state=fields,
+            status=JOB_COMPLETED, lease_owner=None, lease_expires=None
+        ))
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = True, **fields) -> bool:
+        """标记任务失败；未用完尝试次数且 retry=True 时重新排队"""
+        def mark(conn):
+            row = conn.execute(f"SELECT attempts, max_attempts FROM jobs WHERE id = ? AND {self._owned()}",
+                               (job_id, JOB_LEASED, worker_id)).fetchone()
+            if row is None:
+                return False
+            if retry and row['attempts'] < row['max_attempts']:
+                return self._update(conn, job_id, "1", (), status=JOB_QUEUED, lease_owner=None,
+                                    lease_expires=None, error=error,
+                                    state={'status': 'uploaded', 'message': '处理中断，等待重试...'})
+            return self._update(conn, job_id, "1", (), state=fields, status=JOB_FAILED,
+                                lease_owner=None, lease_expires=None, error=error)
+
+        return self._transaction(mark)
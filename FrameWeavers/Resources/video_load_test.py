@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频上传负载测试脚本 - 基于 VideoUploadTester
+
+在本地启动（或连接已有的）video_upload_api 实例，用N个并发模拟设备上传
+合成视频，统计上传吞吐、任务完成耗时、状态查询延迟分位数以及服务端CPU/内存，
+并输出JSON报告用于不同版本之间对比。
+
+使用方法:
+python video_load_test.py --devices 20 --duration 10 --resolution 1280x720 --fps 30
+python video_load_test.py --server asgi --devices 50 --label build-42
+python video_load_test.py --base-url http://localhost:5001 --server-pid 12345
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import concurrent.futures
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import psutil
+import requests
+
+from async_frame_extractor_benchmark import generate_synthetic_video
+from video_upload_test import VideoUploadTester
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TERMINAL_STATUSES = {'completed', 'error', 'cancelled'}
+
+# =============================================================================
+# 统计工具
+# =============================================================================
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """线性插值分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """汇总延迟分布"""
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None
+    }
+
+class ServerResourceSampler:
+    """服务端资源采样器（包含调试模式重载器等子进程）"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self) -> List[psutil.Process]:
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            return []
+
+    def _run(self):
+        # cpu_percent 第一次调用只建立基线
+        known = {}
+        while not self._stop.is_set():
+            cpu_total = 0.0
+            rss_total = 0
+            for proc in self._processes():
+                try:
+                    if proc.pid not in known:
+                        known[proc.pid] = proc
+                        proc.cpu_percent(None)
+                        continue
+                    cpu_total += known[proc.pid].cpu_percent(None)
+                    rss_total += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.samples.append({'time': time.time(), 'cpu_percent': cpu_total, 'rss_bytes': rss_total})
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        """停止采样并返回汇总"""
+        self._stop.set()
+        self._thread.join(timeout=self.interval * 4)
+        cpu = [s['cpu_percent'] for s in self.samples]
+        rss = [s['rss_bytes'] for s in self.samples]
+        return {
+            'samples': len(self.samples),
+            'cpu_percent_mean': sum(cpu) / len(cpu) if cpu else None,
+            'cpu_percent_max': max(cpu) if cpu else None,
+            'rss_mb_mean': sum(rss) / len(rss) / (1024 * 1024) if rss else None,
+            'rss_mb_max': max(rss) / (1024 * 1024) if rss else None
+        }
+
+# =============================================================================
+# 模拟设备
+# =============================================================================
+
+class LoadTestDevice(VideoUploadTester):
+    """负载测试中的单个模拟设备"""
+
+    def __init__(self, base_url: str, status_interval: float = 0.5,
+                 task_timeout: float = 600, verbose: bool = False):
+        super().__init__(base_url)
+        self.device_id = f"load_test_{uuid.uuid4().hex[:8]}"
+        self.status_interval = status_interval
+        self.task_timeout = task_timeout
+        self.verbose = verbose
+        self.session = requests.Session()
+
+    def log(self, message: str, level: str = "INFO"):
+        """负载测试默认只打印警告和错误"""
+        if self.verbose or level != "INFO":
+            super().log(f"[{self.device_id}] {message}", level)
+
+    def run_once(self, video_path: str) -> Dict[str, Any]:
+        """上传一次并等待任务结束，返回计时结果"""
+        file_info = self.check_file_info(video_path)
+        record = {
+            'device_id': self.device_id,
+            'success': False,
+            'upload_bytes': file_info.get('size_bytes', 0),
+            'status_latencies': []
+        }
+        if not file_info.get("exists"):
+            record['error'] = file_info.get("error")
+            return record
+
+        start_time = time.time()
+        try:
+            with open(video_path, 'rb') as video_file:
+                response = self.session.post(
+                    f'{self.base_url}/api/upload/videos',
+                    files={'videos': (file_info['name'], video_file, 'video/mp4')},
+                    data={'device_id': self.device_id},
+                    timeout=self.task_timeout
+                )
+        except requests.exceptions.RequestException as e:
+            record['error'] = f"上传异常: {str(e)}"
+            self.log(record['error'], "ERROR")
+            return record
+
+        record['upload_time'] = time.time() - start_time
+        if response.status_code != 200 or not response.json().get('success'):
+            record['error'] = f"HTTP {response.status_code}: {response.text[:200]}"
+            self.log(record['error'], "ERROR")
+            return record
+
+        task_id = response.json().get('task_id')
+        record['task_id'] = task_id
+        self.log(f"上传完成，任务ID: {task_id}")
+
+        # 固定间隔查询状态，记录每次查询的响应延迟
+        while time.time() - start_time < self.task_timeout:
+            request_start = time.time()
+            try:
+                status_response = self.session.get(f'{self.base_url}/api/task/status/{task_id}', timeout=30)
+            except requests.exceptions.RequestException as e:
+                self.log(f"状态查询异常: {str(e)}", "WARNING")
+                time.sleep(self.status_interval)
+                continue
+            record['status_latencies'].append(time.time() - request_start)
+
+            status = status_response.json().get('status') if status_response.status_code == 200 else None
+            if status in TERMINAL_STATUSES:
+                record['final_status'] = status
+                record['time_to_complete'] = time.time() - start_time
+                record['success'] = status == 'completed'
+                if not record['success']:
+                    record['error'] = status_response.json().get('message')
+                return record
+
+            time.sleep(self.status_interval)
+
+        record['error'] = '任务等待超时'
+        self.log(record['error'], "WARNING")
+        return record
+
+# =============================================================================
+# 负载测试
+# =============================================================================
+
+def start_local_server(server: str, port: int, workdir: str) -> subprocess.Popen:
+    """在独立工作目录中启动本地 video_upload_api 实例"""
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG='0')
+    if server == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'video_upload_asgi:app',
+                   '--app-dir', SCRIPT_DIR, '--host', '127.0.0.1', '--port', str(port)]
+    else:
+        command = [sys.executable, os.path.join(SCRIPT_DIR, 'video_upload_api.py')]
+
+    return subprocess.Popen(command, cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_for_server(base_url: str, timeout: float = 60) -> bool:
+    """等待服务器可以响应请求"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{base_url}/", timeout=2)
+            return True
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+    return False
+
+def run_load_test(base_url: str, video_path: str, devices: int, rounds: int,
+                  status_interval: float, task_timeout: float, server_pid: Optional[int] = None,
+                  verbose: bool = False) -> Dict[str, Any]:
+    """N个并发设备各上传 rounds 次，返回汇总结果"""
+    sampler = ServerResourceSampler(server_pid) if server_pid else None
+    if sampler:
+        sampler.start()
+
+    def device_worker(_) -> List[Dict[str, Any]]:
+        device = LoadTestDevice(base_url, status_interval, task_timeout, verbose)
+        return [device.run_once(video_path) for _ in range(rounds)]
+
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=devices) as pool:
+        records = [record for batch in pool.map(device_worker, range(devices)) for record in batch]
+    wall_time = time.time() - start_time
+
+    server_resources = sampler.stop() if sampler else None
+
+    uploaded = [r for r in records if 'upload_time' in r]
+    completed = [r for r in records if r['success']]
+    upload_bytes = sum(r['upload_bytes'] for r in uploaded)
+    upload_time_total = sum(r['upload_time'] for r in uploaded)
+
+    return {
+        'wall_time_seconds': wall_time,
+        'total_uploads': len(records),
+        'successful_uploads': len(uploaded),
+        'completed_tasks': len(completed),
+        'failed_tasks': len(records) - len(completed),
+        'upload_throughput': {
+            'aggregate_mb_per_second': upload_bytes / wall_time / (1024 * 1024) if wall_time > 0 else None,
+            'per_upload_mb_per_second': (upload_bytes / upload_time_total / (1024 * 1024)
+                                         if upload_time_total > 0 else None),
+            'upload_time_seconds': summarize([r['upload_time'] for r in uploaded])
+        },
+        'time_to_complete_seconds': summarize([r['time_to_complete'] for r in completed]),
+        'status_latency_seconds': summarize([lat for r in records for lat in r['status_latencies']]),
+        'server_resources': server_resources,
+        'errors': [r['error'] for r in records if r.get('error')][:50]
+    }
+
+def main():
+    """负载测试入口"""
+    parser = argparse.ArgumentParser(description="video_upload_api 负载测试")
+    parser.add_argument('--base-url', help="已运行服务的地址；不指定时启动本地实例")
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask', help="启动的本地服务类型")
+    parser.add_argument('--port', type=int, default=5055, help="本地服务端口")
+    parser.add_argument('--server-pid', type=int, help="已运行服务的进程ID（用于采集CPU/内存）")
+    parser.add_argument('--devices', type=int, default=10, help="并发模拟设备数")
+    parser.add_argument('--rounds', type=int, default=1, help="每个设备上传次数")
+    parser.add_argument('--duration', type=float, default=10.0, help="合成视频时长（秒）")
+    parser.add_argument('--resolution', default='1280x720', help="合成视频分辨率，如 1920x1080")
+    parser.add_argument('--fps', type=float, default=30.0, help="合成视频帧率")
+    parser.add_argument('--status-interval', type=float, default=0.5, help="状态查询间隔（秒）")
+    parser.add_argument('--task-timeout', type=float, default=600.0, help="单个任务最长等待时间（秒）")
+    parser.add_argument('--label', default='', help="构建标识，写入报告便于对比")
+    parser.add_argument('--report', help="报告输出路径（JSON）")
+    parser.add_argument('--verbose', action='store_true', help="打印每个设备的详细日志")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+
+    with tempfile.TemporaryDirectory(prefix="load_test_") as workdir:
+        print(f"🎞️ 生成合成视频: {args.duration}s {width}x{height} @ {args.fps}fps")
+        video_path = generate_synthetic_video(
+            os.path.join(workdir, 'synthetic.mp4'), args.duration, width, height, args.fps
+        )
+
+        server_process = None
+        base_url = args.base_url
+        server_pid = args.server_pid
+        if not base_url:
+            base_url = f"http://127.0.0.1:{args.port}"
+            server_process = start_local_server(args.server, args.port, workdir)
+            server_pid = server_process.pid
+            if not wait_for_server(base_url):
+                server_process.terminate()
+                print("❌ 本地服务启动失败")
+                return 1
+
+        try:
+            print(f"🔥 开始负载测试: {args.devices} 个设备 × {args.rounds} 次 → {base_url}")
+            summary = run_load_test(
+                base_url, video_path, args.devices, args.rounds,
+                args.status_interval, args.task_timeout, server_pid, args.verbose
+            )
+        finally:
+            if server_process:
+                server_process.terminate()
+                server_process.wait(timeout=10)
+
+    report = {
+        'label': args.label,
+        'timestamp': datetime.now().isoformat(),
+        'config': {
+            'server': args.server if not args.base_url else 'external',
+            'base_url': base_url,
+            'devices': args.devices,
+            'rounds': args.rounds,
+            'video': {'duration': args.duration, 'width': width, 'height': height, 'fps': args.fps},
+            'status_interval': args.status_interval
+        },
+        'results': summary
+    }
+
+    report_path = args.report or f"load_test_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    latency = summary['status_latency_seconds']
+    print("\n📊 负载测试结果:")
+    print(f"完成任务: {summary['completed_tasks']}/{summary['total_uploads']}")
+    print(f"上传吞吐: {summary['upload_throughput']['aggregate_mb_per_second'] or 0:.2f} MB/s")
+    if latency['count']:
+        print(f"状态查询延迟: p50 {latency['p50'] * 1000:.1f}ms | "
+              f"p95 {latency['p95'] * 1000:.1f}ms | p99 {latency['p99'] * 1000:.1f}ms")
+    print(f"报告已保存: {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,229 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, send_file
 from werkzeug.utils import secure_filename
 import os
+import logging
 import uuid
+import asyncio
 import threading
 import time
 from datetime import datetime
 
+from async_frame_extractor import AsyncFrameExtractor, AsyncFrameExtractorConfig, CancellationToken, DerivativeCache
+from video_job_queue import (
+    JobQueue, FairTaskScheduler, DeviceUploadQuota, job_cost, DEFAULT_DEVICE_WEIGHT, JOB_QUEUED
+)
+from video_upload_common import (
+    FRAMES_FOLDER, MAX_CONTENT_LENGTH,
+    LONG_POLL_MAX_WAIT, SSE_HEARTBEAT_INTERVAL, SSE_RETRY_MS, TERMINAL_STATUSES,
+    MAX_PROCESSING_TASKS, DEVICE_MAX_CONCURRENT, DEVICE_UPLOAD_BYTES_PER_MINUTE, DEVICE_WEIGHTS,
+    FRAME_CACHE_MAX_AGE, FRAME_BATCH_MAX_FILES,
+    allowed_file, extraction_options, format_sse_event, task_upload_dir, remove_task_files,
+    resolve_frame, read_packed_frame, frame_mimetype, parse_resize_args, derivative_key, make_derivative,
+    frame_batch_etag, iter_frame_batch
+)
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
-# 配置
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'wmv', 'flv', '3gp'}
-MAX_CONTENT_LENGTH = 800 * 1024 * 1024  # 500MB
+# 队列模式：设置 JOB_QUEUE_PATH 后上传只写入持久化队列，由 video_worker.py 工作进程处理
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH')
+QUEUE_SYNC_INTERVAL = 0.5        # 从队列同步任务状态的间隔（秒）
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-# 确保上传目录存在
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# 确保输出目录存在（上传文件保存在各任务目录下）
+os.makedirs(FRAMES_FOLDER, exist_ok=True)
 
 # 任务状态存储
 task_status = {}
+# 任务进度通道（版本号 + 条件变量），用于SSE推送和长轮询
+task_channels = {}
+# 任务取消令牌，取消接口通过它通知正在运行的抽帧器
+task_cancel_tokens = {}
+
+job_queue = JobQueue(JOB_QUEUE_PATH) if JOB_QUEUE_PATH else None
+task_scheduler = FairTaskScheduler(MAX_PROCESSING_TASKS)
+upload_quota = DeviceUploadQuota(DEVICE_UPLOAD_BYTES_PER_MINUTE)
+
+# 按需缩放：派生图在共享抽帧器的线程池中生成（线程池首次使用时才创建），结果进入磁盘LRU缓存
+shared_extractor = AsyncFrameExtractor(output_dir=FRAMES_FOLDER, auto_detect_performance=False)
+derivative_cache = DerivativeCache(os.path.join(FRAMES_FOLDER, AsyncFrameExtractorConfig.DERIVATIVE_CACHE_SUBDIR))
+
+class TaskProgressChannel:
+    """单个任务的进度通道
+    
+    每次状态变更版本号加一并唤醒所有等待者，
+    SSE流和长轮询请求都通过 wait() 阻塞到有新版本为止。
+    """
+    
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+    
+    def publish(self, status, **fields):
+        """更新状态字段并通知等待者"""
+        with self.condition:
+            status.update(fields)
+            self.version += 1
+            status['version'] = self.version
+            self.condition.notify_all()
+    
+    def snapshot(self, status):
+        """获取当前版本和状态副本"""
+        with self.condition:
+            return self.version, dict(status)
+    
+    def wait(self, status, since_version, timeout):
+        """等待版本号超过 since_version（或任务已结束），返回版本和状态副本"""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.version > since_version or status.get('status') in TERMINAL_STATUSES,
+                timeout=timeout
+            )
+            return self.version, dict(status)
+
+def create_task_status(task_id, **fields):
+    """初始化任务状态及其进度通道"""
+    task_status[task_id] = {}
+    task_channels[task_id] = TaskProgressChannel()
+    task_cancel_tokens[task_id] = CancellationToken()
+    task_channels[task_id].publish(task_status[task_id], **fields)
+
+def update_task_status(task_id, **fields):
+    """更新任务状态并推送给所有订阅者"""
+    task_channels[task_id].publish(task_status[task_id], **fields)
+
+def load_queued_task(task_id):
+    """队列模式下本进程没有该任务时（如由其他API节点接收），从队列加载状态"""
+    if task_id in task_status or job_queue is None:
+        return task_id in task_status
+    job = job_queue.get(task_id)
+    if job is None:
+        return False
+    create_task_status(task_id, **job['state'])
+    return True
 
-def allowed_file(filename):
-    """检查文件扩展名是否允许"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def sync_queue_status():
+    """后台线程：按 seq 增量读取队列变更，推送给本进程的SSE和长轮询订阅者"""
+    seq = 0
+    while True:
+        try:
+            for job in job_queue.changed_since(seq):
+                seq = job['seq']
+                if job['id'] in task_status:
+                    update_task_status(job['id'], **job['state'])
+        except Exception as e:
+            logger.warning(f"队列状态同步失败: {e}")
+        time.sleep(QUEUE_SYNC_INTERVAL)
+
+def enqueue_task(task_id, device_id, saved_files):
+    """把任务写入持久化队列；文件路径转为绝对路径，供其他工作目录/节点的工作进程使用"""
+    files = [{**video_file, 'filepath': os.path.abspath(video_file['filepath'])} for video_file in saved_files]
+    job_queue.enqueue(
+        task_id,
+        {'files': files, 'frames_folder': os.path.abspath(FRAMES_FOLDER),
+         'options': task_status[task_id].get('options', {})},
+        device_id=device_id,
+        state={key: value for key, value in task_status[task_id].items() if key != 'version'},
+        cost=job_cost(sum(video_file['size'] for video_file in saved_files)),
+        weight=DEVICE_WEIGHTS.get(device_id, DEFAULT_DEVICE_WEIGHT),
+        max_concurrent=DEVICE_MAX_CONCURRENT
+    )
+
+def schedule_task(task_id, device_id, saved_files):
+    """交给进程内公平调度器，槽位空闲且设备未达并发上限时在独立线程中处理"""
+    task_scheduler.submit(
+        device_id,
+        job_cost(sum(video_file['size'] for video_file in saved_files)),
+        lambda: process_videos_async(task_id, saved_files),
+        weight=DEVICE_WEIGHTS.get(device_id, DEFAULT_DEVICE_WEIGHT),
+        max_concurrent=DEVICE_MAX_CONCURRENT
+    )
+
+def make_progress_callback(task_id, total_files):
+    """创建抽帧器进度回调，把 AsyncProgressMonitor 的进度写入任务状态"""
+    cancel_token = task_cancel_tokens[task_id]
+    
+    async def on_progress(progress_data):
+        if cancel_token.cancelled:
+            return
+        
+        completed = progress_data['completed_files']
+        current_progress = progress_data['current_file_progress']
+        progress = progress_data['overall_progress']
+        if current_progress < 100:
+            progress += current_progress / max(total_files, 1)
+        
+        update_task_status(
+            task_id,
+            progress=min(int(progress), 99),
+            message=f'正在处理第 {min(completed + 1, total_files)}/{total_files} 个视频...'
+        )
+    
+    return on_progress
+
+async def extract_task_frames(task_id, video_files):
+    """在当前事件循环上运行抽帧器"""
+    async with AsyncFrameExtractor(output_dir=FRAMES_FOLDER, auto_detect_performance=False) as extractor:
+        return await extractor.process_and_format_async(
+            [video_file['filepath'] for video_file in video_files],
+            device_id=task_status[task_id].get('device_id'),
+            task_id=task_id,
+            progress_callback=make_progress_callback(task_id, len(video_files)),
+            cancel_token=task_cancel_tokens[task_id],
+            **task_status[task_id].get('options', {})
+        )
 
 def process_videos_async(task_id, video_files):
     """异步处理视频的后台任务"""
+    cancel_token = task_cancel_tokens[task_id]
+    
     try:
-        task_status[task_id]['status'] = 'processing'
-        task_status[task_id]['message'] = '正在为您织造回忆，请稍候...'
-        
-        # 模拟视频处理过程
-        for i, video_file in enumerate(video_files):
-            # 更新进度
-            progress = int((i + 1) / len(video_files) * 100)
-            task_status[task_id]['progress'] = progress
-            task_status[task_id]['message'] = f'正在处理第 {i+1}/{len(video_files)} 个视频...'
-            
-            # 这里添加实际的视频处理逻辑
-            # 例如：调用视频帧提取、AI分析等
-            time.sleep(2)  # 模拟处理时间
+        # 排队期间已取消：抽帧器不会运行，由这里清理上传文件
+        if cancel_token.cancelled:
+            remove_task_files(task_id)
+            return
+        
+        update_task_status(task_id, status='processing', message='正在为您织造回忆，请稍候...')
+        
+        result = asyncio.run(extract_task_frames(task_id, video_files))
+        
+        # 已取消的任务保持 cancelled 状态，不再覆盖；抽帧器已清理输出，这里删除上传文件
+        if cancel_token.cancelled:
+            remove_task_files(task_id)
+            return
+        
+        if not result['success']:
+            error = result.get('error', '未知错误')
+            update_task_status(task_id, status='error', message=f'处理失败: {error}', error=error)
+            return
         
         # 处理完成
-        task_status[task_id]['status'] = 'completed'
-        task_status[task_id]['message'] = '回忆织造完成！'
-        task_status[task_id]['progress'] = 100
+        update_task_status(
+            task_id,
+            status='completed',
+            message='回忆织造完成！',
+            progress=100,
+            frame_count=len(result['base_frame_paths']),
+            task_output_dir=result['storage_info']['task_output_directory'],
+            json_result_path=result['storage_info'].get('json_result_path'),
+            sprite_sheets=result['storage_info'].get('sprite_sheets')
+        )
         
     except Exception as e:
-        task_status[task_id]['status'] = 'error'
-        task_status[task_id]['message'] = f'处理失败: {str(e)}'
-        task_status[task_id]['error'] = str(e)
+        if not cancel_token.cancelled:
+            update_task_status(task_id, status='error', message=f'处理失败: {str(e)}', error=str(e))
+
+def quota_exceeded_response(retry_after):
+    """超过设备上传配额时的429响应"""
+    response = jsonify({
+        'success': False,
+        'message': '上传过于频繁，请稍后再试' if retry_after != float('inf') else '单次上传超过设备配额'
+    })
+    if retry_after != float('inf'):
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response, 429
 
 @app.route('/api/upload/videos', methods=['POST'])
 def upload_videos():
@@ -66,6 +237,11 @@ def upload_videos():
                 'message': '缺少设备唯一码'
             }), 400
         
+        # 按设备检查最近一分钟的上传字节数（只检查，上传被接受后才按实际字节数记账）
+        retry_after = upload_quota.check(device_id, request.content_length or 0)
+        if retry_after is not None:
+            return quota_exceeded_response(retry_after)
+        
         # 检查是否有文件
         if 'videos' not in request.files:
             return jsonify({
@@ -103,12 +279,13 @@ def upload_videos():
         
         # 保存文件
         saved_files = []
+        upload_dir = task_upload_dir(task_id)
         for file in valid_files:
             filename = secure_filename(file.filename)
             # 添加时间戳避免文件名冲突
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(upload_dir, filename)
             file.save(filepath)
             saved_files.append({
                 'original_name': file.filename,
@@ -117,23 +294,31 @@ def upload_videos():
                 'size': os.path.getsize(filepath)
             })
         
-        # 初始化任务状态
-        task_status[task_id] = {
-            'status': 'uploaded',
-            'message': '视频上传成功，准备开始处理...',
-            'progress': 0,
-            'files': saved_files,
-            'device_id': device_id,
-            'created_at': datetime.now().isoformat()
-        }
+        # 分块传输没有 Content-Length，按实际保存的字节数再检查一次配额
+        received_bytes = request.content_length or sum(saved['size'] for saved in saved_files)
+        if not request.content_length:
+            retry_after = upload_quota.check(device_id, received_bytes)
+            if retry_after is not None:
+                remove_task_files(task_id)
+                return quota_exceeded_response(retry_after)
+        upload_quota.consume(device_id, received_bytes)
         
-        # 启动异步处理任务
-        thread = threading.Thread(
-            target=process_videos_async, 
-            args=(task_id, saved_files)
+        # 初始化任务状态
+        create_task_status(
+            task_id,
+            status='uploaded',
+            message='视频上传成功，排队等待处理...',
+            progress=0,
+            files=saved_files,
+            device_id=device_id,
+            options=extraction_options(request.form),
+            created_at=datetime.now().isoformat()
         )
-        thread.daemon = True
-        thread.start()
+        
+        if job_queue is not None:
+            enqueue_task(task_id, device_id, saved_files)
+        else:
+            schedule_task(task_id, device_id, saved_files)
         
         return jsonify({
             'success': True,
@@ -152,23 +337,221 @@ def upload_videos():
 
 @app.route('/api/task/status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
-    """获取任务处理状态"""
-    if task_id not in task_status:
+    """获取任务处理状态
+    
+    支持长轮询：?wait=30&since_version=N 时阻塞到版本号超过N、任务结束或超时为止。
+    """
+    if not load_queued_task(task_id):
         return jsonify({
             'success': False,
             'message': '任务不存在'
         }), 404
     
+    channel = task_channels[task_id]
+    wait = request.args.get('wait', type=float)
+    since_version = request.args.get('since_version', type=int)
+    
+    if wait and since_version is not None:
+        wait = min(max(wait, 0), LONG_POLL_MAX_WAIT)
+        _, status = channel.wait(task_status[task_id], since_version, wait)
+    else:
+        _, status = channel.snapshot(task_status[task_id])
+    
     return jsonify({
         'success': True,
         'task_id': task_id,
-        **task_status[task_id]
+        **status
+    }), 200
+
+@app.route('/api/task/events/<task_id>', methods=['GET'])
+def stream_task_events(task_id):
+    """以Server-Sent Events推送任务进度，任务结束后关闭流"""
+    if not load_queued_task(task_id):
+        return jsonify({
+            'success': False,
+            'message': '任务不存在'
+        }), 404
+    
+    channel = task_channels[task_id]
+    status = task_status[task_id]
+    
+    # 断线重连时从 Last-Event-ID 继续
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since_version', '0')
+    try:
+        since_version = int(last_event_id)
+    except ValueError:
+        since_version = 0
+    
+    def generate():
+        version = since_version
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        
+        while True:
+            new_version, snapshot = channel.wait(status, version, SSE_HEARTBEAT_INTERVAL)
+            if new_version > version:
+                version = new_version
+                yield format_sse_event(version, {'task_id': task_id, **snapshot})
+            elif snapshot.get('status') not in TERMINAL_STATUSES:
+                yield ": keep-alive\n\n"
+            
+            if snapshot.get('status') in TERMINAL_STATUSES:
+                break
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def task_frames_ready(task_id):
+    """检查任务可以下载帧：存在且已完成（完成前帧文件可能还会被重命名）"""
+    if not load_queued_task(task_id):
+        return jsonify({
+            'success': False,
+            'message': '任务不存在'
+        }), 404
+    if task_status[task_id].get('status') != 'completed':
+        return jsonify({
+            'success': False,
+            'message': '任务尚未完成'
+        }), 409
+    return None
+
+def set_immutable_cache(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = FRAME_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/task/<task_id>/frames/<filename>', methods=['GET'])
+def get_task_frame(task_id, filename):
+    """下载单帧
+    
+    独立文件通过 send_file 发送（WSGI服务器支持时走 sendfile 零拷贝），
+    支持 ETag/If-None-Match（304）和 Range（206）；打包容器中的帧按偏移读取后同样支持这些头。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+    
+    frame = resolve_frame(task_id, filename)
+    if frame is None:
+        return jsonify({
+            'success': False,
+            'message': '帧不存在'
+        }), 404
+    
+    if 'path' in frame:
+        response = send_file(frame['path'], mimetype=frame_mimetype(filename),
+                             conditional=True, etag=frame['etag'], max_age=FRAME_CACHE_MAX_AGE)
+        return set_immutable_cache(response)
+    
+    response = Response(read_packed_frame(frame), mimetype=frame_mimetype(filename))
+    response.set_etag(frame['etag'])
+    set_immutable_cache(response)
+    return response.make_conditional(request, accept_ranges=True, complete_length=frame['size'])
+
+@app.route('/api/task/<task_id>/frames/<filename>/resize', methods=['GET'])
+def get_task_frame_resized(task_id, filename):
+    """按需缩放：?width=480[&crop=x,y,w,h][&format=jpeg|webp]
+    
+    结果来自磁盘LRU缓存；同一派生图的并发请求只生成一次。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+    
+    resize_args, message = parse_resize_args(request.args)
+    if resize_args is None:
+        return jsonify({
+            'success': False,
+            'message': message
+        }), 400
+    width, crop, encode_format = resize_args
+    
+    frame = resolve_frame(task_id, filename)
+    if frame is None:
+        return jsonify({
+            'success': False,
+            'message': '帧不存在'
+        }), 404
+    
+    key = derivative_key(task_id, filename, frame, width, crop, encode_format)
+    create = make_derivative(frame, width, crop, encode_format)
+    
+    def send_derivative():
+        path = derivative_cache.get_or_create(key, create, shared_extractor.thread_pool)
+        return send_file(path, mimetype=frame_mimetype(key), conditional=True,
+                         etag=key.split('.')[0], max_age=FRAME_CACHE_MAX_AGE)
+    
+    try:
+        try:
+            response = send_derivative()
+        except FileNotFoundError:
+            # 刚生成就被其他请求淘汰，重新生成一次
+            response = send_derivative()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'生成失败: {str(e)}'
+        }), 422
+    return set_immutable_cache(response)
+
+@app.route('/api/frames/cache/stats', methods=['GET'])
+def get_derivative_cache_stats():
+    """派生图缓存统计：命中率、合并请求数、淘汰次数和占用字节数"""
+    return jsonify({
+        'success': True,
+        **derivative_cache.stats()
     }), 200
 
+@app.route('/api/task/<task_id>/frames', methods=['GET'])
+def get_task_frames_batch(task_id):
+    """批量下载多帧：?names=a.jpg,b.jpg，返回 multipart/mixed
+    
+    每个分段带 Content-Type、Content-Length、Content-Location（文件名）和 ETag；
+    整个批次的 ETag 由各帧 ETag 计算，客户端重复请求同一批次时可得到 304。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+    
+    names = [name for name in request.args.get('names', '').split(',') if name]
+    if not names:
+        return jsonify({
+            'success': False,
+            'message': '缺少 names 参数'
+        }), 400
+    if len(names) > FRAME_BATCH_MAX_FILES:
+        return jsonify({
+            'success': False,
+            'message': f'单次最多下载 {FRAME_BATCH_MAX_FILES} 帧'
+        }), 400
+    
+    frames = [(name, resolve_frame(task_id, name)) for name in names]
+    missing = [name for name, frame in frames if frame is None]
+    if missing:
+        return jsonify({
+            'success': False,
+            'message': '帧不存在',
+            'missing': missing
+        }), 404
+    
+    batch_etag = frame_batch_etag(frames)
+    if request.if_none_match.contains(batch_etag):
+        response = Response(status=304)
+        response.set_etag(batch_etag)
+        return set_immutable_cache(response)
+    
+    boundary = uuid.uuid4().hex
+    response = Response(iter_frame_batch(frames, boundary), mimetype=f'multipart/mixed; boundary={boundary}')
+    response.set_etag(batch_etag)
+    return set_immutable_cache(response)
+
 @app.route('/api/task/cancel/<task_id>', methods=['POST'])
 def cancel_task(task_id):
     """取消任务"""
-    if task_id not in task_status:
+    if not load_queued_task(task_id):
         return jsonify({
             'success': False,
             'message': '任务不存在'
@@ -180,8 +563,12 @@ def cancel_task(task_id):
             'message': '任务已完成或出错，无法取消'
         }), 400
     
-    task_status[task_id]['status'] = 'cancelled'
-    task_status[task_id]['message'] = '任务已取消'
+    # 先通知抽帧器停止工作，再更新状态（队列模式下由工作进程在下次心跳时停止）
+    task_cancel_tokens[task_id].cancel()
+    if job_queue is not None and job_queue.cancel(task_id) == JOB_QUEUED:
+        # 还没有工作进程领取，上传文件不会再被处理
+        remove_task_files(task_id)
+    update_task_status(task_id, status='cancelled', message='任务已取消')
     
     return jsonify({
         'success': True,
@@ -222,5 +609,15 @@ def too_large(e):
         'message': '文件过大，请选择小于800MB的视频文件'
     }), 413
 
+if job_queue is not None:
+    threading.Thread(target=sync_queue_status, daemon=True).start()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # 抽帧器和公共模块导入时都不配置日志，由服务入口统一配置
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # 压测等场景可通过环境变量关闭调试模式（调试模式的重载器会多起一个进程）
+    app.run(
+        debug=os.environ.get('FLASK_DEBUG', '1') == '1',
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', 5001))
+    )
\ No newline at end of file
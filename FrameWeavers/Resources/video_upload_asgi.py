@@ -0,0 +1,770 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频上传API - ASGI异步版本
+
+与 video_upload_api.py 提供相同的接口（队列模式仅Flask版本支持），但运行在单个事件循环上：
+- 抽帧器直接在服务器自己的事件循环上运行，不再为每个任务起线程和新循环
+- 上传请求体边接收边解析（python-multipart 流式解析器），视频分块经异步文件I/O直接写入任务目录，
+  不经框架先整体缓存到临时文件
+- 状态查询、长轮询和SSE都只是在 asyncio.Condition 上等待，不占用工作线程
+- 阻塞操作只使用固定大小的线程池（抽帧线程池 + ASGI_IO_THREADS 个I/O线程）
+- 帧下载、按需缩放和批量下载与Flask版本共用 video_upload_common 中的定位和缓存键逻辑
+
+使用方法:
+uvicorn video_upload_asgi:app --host 0.0.0.0 --port 5001
+"""
+
+import logging
+import os
+import uuid
+import asyncio
+import concurrent.futures
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+
+import aiofiles
+import anyio.to_thread
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from werkzeug.utils import secure_filename
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13 的包名
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from async_frame_extractor import AsyncFrameExtractor, AsyncFrameExtractorConfig, CancellationToken, DerivativeCache
+from video_job_queue import FairTaskScheduler, DeviceUploadQuota, job_cost, DEFAULT_DEVICE_WEIGHT
+from video_upload_common import (
+    FRAMES_FOLDER, MAX_CONTENT_LENGTH,
+    LONG_POLL_MAX_WAIT, SSE_HEARTBEAT_INTERVAL, SSE_RETRY_MS, TERMINAL_STATUSES,
+    MAX_PROCESSING_TASKS, DEVICE_MAX_CONCURRENT, DEVICE_UPLOAD_BYTES_PER_MINUTE, DEVICE_WEIGHTS,
+    FRAME_CACHE_MAX_AGE, FRAME_BATCH_MAX_FILES,
+    allowed_file, extraction_options, format_sse_event, task_upload_dir, remove_task_files,
+    resolve_frame, read_frame, frame_mimetype, parse_resize_args, derivative_key, make_derivative,
+    frame_batch_etag, iter_frame_batch
+)
+
+# 配置
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传分块写盘大小
+FORM_FIELD_MAX_BYTES = 64 * 1024  # 普通表单字段的最大长度
+ASGI_IO_THREADS = 4               # 文件I/O等阻塞操作使用的固定线程数
+
+# 任务状态存储
+task_status = {}
+task_channels = {}
+task_cancel_tokens = {}
+# 正在运行的后台任务（保持引用避免被回收）
+running_tasks = set()
+# 共享抽帧器和派生图缓存，在应用启动时创建
+extractor = None
+derivative_cache = None
+# 按设备公平调度与上传配额（与Flask版本配置相同）
+task_scheduler = FairTaskScheduler(MAX_PROCESSING_TASKS)
+upload_quota = DeviceUploadQuota(DEVICE_UPLOAD_BYTES_PER_MINUTE)
+
+class AsyncTaskProgressChannel:
+    """单个任务的进度通道（asyncio版本）
+
+    与 TaskProgressChannel 语义相同，等待者挂在 asyncio.Condition 上，
+    不占用任何线程。
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.condition = asyncio.Condition()
+
+    async def publish(self, status, **fields):
+        """更新状态字段并通知等待者"""
+        async with self.condition:
+            status.update(fields)
+            self.version += 1
+            status['version'] = self.version
+            self.condition.notify_all()
+
+    async def wait(self, status, since_version, timeout):
+        """等待版本号超过 since_version（或任务已结束），返回版本和状态副本"""
+        async with self.condition:
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(
+                        lambda: self.version > since_version or status.get('status') in TERMINAL_STATUSES
+                    ),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+            return self.version, dict(status)
+
+async def create_task_status(task_id, **fields):
+    """初始化任务状态及其进度通道"""
+    task_status[task_id] = {}
+    task_channels[task_id] = AsyncTaskProgressChannel()
+    task_cancel_tokens[task_id] = CancellationToken()
+    await task_channels[task_id].publish(task_status[task_id], **fields)
+
+async def update_task_status(task_id, **fields):
+    """更新任务状态并推送给所有订阅者"""
+    await task_channels[task_id].publish(task_status[task_id], **fields)
+
+@asynccontextmanager
+async def lifespan(app):
+    """应用生命周期：固定线程数并创建共享抽帧器和派生图缓存"""
+    global extractor, derivative_cache
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        max_workers=ASGI_IO_THREADS,
+        thread_name_prefix="AsgiIO"
+    ))
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_IO_THREADS
+
+    os.makedirs(FRAMES_FOLDER, exist_ok=True)
+    derivative_cache = await loop.run_in_executor(None, DerivativeCache, os.path.join(
+        FRAMES_FOLDER, AsyncFrameExtractorConfig.DERIVATIVE_CACHE_SUBDIR
+    ))
+
+    # 不做性能自动检测：psutil.cpu_percent(interval=1) 会阻塞事件循环一秒
+    extractor = AsyncFrameExtractor(output_dir=FRAMES_FOLDER, auto_detect_performance=False)
+    try:
+        yield
+    finally:
+        for task in list(running_tasks):
+            task.cancel()
+        await extractor.cleanup()
+        extractor = None
+
+app = FastAPI(lifespan=lifespan)
+
+def error_response(message, status_code, **extra):
+    """统一的错误响应"""
+    return JSONResponse({'success': False, 'message': message, **extra}, status_code=status_code)
+
+def make_progress_callback(task_id, total_files):
+    """创建抽帧器进度回调，把 AsyncProgressMonitor 的进度写入任务状态"""
+    cancel_token = task_cancel_tokens[task_id]
+
+    async def on_progress(progress_data):
+        if cancel_token.cancelled:
+            return
+
+        completed = progress_data['completed_files']
+        current_progress = progress_data['current_file_progress']
+        progress = progress_data['overall_progress']
+        if current_progress < 100:
+            progress += current_progress / max(total_files, 1)
+
+        await update_task_status(
+            task_id,
+            progress=min(int(progress), 99),
+            message=f'正在处理第 {min(completed + 1, total_files)}/{total_files} 个视频...'
+        )
+
+    return on_progress
+
+async def process_videos(task_id, video_files):
+    """在服务器事件循环上处理视频"""
+    cancel_token = task_cancel_tokens[task_id]
+
+    try:
+        # 排队期间已取消：抽帧器不会运行，由这里清理上传文件
+        if cancel_token.cancelled:
+            await asyncio.get_running_loop().run_in_executor(None, remove_task_files, task_id)
+            return
+
+        await update_task_status(task_id, status='processing', message='正在为您织造回忆，请稍候...')
+
+        result = await extractor.process_and_format_async(
+            [video_file['filepath'] for video_file in video_files],
+            device_id=task_status[task_id].get('device_id'),
+            task_id=task_id,
+            progress_callback=make_progress_callback(task_id, len(video_files)),
+            cancel_token=cancel_token,
+            **task_status[task_id].get('options', {})
+        )
+
+        # 已取消的任务保持 cancelled 状态，不再覆盖；抽帧器已清理输出，这里删除上传文件
+        if cancel_token.cancelled:
+            await asyncio.get_running_loop().run_in_executor(None, remove_task_files, task_id)
+            return
+
+        if not result['success']:
+            error = result.get('error', '未知错误')
+            await update_task_status(task_id, status='error', message=f'处理失败: {error}', error=error)
+            return
+
+        await update_task_status(
+            task_id,
+            status='completed',
+            message='回忆织造完成！',
+            progress=100,
+            frame_count=len(result['base_frame_paths']),
+            task_output_dir=result['storage_info']['task_output_directory'],
+            json_result_path=result['storage_info'].get('json_result_path'),
+            sprite_sheets=result['storage_info'].get('sprite_sheets')
+        )
+
+    except Exception as e:
+        if not cancel_token.cancelled:
+            await update_task_status(task_id, status='error', message=f'处理失败: {str(e)}', error=str(e))
+
+def schedule_task(loop, task_id, device_id, saved_files):
+    """交给公平调度器；调度到后在事件循环上运行，调度线程只等待其结束以占住槽位"""
+    async def run():
+        task = asyncio.current_task()
+        running_tasks.add(task)
+        try:
+            await process_videos(task_id, saved_files)
+        finally:
+            running_tasks.discard(task)
+
+    def run_blocking():
+        try:
+            asyncio.run_coroutine_threadsafe(run(), loop).result()
+        except (concurrent.futures.CancelledError, RuntimeError):
+            # 应用关闭时任务被取消或事件循环已关闭
+            pass
+
+    task_scheduler.submit(
+        device_id,
+        job_cost(sum(video_file['size'] for video_file in saved_files)),
+        run_blocking,
+        weight=DEVICE_WEIGHTS.get(device_id, DEFAULT_DEVICE_WEIGHT),
+        max_concurrent=DEVICE_MAX_CONCURRENT
+    )
+
+class MultipartStream:
+    """流式multipart解析器：请求体分块喂入，返回该块解析出的事件
+
+    事件为 ('part', 字段名, 文件名或None)、('data', 字节)、('end',)。
+    解析器回调只收集事件，文件写入由调用方在事件循环上异步完成。
+    """
+
+    def __init__(self, boundary: bytes):
+        self._events = []
+        self._headers = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._parser = MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        filename = options.get(b'filename')
+        self._events.append(('part', options.get(b'name', b'').decode('utf-8', 'replace'),
+                             filename.decode('utf-8', 'replace') if filename is not None else None))
+
+    def _on_part_data(self, data, start, end):
+        self._events.append(('data', bytes(data[start:end])))
+
+    def _on_part_end(self):
+        self._events.append(('end',))
+
+    def _take_events(self):
+        events, self._events = self._events, []
+        return events
+
+    def feed(self, chunk: bytes):
+        """喂入一块请求体"""
+        self._parser.write(chunk)
+        return self._take_events()
+
+    def finish(self):
+        """请求体结束"""
+        self._parser.finalize()
+        return self._take_events()
+
+class StreamingUpload:
+    """单个上传请求的接收状态
+
+    表单字段保存在内存中；videos 字段的合法视频边接收边写入任务上传目录，
+    总大小超过 MAX_CONTENT_LENGTH 时立即中止。设备唯一码一到就检查上传配额，
+    超限的请求不必等整个请求体传完；之后已接收字节数超过剩余额度时（分块传输没有
+    Content-Length）同样中止。配额只检查不记账，上传被接受后按实际接收字节数记账。
+    """
+
+    def __init__(self, task_id: str, content_length: int):
+        self.task_id = task_id
+        self.content_length = content_length
+        self.fields = {}
+        self.saved_files = []
+        self.invalid_files = []
+        self.file_parts = 0
+        self.empty_file_parts = 0
+        self.quota_checked = False
+        self.received_bytes = 0
+        self._quota_allowance = float('inf')
+        self._upload_dir = None
+        self._remaining_budget = MAX_CONTENT_LENGTH
+        self._part = None
+
+    def check_quota(self) -> Optional[JSONResponse]:
+        """按设备检查最近一分钟的上传字节数，超限时返回429响应"""
+        self.quota_checked = True
+        device_id = self.fields['device_id']
+        retry_after = upload_quota.check(device_id, max(self.content_length, self.received_bytes))
+        if retry_after is None:
+            self._quota_allowance = upload_quota.available(device_id)
+            return None
+        if retry_after == float('inf'):
+            return error_response('单次上传超过设备配额', 429)
+        response = error_response('上传过于频繁，请稍后再试', 429)
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response
+
+    async def receive(self, request: Request, boundary: bytes) -> Optional[JSONResponse]:
+        """接收并解析整个请求体，需要中止时返回错误响应（已写入的文件由调用方清理）"""
+        parser = MultipartStream(boundary)
+        try:
+            async for chunk in request.stream():
+                self.received_bytes += len(chunk)
+                if self.quota_checked and self.received_bytes > self._quota_allowance:
+                    response = self.check_quota()
+                    if response is not None:
+                        return response
+                for event in parser.feed(chunk):
+                    response = await self._handle(event)
+                    if response is not None:
+                        return response
+            for event in parser.finish():
+                response = await self._handle(event)
+                if response is not None:
+                    return response
+        finally:
+            if self._part and self._part.get('out'):
+                await self._part['out'].close()
+        return None
+
+    async def _handle(self, event) -> Optional[JSONResponse]:
+        """处理一个解析事件"""
+        part = self._part
+        if event[0] == 'part':
+            _, name, filename = event
+            self._part = {'name': name, 'filename': filename, 'buffer': bytearray(), 'size': 0, 'out': None}
+            if filename is not None and name == 'videos':
+                return await self._begin_file(self._part)
+            return None
+
+        if part is None:
+            return None
+
+        if event[0] == 'data':
+            part['buffer'] += event[1]
+            part['size'] += len(event[1])
+            if part['filename'] is None:
+                if part['size'] > FORM_FIELD_MAX_BYTES:
+                    return error_response('表单字段过长', 400)
+            elif part['out']:
+                if part['size'] > self._remaining_budget:
+                    return error_response('文件过大，请选择小于800MB的视频文件', 413)
+                if len(part['buffer']) >= UPLOAD_CHUNK_SIZE:
+                    await part['out'].write(bytes(part['buffer']))
+                    part['buffer'].clear()
+            else:
+                part['buffer'].clear()
+            return None
+
+        # 当前部分结束
+        if part['out']:
+            await part['out'].write(bytes(part['buffer']))
+            await part['out'].close()
+        self._part = None
+        if part['filename'] is None:
+            self.fields[part['name']] = part['buffer'].decode('utf-8', 'replace')
+            if part['name'] == 'device_id' and self.fields['device_id'] and not self.quota_checked:
+                return self.check_quota()
+        elif part['out']:
+            self._remaining_budget -= part['size']
+            part['saved']['size'] = part['size']
+            self.saved_files.append(part['saved'])
+        return None
+
+    async def _begin_file(self, part) -> Optional[JSONResponse]:
+        """videos 字段的一个文件开始：合法视频打开目标文件，其余记为无效文件"""
+        self.file_parts += 1
+        original_name = part['filename']
+        if not original_name:
+            self.empty_file_parts += 1
+        if not original_name or not allowed_file(original_name):
+            self.invalid_files.append(original_name or '未知文件')
+            return None
+
+        if self._upload_dir is None:
+            self._upload_dir = await asyncio.get_running_loop().run_in_executor(
+                None, task_upload_dir, self.task_id
+            )
+        # 添加时间戳避免文件名冲突
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"{timestamp}_{secure_filename(original_name)}"
+        filepath = os.path.join(self._upload_dir, filename)
+        part['out'] = await aiofiles.open(filepath, 'wb')
+        part['saved'] = {
+            'original_name': original_name,
+            'saved_name': filename,
+            'filepath': filepath
+        }
+        return None
+
+@app.post('/api/upload/videos')
+async def upload_videos(request: Request):
+    """视频上传接口（边接收边解析请求体）"""
+    loop = asyncio.get_running_loop()
+    task_id = str(uuid.uuid4())
+    try:
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or not params.get(b'boundary'):
+            return error_response('请求格式错误，需要 multipart/form-data', 400)
+
+        content_length = int(request.headers.get('content-length') or 0)
+        if content_length > MAX_CONTENT_LENGTH:
+            return error_response('文件过大，请选择小于800MB的视频文件', 413)
+
+        upload = StreamingUpload(task_id, content_length)
+        response = await upload.receive(request, params[b'boundary'])
+        if response is None:
+            response = validate_upload(upload)
+        if response is not None:
+            await loop.run_in_executor(None, remove_task_files, task_id)
+            return response
+
+        device_id = upload.fields['device_id']
+        upload_quota.consume(device_id, upload.received_bytes)
+
+        # 初始化任务状态
+        await create_task_status(
+            task_id,
+            status='uploaded',
+            message='视频上传成功，排队等待处理...',
+            progress=0,
+            files=upload.saved_files,
+            device_id=device_id,
+            options=extraction_options(upload.fields),
+            created_at=datetime.now().isoformat()
+        )
+
+        schedule_task(loop, task_id, device_id, upload.saved_files)
+
+        return JSONResponse({
+            'success': True,
+            'message': '视频上传成功',
+            'task_id': task_id,
+            'device_id': device_id,
+            'uploaded_files': len(upload.saved_files),
+            'invalid_files': upload.invalid_files if upload.invalid_files else None
+        }, status_code=200)
+
+    except Exception as e:
+        await loop.run_in_executor(None, remove_task_files, task_id)
+        return error_response(f'上传失败: {str(e)}', 500)
+
+def validate_upload(upload: StreamingUpload) -> Optional[JSONResponse]:
+    """请求体接收完后检查表单，返回错误响应或None"""
+    # 检查设备唯一码
+    if not upload.fields.get('device_id'):
+        return error_response('缺少设备唯一码', 400)
+
+    # 设备唯一码在文件之后才到达时，在这里检查配额
+    if not upload.quota_checked:
+        response = upload.check_quota()
+        if response is not None:
+            return response
+
+    # 检查是否有文件
+    if not upload.file_parts:
+        return error_response('未找到视频文件', 400)
+
+    if upload.empty_file_parts == upload.file_parts:
+        return error_response('未选择任何文件', 400)
+
+    if not upload.saved_files:
+        return error_response('没有有效的视频文件', 400, invalid_files=upload.invalid_files)
+    return None
+
+@app.get('/api/task/status/{task_id}')
+async def get_task_status(task_id: str, wait: Optional[float] = None, since_version: Optional[int] = None):
+    """获取任务处理状态（支持 ?wait=30&since_version=N 长轮询）"""
+    if task_id not in task_status:
+        return error_response('任务不存在', 404)
+
+    if wait and since_version is not None:
+        wait = min(max(wait, 0), LONG_POLL_MAX_WAIT)
+        _, status = await task_channels[task_id].wait(task_status[task_id], since_version, wait)
+    else:
+        status = dict(task_status[task_id])
+
+    return JSONResponse({
+        'success': True,
+        'task_id': task_id,
+        **status
+    }, status_code=200)
+
+@app.get('/api/task/events/{task_id}')
+async def stream_task_events(task_id: str, request: Request, since_version: int = 0):
+    """以Server-Sent Events推送任务进度，任务结束后关闭流"""
+    if task_id not in task_status:
+        return error_response('任务不存在', 404)
+
+    channel = task_channels[task_id]
+    status = task_status[task_id]
+
+    # 断线重连时从 Last-Event-ID 继续
+    try:
+        since_version = int(request.headers.get('Last-Event-ID', since_version))
+    except ValueError:
+        since_version = 0
+
+    async def generate():
+        version = since_version
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+
+        while True:
+            new_version, snapshot = await channel.wait(status, version, SSE_HEARTBEAT_INTERVAL)
+            if new_version > version:
+                version = new_version
+                yield format_sse_event(version, {'task_id': task_id, **snapshot})
+            elif snapshot.get('status') not in TERMINAL_STATUSES:
+                yield ": keep-alive\n\n"
+
+            if snapshot.get('status') in TERMINAL_STATUSES:
+                break
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def task_frames_ready(task_id) -> Optional[JSONResponse]:
+    """检查任务可以下载帧：存在且已完成（完成前帧文件可能还会被重命名）"""
+    if task_id not in task_status:
+        return error_response('任务不存在', 404)
+    if task_status[task_id].get('status') != 'completed':
+        return error_response('任务尚未完成', 409)
+    return None
+
+def immutable_cache_headers(etag):
+    """强ETag + 长期缓存头"""
+    return {'ETag': f'"{etag}"', 'Cache-Control': f'public, max-age={FRAME_CACHE_MAX_AGE}, immutable'}
+
+def etag_matches(request: Request, etag) -> bool:
+    """If-None-Match 是否包含该ETag"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in header.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag).strip('"') == etag for tag in tags)
+
+def parse_byte_range(header, size):
+    """解析单个 Range: bytes=start-end，返回 (start, end)（含end）
+
+    没有Range头或是多段范围时返回 None（发送完整内容），范围无法满足时抛出 ValueError。
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    if not start:
+        length = int(end)
+        if length <= 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+def frame_bytes_response(request: Request, data: bytes, etag, media_type):
+    """发送内存中的帧内容，支持 Range（206）"""
+    headers = immutable_cache_headers(etag)
+    headers['Accept-Ranges'] = 'bytes'
+    try:
+        byte_range = parse_byte_range(request.headers.get('range'), len(data))
+    except ValueError:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{len(data)}'})
+    if byte_range is None:
+        return Response(data, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+    return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+@app.get('/api/task/{task_id}/frames/{filename}')
+async def get_task_frame(task_id: str, filename: str, request: Request):
+    """下载单帧
+
+    支持 ETag/If-None-Match（304）和 Range（206）；完整的独立文件由 FileResponse 分块发送，
+    打包容器中的帧和范围请求读入内存后发送。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+
+    loop = asyncio.get_running_loop()
+    frame = await loop.run_in_executor(None, resolve_frame, task_id, filename)
+    if frame is None:
+        return error_response('帧不存在', 404)
+
+    if etag_matches(request, frame['etag']):
+        return Response(status_code=304, headers=immutable_cache_headers(frame['etag']))
+    if 'path' in frame and not request.headers.get('range'):
+        headers = immutable_cache_headers(frame['etag'])
+        headers['Accept-Ranges'] = 'bytes'
+        return FileResponse(frame['path'], media_type=frame_mimetype(filename), headers=headers)
+
+    data = await loop.run_in_executor(None, read_frame, frame)
+    return frame_bytes_response(request, data, frame['etag'], frame_mimetype(filename))
+
+@app.get('/api/task/{task_id}/frames/{filename}/resize')
+async def get_task_frame_resized(task_id: str, filename: str, request: Request):
+    """按需缩放：?width=480[&crop=x,y,w,h][&format=jpeg|webp]
+
+    结果来自磁盘LRU缓存；同一派生图的并发请求只生成一次，生成在抽帧器线程池中进行。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+
+    resize_args, message = parse_resize_args(request.query_params)
+    if resize_args is None:
+        return error_response(message, 400)
+    width, crop, encode_format = resize_args
+
+    loop = asyncio.get_running_loop()
+    frame = await loop.run_in_executor(None, resolve_frame, task_id, filename)
+    if frame is None:
+        return error_response('帧不存在', 404)
+
+    key = derivative_key(task_id, filename, frame, width, crop, encode_format)
+    etag = key.split('.')[0]
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=immutable_cache_headers(etag))
+    create = make_derivative(frame, width, crop, encode_format)
+
+    def load_derivative():
+        path = derivative_cache.get_or_create(key, create, extractor.thread_pool)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    try:
+        try:
+            data = await loop.run_in_executor(None, load_derivative)
+        except FileNotFoundError:
+            # 刚生成就被其他请求淘汰，重新生成一次
+            data = await loop.run_in_executor(None, load_derivative)
+    except ValueError as e:
+        return error_response(f'生成失败: {str(e)}', 422)
+    return frame_bytes_response(request, data, etag, frame_mimetype(key))
+
+@app.get('/api/frames/cache/stats')
+async def get_derivative_cache_stats():
+    """派生图缓存统计：命中率、合并请求数、淘汰次数和占用字节数"""
+    return JSONResponse({
+        'success': True,
+        **derivative_cache.stats()
+    }, status_code=200)
+
+@app.get('/api/task/{task_id}/frames')
+async def get_task_frames_batch(task_id: str, request: Request, names: str = ''):
+    """批量下载多帧：?names=a.jpg,b.jpg，返回 multipart/mixed
+
+    每个分段带 Content-Type、Content-Length、Content-Location（文件名）和 ETag；
+    整个批次的 ETag 由各帧 ETag 计算，客户端重复请求同一批次时可得到 304。
+    """
+    error = task_frames_ready(task_id)
+    if error:
+        return error
+
+    names = [name for name in names.split(',') if name]
+    if not names:
+        return error_response('缺少 names 参数', 400)
+    if len(names) > FRAME_BATCH_MAX_FILES:
+        return error_response(f'单次最多下载 {FRAME_BATCH_MAX_FILES} 帧', 400)
+
+    frames = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: [(name, resolve_frame(task_id, name)) for name in names]
+    )
+    missing = [name for name, frame in frames if frame is None]
+    if missing:
+        return error_response('帧不存在', 404, missing=missing)
+
+    batch_etag = frame_batch_etag(frames)
+    if etag_matches(request, batch_etag):
+        return Response(status_code=304, headers=immutable_cache_headers(batch_etag))
+
+    # 同步生成器由框架在线程池中迭代，读帧不阻塞事件循环
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(iter_frame_batch(frames, boundary),
+                             media_type=f'multipart/mixed; boundary={boundary}',
+                             headers=immutable_cache_headers(batch_etag))
+
+@app.post('/api/task/cancel/{task_id}')
+async def cancel_task(task_id: str):
+    """取消任务"""
+    if task_id not in task_status:
+        return error_response('任务不存在', 404)
+
+    if task_status[task_id]['status'] in ['completed', 'error']:
+        return error_response('任务已完成或出错，无法取消', 400)
+
+    # 先通知抽帧器停止工作，再更新状态
+    task_cancel_tokens[task_id].cancel()
+    await update_task_status(task_id, status='cancelled', message='任务已取消')
+
+    return JSONResponse({
+        'success': True,
+        'message': '任务已取消'
+    }, status_code=200)
+
+@app.get('/api/device/{device_id}/tasks')
+async def get_device_tasks(device_id: str):
+    """获取设备的所有任务历史"""
+    device_tasks = []
+
+    for task_id, task_info in task_status.items():
+        if task_info.get('device_id') == device_id:
+            device_tasks.append({
+                'task_id': task_id,
+                'status': task_info['status'],
+                'message': task_info['message'],
+                'progress': task_info.get('progress', 0),
+                'created_at': task_info['created_at'],
+                'file_count': len(task_info.get('files', []))
+            })
+
+    # 按创建时间倒序排列
+    device_tasks.sort(key=lambda x: x['created_at'], reverse=True)
+
+    return JSONResponse({
+        'success': True,
+        'device_id': device_id,
+        'tasks': device_tasks,
+        'total_tasks': len(device_tasks)
+    }, status_code=200)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频上传API的共享配置与辅助函数
+
+Flask版本（video_upload_api.py）和ASGI版本（video_upload_asgi.py）都从这里导入，
+本模块导入时不创建应用、队列、抽帧器，也不启动线程或配置日志。
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from functools import lru_cache
+
+from werkzeug.security import safe_join
+
+from async_frame_extractor import AsyncFrameExtractorConfig, render_derivative
+
+# 配置
+FRAMES_FOLDER = 'frames'
+ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'wmv', 'flv', '3gp'}
+MAX_CONTENT_LENGTH = 800 * 1024 * 1024  # 800MB
+
+# 进度推送配置
+LONG_POLL_MAX_WAIT = 60          # 长轮询最长等待时间（秒）
+SSE_HEARTBEAT_INTERVAL = 15      # SSE心跳间隔（秒）
+SSE_RETRY_MS = 3000              # 断线后客户端重连间隔（毫秒）
+TERMINAL_STATUSES = {'completed', 'error', 'cancelled'}
+
+# 按设备公平调度与配额
+MAX_PROCESSING_TASKS = int(os.environ.get('MAX_PROCESSING_TASKS', 4))        # 本进程同时处理的任务数
+DEVICE_MAX_CONCURRENT = int(os.environ.get('DEVICE_MAX_CONCURRENT', 2))      # 单个设备同时处理的任务数
+DEVICE_UPLOAD_BYTES_PER_MINUTE = int(os.environ.get('DEVICE_UPLOAD_BYTES_PER_MINUTE', 2 * 1024 ** 3))  # 0 表示不限
+DEVICE_WEIGHTS = json.loads(os.environ.get('DEVICE_WEIGHTS') or '{}')       # {"device_id": 权重}
+
+# 帧文件下载
+FRAME_CACHE_MAX_AGE = 365 * 24 * 3600   # 任务完成后帧文件不再变化，允许客户端长期缓存
+FRAME_BATCH_MAX_FILES = 100             # 单次批量下载的最大帧数
+DERIVATIVE_FORMATS = {'jpeg': '.jpg', 'webp': '.webp'}
+
+
+def task_upload_dir(task_id):
+    """任务的上传目录：上传文件直接保存在任务目录下，抽帧输出与其同处一个目录树"""
+    upload_dir = os.path.join(FRAMES_FOLDER, task_id, AsyncFrameExtractorConfig.TASK_INPUT_SUBDIR)
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+def remove_task_files(task_id):
+    """删除被取消任务的整个目录（含上传文件；抽帧器取消时只清理自己的输出）"""
+    shutil.rmtree(os.path.join(FRAMES_FOLDER, task_id), ignore_errors=True)
+
+def extraction_options(form):
+    """从上传表单中读取可选的抽帧参数"""
+    options = {}
+    if str(form.get('sprite_sheet', '')).lower() in ('1', 'true', 'yes'):
+        options['sprite_sheet'] = True
+    return options
+
+def allowed_file(filename):
+    """检查文件扩展名是否允许"""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def format_sse_event(version, status):
+    """格式化一条SSE事件"""
+    data = json.dumps(status, ensure_ascii=False, default=str)
+    return f"id: {version}\nevent: progress\ndata: {data}\n\n"
+
+@lru_cache(maxsize=256)
+def load_frame_pack_index(index_path, mtime_ns):
+    """读取打包容器索引（按修改时间缓存）：{文件名: (偏移, 长度)}"""
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    frames = {entry['filename']: (entry['offset'], entry['length']) for entry in index['frames']}
+    return os.path.join(os.path.dirname(index_path), index['pack']), frames
+
+def resolve_frame(task_id, filename):
+    """定位任务的帧：返回独立文件 {'path', 'size', 'etag'}，
+    或打包容器中的切片 {'pack_path', 'offset', 'size', 'etag'}；不存在时返回 None
+    """
+    if '/' in filename or '\\' in filename:
+        return None
+    if os.path.splitext(filename)[1].lower() not in AsyncFrameExtractorConfig.SUPPORTED_IMAGE_FORMATS:
+        return None
+    task_dir = safe_join(FRAMES_FOLDER, task_id)
+    if task_dir is None:
+        return None
+
+    path = safe_join(task_dir, filename)
+    if path and os.path.isfile(path):
+        stat = os.stat(path)
+        return {'path': path, 'size': stat.st_size, 'etag': f"{stat.st_mtime_ns:x}-{stat.st_size:x}"}
+
+    index_path = os.path.join(task_dir, f"frames_{task_id}.pack{AsyncFrameExtractorConfig.FRAME_PACK_INDEX_SUFFIX}")
+    try:
+        mtime_ns = os.stat(index_path).st_mtime_ns
+    except OSError:
+        return None
+    pack_path, frames = load_frame_pack_index(index_path, mtime_ns)
+    if filename not in frames:
+        return None
+    offset, length = frames[filename]
+    return {'pack_path': pack_path, 'offset': offset, 'size': length,
+            'etag': f"{mtime_ns:x}-{offset:x}-{length:x}"}
+
+def read_packed_frame(frame):
+    """从打包容器读取一帧（pread，不移动共享文件位置）"""
+    fd = os.open(frame['pack_path'], os.O_RDONLY)
+    try:
+        return os.pread(fd, frame['size'], frame['offset'])
+    finally:
+        os.close(fd)
+
+def read_frame(frame):
+    """读取 resolve_frame 定位到的帧的完整内容"""
+    if 'path' in frame:
+        with open(frame['path'], 'rb') as f:
+            return f.read()
+    return read_packed_frame(frame)
+
+def frame_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def parse_crop(value):
+    """解析 crop=x,y,w,h（0-1之间的比例），无效时返回 None"""
+    try:
+        crop = tuple(float(part) for part in value.split(','))
+    except ValueError:
+        return None
+    if len(crop) != 4:
+        return None
+    x, y, w, h = crop
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < w <= 1 - x + 1e-9 and 0 < h <= 1 - y + 1e-9):
+        return None
+    return crop
+
+def parse_resize_args(args):
+    """解析按需缩放的查询参数，返回 ((width, crop, encode_format), None) 或 (None, 错误信息)"""
+    try:
+        width = int(args.get('width', ''))
+    except ValueError:
+        width = None
+    if width is None or not (AsyncFrameExtractorConfig.DERIVATIVE_MIN_WIDTH <= width
+                             <= AsyncFrameExtractorConfig.DERIVATIVE_MAX_WIDTH):
+        return None, (f'width 需在 {AsyncFrameExtractorConfig.DERIVATIVE_MIN_WIDTH}-'
+                      f'{AsyncFrameExtractorConfig.DERIVATIVE_MAX_WIDTH} 之间')
+    crop = None
+    if args.get('crop'):
+        crop = parse_crop(args['crop'])
+        if crop is None:
+            return None, 'crop 格式应为 x,y,w,h（0-1之间的比例）'
+    encode_format = args.get('format', 'jpeg')
+    if encode_format not in DERIVATIVE_FORMATS:
+        return None, 'format 仅支持 jpeg / webp'
+    return (width, crop, encode_format), None
+
+def derivative_key(task_id, filename, frame, width, crop, encode_format):
+    """派生图缓存键（含扩展名）；源帧的ETag参与缓存键，源文件变化后自动生成新的派生图"""
+    variant = f"{task_id}/{filename}:{frame['etag']}:{width}:{crop}:{encode_format}"
+    return hashlib.sha1(variant.encode('utf-8')).hexdigest() + DERIVATIVE_FORMATS[encode_format]
+
+def make_derivative(frame, width, crop, encode_format):
+    """返回生成派生图的函数，交给 DerivativeCache.get_or_create 在缓存未命中时调用"""
+    return lambda: render_derivative(read_frame(frame), width, crop, encode_format)
+
+def frame_batch_etag(frames):
+    """整批帧的ETag，由各帧ETag计算"""
+    return hashlib.sha1(
+        '\n'.join(f"{name}:{frame['etag']}" for name, frame in frames).encode('utf-8')
+    ).hexdigest()
+
+def iter_frame_batch(frames, boundary):
+    """逐段生成 multipart/mixed 响应体"""
+    for name, frame in frames:
+        yield (f"--{boundary}\r\n"
+               f"Content-Type: {frame_mimetype(name)}\r\n"
+               f"Content-Length: {frame['size']}\r\n"
+               f"Content-Location: {name}\r\n"
+               f"ETag: \"{frame['etag']}\"\r\n\r\n").encode('utf-8')
+        yield read_frame(frame)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode('utf-8')
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+抽帧工作进程 - 从持久化任务队列领取任务并运行 AsyncFrameExtractor
+
+可在同一台机器上启动多个，也可在共享文件系统（上传目录、输出目录、队列数据库）
+的多台机器上启动；每个进程一次处理一个任务，后台线程定期心跳延长租约。
+任务被取消或租约被接管（例如本进程长时间卡住）时，心跳失败并通过取消令牌停止抽帧。
+
+--pool 模式启动预热进程池：父进程先导入OpenCV/numpy再fork子进程，每个子进程做一次
+小规模的解码和编码预热后才开始领取任务；管理进程维持目标数量的空闲预热进程，
+并在处理N个任务或RSS超过阈值后回收进程，限制首个任务的延迟和内存增长。
+
+使用方法:
+python video_worker.py --queue frames/jobs.db
+python video_worker.py --queue /shared/frames/jobs.db --worker-id node-2 --lease 120
+python video_worker.py --queue frames/jobs.db --pool --max-workers 8 --target-idle 1 --max-jobs 50 --max-rss-mb 1500
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from async_frame_extractor import AsyncFrameExtractor, CancellationToken, cv2, np, psutil, preload_modules
+from video_job_queue import JobQueue, DEFAULT_LEASE_SECONDS, JOB_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+IDLE_POLL_INTERVAL = 1.0        # 队列为空时的轮询间隔（秒）
+PROGRESS_WRITE_INTERVAL = 0.5   # 进度写回队列的最小间隔（秒）
+
+# 预热进程池配置
+POOL_CHECK_INTERVAL = 0.5       # 管理进程检查子进程状态的间隔（秒）
+POOL_SHUTDOWN_TIMEOUT = 30      # 退出时等待子进程完成当前任务的时间（秒）
+POOL_EARLY_EXIT_SECONDS = 10    # 启动后这么快就异常退出的子进程视为启动失败
+POOL_RESPAWN_BACKOFF_MAX = 60   # 连续启动失败时补充进程的最长退避间隔（秒）
+WARMUP_FRAME_SIZE = (320, 180)  # 预热解码/编码使用的帧尺寸
+WARMUP_FRAME_COUNT = 8
+
+# 池中子进程状态
+WORKER_WARMING = 0
+WORKER_IDLE = 1
+WORKER_BUSY = 2
+
+
+def stop_on_lease_loss(queue: JobQueue, job_id: str, cancel_token: CancellationToken):
+    """不再持有租约时停止任务：用户取消按取消处理，其余情况（租约被接管、状态未知）不删除任何文件"""
+    try:
+        job = queue.get(job_id)
+    except Exception as e:
+        logger.warning(f"⚠️ 读取任务状态失败: {e}")
+        job = None
+    if job is not None and job['status'] == JOB_CANCELLED:
+        cancel_token.cancel("任务已取消")
+    else:
+        cancel_token.cancel("租约已失效", cleanup=False)
+
+
+class LeaseKeeper:
+    """后台心跳线程：每 lease_seconds/3 延长一次租约，失败时停止任务
+
+    任务被用户取消时按取消处理（清理输出）；租约被其他进程接管时只停止抽帧，
+    不删除任何文件，任务目录留给新的租约持有者。
+    """
+
+    def __init__(self, queue: JobQueue, job_id: str, worker_id: str,
+                 lease_seconds: float, cancel_token: CancellationToken):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.cancel_token = cancel_token
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                alive = self.queue.heartbeat(self.job_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"⚠️ 心跳失败: {e}")
+                continue
+            if not alive:
+                stop_on_lease_loss(self.queue, self.job_id, self.cancel_token)
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def make_progress_callback(queue: JobQueue, job_id: str, worker_id: str, total_files: int,
+                           cancel_token: CancellationToken):
+    """把抽帧进度写回队列（节流，避免每次回调都抢写锁）"""
+    last_write = [0.0]
+
+    async def on_progress(progress_data):
+        now = time.monotonic()
+        if cancel_token.cancelled or now - last_write[0] < PROGRESS_WRITE_INTERVAL:
+            return
+        last_write[0] = now
+
+        completed = progress_data['completed_files']
+        current_progress = progress_data['current_file_progress']
+        progress = progress_data['overall_progress']
+        if current_progress < 100:
+            progress += current_progress / max(total_files, 1)
+
+        await asyncio.get_running_loop().run_in_executor(None, lambda: queue.update_state(
+            job_id, worker_id,
+            progress=min(int(progress), 99),
+            message=f'正在处理第 {min(completed + 1, total_files)}/{total_files} 个视频...'
+        ))
+
+    return on_progress
+
+
+async def extract_job_frames(queue: JobQueue, job, worker_id: str, cancel_token: CancellationToken):
+    """在当前事件循环上运行抽帧器"""
+    payload = job['payload']
+    files = payload['files']
+    async with AsyncFrameExtractor(output_dir=payload['frames_folder'], auto_detect_performance=False) as extractor:
+        return await extractor.process_and_format_async(
+            [video_file['filepath'] for video_file in files],
+            device_id=job['device_id'],
+            task_id=job['id'],
+            progress_callback=make_progress_callback(queue, job['id'], worker_id, len(files), cancel_token),
+            cancel_token=cancel_token,
+            **payload.get('options', {})
+        )
+
+
+def run_job(queue: JobQueue, job, worker_id: str, lease_seconds: float):
+    """处理一个已领取的任务并写回结果"""
+    job_id = job['id']
+    cancel_token = CancellationToken()
+    logger.info(f"🎬 领取任务 {job_id}（第 {job['attempts']} 次尝试）")
+
+    try:
+        if not queue.update_state(job_id, worker_id, status='processing', message='正在为您织造回忆，请稍候...',
+                                  worker_id=worker_id):
+            stop_on_lease_loss(queue, job_id, cancel_token)
+        else:
+            with LeaseKeeper(queue, job_id, worker_id, lease_seconds, cancel_token):
+                result = asyncio.run(extract_job_frames(queue, job, worker_id, cancel_token))
+    except Exception as e:
+        if not cancel_token.cancelled:
+            logger.exception(f"❌ 任务 {job_id} 异常: {e}")
+            queue.fail(job_id, worker_id, str(e), status='error', message=f'处理失败: {str(e)}', error=str(e))
+            return
+
+    # 已取消或租约已被接管：队列中的状态以取消方/新租约持有者为准
+    if cancel_token.cancelled:
+        # 被取消的任务不会再被领取，删除整个任务目录（含上传文件）；租约被接管时什么都不删
+        if cancel_token.cleanup:
+            shutil.rmtree(os.path.join(job['payload']['frames_folder'], job_id), ignore_errors=True)
+        logger.info(f"⏹️ 任务 {job_id} 已停止: {cancel_token.reason}")
+        return
+
+    if not result['success']:
+        error = result.get('error', '未知错误')
+        queue.fail(job_id, worker_id, error, retry=False, status='error', message=f'处理失败: {error}', error=error)
+        return
+
+    queue.complete(
+        job_id, worker_id,
+        status='completed',
+        message='回忆织造完成！',
+        progress=100,
+        frame_count=len(result['base_frame_paths']),
+        task_output_dir=result['storage_info']['task_output_directory'],
+        json_result_path=result['storage_info'].get('json_result_path'),
+        sprite_sheets=result['storage_info'].get('sprite_sheets')
+    )
+    logger.info(f"✅ 任务 {job_id} 完成")
+
+
+def run_worker(queue: JobQueue, worker_id: str, lease_seconds: float, max_jobs: int = None,
+               max_rss_mb: float = None, state=None, retire=None):
+    """工作进程主循环：领取 → 处理 → 写回，队列为空时休眠
+
+    处理 max_jobs 个任务或RSS超过 max_rss_mb 后返回；
+    state/retire 由预热进程池传入，用于上报空闲/忙碌状态和接收空闲回收通知。
+    """
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        if retire is not None and retire.is_set():
+            return 'retired'
+        if state is not None:
+            state.value = WORKER_IDLE
+        job = queue.lease(worker_id, lease_seconds)
+        if job is None:
+            time.sleep(IDLE_POLL_INTERVAL)
+            continue
+        if state is not None:
+            state.value = WORKER_BUSY
+        run_job(queue, job, worker_id, lease_seconds)
+        processed += 1
+
+        if max_rss_mb and psutil.Process().memory_info().rss > max_rss_mb * 1024 * 1024:
+            return 'rss'
+    return 'max_jobs'
+
+# =============================================================================
+# 预热进程池
+# =============================================================================
+
+def warm_up_codecs():
+    """做一次小规模的视频编码、解码和JPEG编解码，初始化编解码器和缓冲区"""
+    width, height = WARMUP_FRAME_SIZE
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    frame = cv2.merge([gradient, gradient[::-1], np.full_like(gradient, 128)])
+
+    with tempfile.TemporaryDirectory(prefix="worker_warmup_") as workdir:
+        video_path = os.path.join(workdir, 'warmup.mp4')
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (width, height))
+        for _ in range(WARMUP_FRAME_COUNT):
+            writer.write(frame)
+        writer.release()
+
+        cap = cv2.VideoCapture(video_path)
+        decoded = None
+        while True:
+            ok, image = cap.read()
+            if not ok:
+                break
+            decoded = image
+        cap.release()
+
+    ok, encoded = cv2.imencode('.jpg', decoded if decoded is not None else frame,
+                               [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if ok:
+        cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+def pool_worker_main(queue_path: str, worker_id: str, lease_seconds: float, max_jobs: int,
+                     max_rss_mb: float, state, retire):
+    """池中子进程入口：预热后进入领取循环"""
+    # 由管理进程统一处理 Ctrl+C，子进程在当前任务结束后按回收通知退出；
+    # SIGTERM 恢复默认行为，超时后管理进程用它强制终止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # spawn 方式启动的子进程不继承管理进程的日志配置（fork 时此调用不生效）
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    started = time.perf_counter()
+    try:
+        warm_up_codecs()
+        logger.info(f"🔥 {worker_id} 预热完成 {(time.perf_counter() - started) * 1000:.0f}ms")
+    except Exception:
+        # 预热只是优化（如缺少mp4v编码器、临时目录只读），失败时以冷启动状态继续领取任务
+        logger.exception(f"⚠️ {worker_id} 预热失败，跳过预热")
+
+    queue = JobQueue(queue_path, lease_seconds=lease_seconds)
+    reason = run_worker(queue, worker_id, lease_seconds, max_jobs, max_rss_mb, state, retire)
+    logger.info(f"♻️ {worker_id} 退出（{reason}）")
+
+class WarmWorkerPool:
+    """预热工作进程池管理器
+
+    - 进程总数保持在 [min_workers, max_workers]
+    - 空闲（含预热中）进程少于 target_idle 时补充新进程；多于 target_idle 时通知多余的空闲进程退出
+    - 子进程处理 max_jobs 个任务或RSS超过 max_rss_mb 后自行退出，由管理进程补充
+    - 子进程启动后很快异常退出时按指数退避补充，避免反复崩溃重启
+    """
+
+    def __init__(self, queue_path: str, min_workers: int = 1, max_workers: int = None,
+                 target_idle: int = 1, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_jobs: int = None, max_rss_mb: float = None):
+        self.queue_path = queue_path
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers or os.cpu_count() or 1, min_workers)
+        self.target_idle = target_idle
+        self.lease_seconds = lease_seconds
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.workers = {}  # worker_id -> (进程, 状态, 回收事件)
+        self._started_at = {}  # worker_id -> 启动时间
+        self._early_exits = 0  # 连续启动失败次数
+        self._spawn_after = 0.0
+        self._stopping = False
+        # fork 让子进程直接继承父进程已导入的OpenCV/numpy
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+    def _spawn(self):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        state = self._context.Value('i', WORKER_WARMING, lock=False)
+        retire = self._context.Event()
+        process = self._context.Process(
+            target=pool_worker_main,
+            args=(self.queue_path, worker_id, self.lease_seconds, self.max_jobs, self.max_rss_mb, state, retire),
+            name=f"FrameWorker-{worker_id}",
+            daemon=False
+        )
+        process.start()
+        self.workers[worker_id] = (process, state, retire)
+        self._started_at[worker_id] = time.monotonic()
+        return worker_id
+
+    def _reap(self):
+        for worker_id, (process, _, _) in list(self.workers.items()):
+            if not process.is_alive():
+                process.join()
+                del self.workers[worker_id]
+                lifetime = time.monotonic() - self._started_at.pop(worker_id)
+                if process.exitcode != 0 and lifetime < POOL_EARLY_EXIT_SECONDS:
+                    self._early_exits += 1
+                    backoff = min(POOL_CHECK_INTERVAL * 2 ** self._early_exits, POOL_RESPAWN_BACKOFF_MAX)
+                    self._spawn_after = time.monotonic() + backoff
+                    logger.warning(f"⚠️ 子进程 {worker_id} 启动后 {lifetime:.1f}s 异常退出"
+                                   f"（退出码 {process.exitcode}），{backoff:.1f}s 后再补充")
+                else:
+                    self._early_exits = 0
+
+    def _rebalance(self):
+        """按空闲目标补充或回收进程"""
+        self._reap()
+        # 已收到回收通知的进程不再计入
+        active = [worker_id for worker_id, (_, _, retire) in self.workers.items() if not retire.is_set()]
+        available = [worker_id for worker_id in active if self.workers[worker_id][1].value != WORKER_BUSY]
+
+        while (time.monotonic() >= self._spawn_after and len(active) < self.max_workers
+               and (len(available) < self.target_idle or len(active) < self.min_workers)):
+            worker_id = self._spawn()
+            active.append(worker_id)
+            available.append(worker_id)
+
+        # 只回收已预热完成的空闲进程
+        surplus = min(len(available) - self.target_idle, len(active) - self.min_workers)
+        for worker_id in available:
+            if surplus <= 0:
+                break
+            _, state, retire = self.workers[worker_id]
+            if state.value == WORKER_IDLE:
+                retire.set()
+                surplus -= 1
+
+    def run(self):
+        """管理循环，直到收到 SIGINT/SIGTERM"""
+        def request_stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        # fork 前导入重量级模块，子进程只需初始化编解码器
+        preload_modules()
+        logger.info(f"🏊 预热进程池启动: {self.min_workers}-{self.max_workers} 个进程，目标空闲 {self.target_idle}")
+        while not self._stopping:
+            self._rebalance()
+            time.sleep(POOL_CHECK_INTERVAL)
+        self.shutdown()
+
+    def shutdown(self, timeout: float = POOL_SHUTDOWN_TIMEOUT):
+        """通知所有子进程在当前任务结束后退出，超时后强制终止（未完成任务的租约过期后会被重新领取）"""
+        for _, _, retire in self.workers.values():
+            retire.set()
+        deadline = time.monotonic() + timeout
+        for process, _, _ in self.workers.values():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.workers.clear()
+        self._started_at.clear()
+
+
+def main():
+    """工作进程入口"""
+    parser = argparse.ArgumentParser(description="抽帧工作进程")
+    parser.add_argument('--queue', default=os.environ.get('JOB_QUEUE_PATH', os.path.join('frames', 'jobs.db')),
+                        help="队列数据库路径（默认读取 JOB_QUEUE_PATH）")
+    parser.add_argument('--worker-id', help="工作进程标识，默认 主机名-进程号-随机后缀")
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help="租约时长（秒）")
+    parser.add_argument('--max-jobs', type=int, help="处理N个任务后退出（便于定期回收进程）")
+    parser.add_argument('--max-rss-mb', type=float, help="任务结束后RSS超过该值（MB）则退出")
+    parser.add_argument('--pool', action='store_true', help="以预热进程池模式运行")
+    parser.add_argument('--min-workers', type=int, default=1, help="进程池最少进程数")
+    parser.add_argument('--max-workers', type=int, help="进程池最多进程数（默认CPU核心数）")
+    parser.add_argument('--target-idle', type=int, default=1, help="保持的空闲预热进程数")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    if args.pool:
+        WarmWorkerPool(
+            args.queue, min_workers=args.min_workers, max_workers=args.max_workers,
+            target_idle=args.target_idle, lease_seconds=args.lease,
+            max_jobs=args.max_jobs, max_rss_mb=args.max_rss_mb
+        ).run()
+        return 0
+
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    queue = JobQueue(args.queue, lease_seconds=args.lease)
+    logger.info(f"👷 工作进程 {worker_id} 已启动，队列: {queue.db_path}")
+
+    try:
+        run_worker(queue, worker_id, args.lease, args.max_jobs, args.max_rss_mb)
+    except KeyboardInterrupt:
+        # 未完成的任务在租约过期后由其他工作进程接手
+        logger.info("👋 工作进程退出")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())